@@ -39,6 +39,8 @@ class TabHandEye():
         self.r_error = None
         self.t_error = None
         self.X = None
+        # 正在执行的标定实例，用于取消
+        self.active_calib = None
         self.Z = None
         # data mapping
         self.he_calib_method_map = {
@@ -532,33 +534,46 @@ class TabHandEye():
         dlg.Destroy()
 
     def on_click_calibrate(self, evt):
+        results = self.db.retrive_data(
+            self.DB_TABLENAME, f'rootpath, filename', '')
+        images = [f[1] for f in results]
+        # 每张图片外参计算完成推进一格
         dlg = wx.ProgressDialog(
             "Handeye calibration",
             "Calibrating ...",
-            maximum=3,
+            maximum=len(images)+3,
             parent=self.tab,
-            style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE
+            style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT
         )
-        dlg.Update(1, "Calculating ...")
-        results = self.db.retrive_data(
-            self.DB_TABLENAME, f'rootpath, filename', '')
-        images = [f[1] for f in results]
+        dlg.Update(0, "Calculating ...")
         thread = threading.Thread(
             target=self._run_handeye_calibration_task, args=(dlg, images))
         thread.start()
 
     def _run_handeye_calibration_task(self, dlg, images):
+        # 检测进度回调在工作线程中执行，转到UI线程更新
+        def progress_cb(done, total, fname, status):
+            wx.CallAfter(self._handeye_calibration_progress, dlg, done, total, fname)
         if self.m_radioBox_calib_he_type.GetSelection() == 0:
-            ret, r_c2g, t_c2g, r_e, t_e, results = self.do_axxb_calib(images)
+            ret, r_c2g, t_c2g, r_e, t_e, results = self.do_axxb_calib(images, progress_cb)
             wx.CallAfter(self._handeye_calibration_task_done,
                          dlg, (ret, r_c2g, t_c2g, r_e, t_e, results))
         else:
-            ret, r_c2w, t_c2w, r_e, t_e, results = self.do_axxb_calib(images)
+            ret, r_c2w, t_c2w, r_e, t_e, results = self.do_axxb_calib(images, progress_cb)
             wx.CallAfter(self._handeye_calibration_task_done, 
                         dlg, (ret, r_c2w, t_c2w, r_e, t_e, results))
 
+    def _handeye_calibration_progress(self, dlg, done, total, fname):
+        keep_going, _ = dlg.Update(done, f"Estimating board pose {done}/{total}: {fname}")
+        if keep_going is False and self.active_calib is not None:
+            self.active_calib.cancel()
+
     def _handeye_calibration_task_done(self, dlg, data):
         ret, r_c2g, t_c2g, r_e, t_e, results = data
+        if ret is CalibErrType.CAL_CANCELLED:
+            dlg.Destroy()
+            wx.MessageBox(f"Calibration failed:{CalibErrType.to_string(ret)}","Notice",wx.OK | wx.ICON_ERROR)
+            return
         if ret is CalibErrType.CAL_DATA_CSV_FORMAT_ERR:
             dlg.Destroy()
             wx.MessageBox(f"Calibration failed:{CalibErrType.to_string(ret)}","Notice",wx.OK | wx.ICON_ERROR)
@@ -608,10 +623,10 @@ class TabHandEye():
         else:
             self.m_statictext_calib_err_result.SetLabel('')
 
-        dlg.Update(3, "done")
+        dlg.Update(dlg.GetRange(), "done")
         self.m_btn_save.Enable()
 
-    def do_axxb_calib(self, images):
+    def do_axxb_calib(self, images, progress_cb=None):
         a_p = self.m_textctrl_load_a_path.GetLabel()
         b_p = self.m_textctrl_load_b_path.GetLabel()
         c_p = self.m_textctrl_cam_param_path.GetLabel()
@@ -621,6 +636,7 @@ class TabHandEye():
         # ax=xb
         he = HandEye()
         cb = CalibBoard(row_p, col_p, cell_p, use_libcbdet=self.m_checkbox_use_libcbdetect.GetValue())
+        self.active_calib = cb
 
         # 读取传感器rt(NDI/IMU etc.)
         try: 
@@ -646,9 +662,17 @@ class TabHandEye():
         t_b2c = []
         # test map
         if cb.USE_MT is True:
-            results = cb.calculate_img_rt_parallel(b_p, images, mtx, dist)
+            results = cb.calculate_img_rt_parallel(b_p, images, mtx, dist, progress_cb)
         else:
-            results = [cb.calculate_img_rt_mono((b_p, fname, mtx, dist)) for fname in images]
+            results = []
+            for done, fname in enumerate(images, 1):
+                if cb.cancel_event.is_set():
+                    break
+                results.append(cb.calculate_img_rt_mono((b_p, fname, mtx, dist)))
+                if progress_cb is not None:
+                    progress_cb(done, len(images), fname, 'rejected' if results[-1][2] is True else 'calibrated')
+        if cb.cancel_event.is_set():
+            return CalibErrType.CAL_CANCELLED, None, None, None, None, results
         # 判断results里面是否包含(None, None)
         if any(any(item is None for item in tup) for tup in results):
             return CalibErrType.CAL_DATA_SIZE_NOT_MATCH, None, None, None, None, results
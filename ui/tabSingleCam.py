@@ -18,7 +18,7 @@ import pickle
 
 from utils.ophelper import *
 from utils.storage import LocalStorage
-from utils.calib import CalibBoard, quat_2_rot, rot_2_quat
+from utils.calib import CalibBoard, quat_2_rot, rot_2_quat, INTRINSIC_NAMES
 from utils.err import CalibErrType
 from ui.components import * # wx is already imported through components
 
@@ -41,6 +41,20 @@ class TabSingleCam():
         self.mtx = None
         self.dist = None
         self.rpjerr = None
+        # opencv 内参标准差及重采样得到的置信区间，随结果一起保存
+        self.std_intrinsics = None
+        self.uncertainty = None
+        # 畸变模型比较结果(pandas.DataFrame)，未做模型选择时为 None
+        self.model_table = None
+        # 上一次标定的每张图位姿及标定板参数，用于增量重标定
+        self.view_poses = None
+        self.view_corners = None
+        self.warm_board = None
+        self.warm_start = False
+        # 文件名到目录条目的映射，用于检测过程中逐张更新
+        self.tree_items = {}
+        # 正在执行的标定实例，用于取消
+        self.active_calib = None
         # checkerboard's pattern
         self.checkerboard_row_cell = 0
         self.checkerboard_col_cell = 0
@@ -145,6 +159,30 @@ class TabSingleCam():
         # add use libcbdetect 
         self.m_checkbox_use_libcbdetect = wx.CheckBox(self.tab, wx.ID_ANY, label="Use Libcbdetect")
         self.checkerpattern_h_sizer.Add(self.m_checkbox_use_libcbdetect, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 检测前预筛模糊/过曝/无标定板的图片
+        self.m_checkbox_prescreen = wx.CheckBox(self.tab, wx.ID_ANY, label="Pre-screen images")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_prescreen, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 缓存角点检测结果，重复标定同一组图片时跳过检测
+        self.m_checkbox_cache = wx.CheckBox(self.tab, wx.ID_ANY, label="Cache corners")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_cache, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 高分辨率图片先在缩小图上检测，再回到原图细化
+        self.m_checkbox_pyramid = wx.CheckBox(self.tab, wx.ID_ANY, label="Pyramid detection")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_pyramid, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 合并视频中相邻的近似重复帧
+        self.m_checkbox_dedup = wx.CheckBox(self.tab, wx.ID_ANY, label="Drop duplicate frames")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_dedup, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 使用光束法平差求解(视角很多时更快)
+        self.m_checkbox_bundle = wx.CheckBox(self.tab, wx.ID_ANY, label="Bundle adjustment")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_bundle, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 交叉验证比较多种畸变模型，选择留出误差最小的模型
+        self.m_checkbox_select_model = wx.CheckBox(self.tab, wx.ID_ANY, label="Select distortion model")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_select_model, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # bootstrap 重采样估计内参的置信区间
+        self.m_checkbox_uncertainty = wx.CheckBox(self.tab, wx.ID_ANY, label="Estimate uncertainty")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_uncertainty, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
+        # 自动剔除离群视角和角点，剔除记录写入 trim_audit 表
+        self.m_checkbox_auto_trim = wx.CheckBox(self.tab, wx.ID_ANY, label="Auto trim outliers")
+        self.checkerpattern_h_sizer.Add(self.m_checkbox_auto_trim, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, pattern_border)
         
         sizer.Add(self.checkerpattern_h_sizer, 1, wx.ALL, 5)
 
@@ -193,15 +231,16 @@ class TabSingleCam():
         # create a single camera calib table
         '''
         use quaternion and position to represent rotation and translation
-        |id integer|rootpath text|filename text|isreject bool|qw float |qx float  |qy float  |qz float  |tx float|ty float| tz float|  rpje| cors blob |
-        |----------|-------------|-------------|-------------|---------|----------|----------|----------|--------|--------|---------|------|-----------|
-        |    0     |c:\data\     |    img1.png |  False      |0.1085443|-0.2130855|-0.9618053|-0.1332042| -44.071| 272.898|-1388.602|0.1826|array bytes|
-        |    1     |c:\data\     |    img2.png |  True       |         |          |          |          |        |        |         |      |           |
+        |id integer|rootpath text|filename text|isreject bool|rejreason text|qw float |qx float  |qy float  |qz float  |tx float|ty float| tz float|  rpje| cors blob |
+        |----------|-------------|-------------|-------------|--------------|---------|----------|----------|----------|--------|--------|---------|------|-----------|
+        |    0     |c:\data\     |    img1.png |  False      |              |0.1085443|-0.2130855|-0.9618053|-0.1332042| -44.071| 272.898|-1388.602|0.1826|array bytes|
+        |    1     |c:\data\     |    img2.png |  True       |blurry        |         |          |          |          |        |        |         |      |           |
         '''
         TABLE_SQL_STR = '''id INTEGER PRIMARY KEY AUTOINCREMENT, 
                             rootpath text,
                             filename text, 
                             isreject bool, 
+                            rejreason text,
                             qw float, 
                             qx float, 
                             qy float, 
@@ -218,8 +257,26 @@ class TabSingleCam():
         if ret is not True:
             logger.debug(f'create db table {self.DB_TABLENAME} failed')
             return None
-        else:
-            return db
+        # 自动剔除的记录, kind: 'view' 整张图片 / 'corner' 单个角点(corner 为角点序号)
+        '''
+        |id integer|filename text|round int|kind text|corner int|error float|threshold float|
+        |----------|-------------|---------|---------|----------|-----------|---------------|
+        |    0     |    img3.png |    1    |view     |          |4.7612     |1.0            |
+        |    1     |    img5.png |    1    |corner   |10        |15.0331    |1.5            |
+        '''
+        AUDIT_SQL_STR = '''id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            filename text,
+                            round int,
+                            kind text,
+                            corner int,
+                            error float,
+                            threshold float'''
+        self.DB_AUDIT_TABLENAME = 'trim_audit'
+        ret = db.create_table(self.DB_AUDIT_TABLENAME, AUDIT_SQL_STR)
+        if ret is not True:
+            logger.debug(f'create db table {self.DB_AUDIT_TABLENAME} failed')
+            return None
+        return db
 
     def _register_all_callbacks(self):
         self.tab.Bind(wx.EVT_BUTTON, self.on_select_file_path,
@@ -279,10 +336,12 @@ class TabSingleCam():
         max_high_count = 0
 
         dirroot = tree.AddRoot('Filename: (Reprojection Error)', image=0)
+        self.tree_items = {}
         if len(filelist) > 0:
             for fname, r in zip(filelist, rpjes):
                 newItem = tree.AppendItem(
                     dirroot, f'{fname}:({str(r)})', data=[fname, r])
+                self.tree_items[fname] = newItem
                 if max_err is not None:
                     if max_err == r and max_high_count < 1:
                         max_high_count += 1
@@ -374,7 +433,9 @@ class TabSingleCam():
     def on_recalib(self, evt):
         # set selected image to be rejected in db
         self.db.modify_data(self.DB_TABLENAME,
-                            f'''SET isreject=1 WHERE filename=\'{self._temp_right_menu_data}\' ''')
+                            f'''SET isreject=1, rejreason='manual' WHERE filename=\'{self._temp_right_menu_data}\' ''')
+        # 以上一次的结果为初值重新标定
+        self.warm_start = True
         right_click_evt = wx.CommandEvent(
             wx.EVT_BUTTON.typeId, self.m_calibrate_btn.GetId())
         self.m_calibrate_btn.GetEventHandler().ProcessEvent(right_click_evt)
@@ -389,6 +450,9 @@ class TabSingleCam():
             self.m_calibrate_btn.Enable(False)
             self.m_save_calibration_btn.Enable(False)
             self.m_show_pts_dist_btn.Enable(False)
+            self.view_poses = None
+            self.view_corners = None
+            self.warm_board = None
         else:
             return
         dir_dialog.Destroy()
@@ -416,11 +480,12 @@ class TabSingleCam():
                                 style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
         # 删除旧记录
         self.db.delete_data(self.DB_TABLENAME, f'WHERE 1=1')
+        self.db.delete_data(self.DB_AUDIT_TABLENAME, f'WHERE 1=1')
         # 写入新纪录
         for item in images:
             count += 1
             self.db.write_data(
-                self.DB_TABLENAME, f'null, \'{self.current_root_dir}\', \'{item}\', 0, null, null, null, null, null, null, null, null, null')
+                self.DB_TABLENAME, f'null, \'{self.current_root_dir}\', \'{item}\', 0, null, null, null, null, null, null, null, null, null, null')
             (keep_going, skip) = dlg.Update(count, f'added {count} images')
         # wx.Sleep(1)
         dlg.Destroy()
@@ -451,8 +516,9 @@ class TabSingleCam():
             else:
                 cellsize = float(self.m_textCtrl_cellsize.GetValue())
 
+            # 每张图片检测完成推进一格，最后3格为求解和保存
             dlg = wx.ProgressDialog(
-                "Calibration", "Calibrating ...", maximum=3, parent=self.tab, style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
+                "Calibration", "Calibrating ...", maximum=len(filelist)+3, parent=self.tab, style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT)
             dlg.Update(0, "Calculating ...")
             thread = threading.Thread(target=self._run_camera_calibration_task, args=(
                 row, col, cellsize, results, filelist, dlg))
@@ -489,12 +555,22 @@ class TabSingleCam():
             'Scheme': 'opencv',
             'ImageShape':[self.image_shape[0], self.image_shape[1]],
             'CameraParameters': {
-                'RadialDistortion': [dist.tolist()[0][0], dist.tolist()[0][1], dist.tolist()[0][-1]],
+                'RadialDistortion': [dist.tolist()[0][0], dist.tolist()[0][1], dist.tolist()[0][4]],
                 'TangentialDistortion': [dist.tolist()[0][2], dist.tolist()[0][3]],
                 'IntrinsicMatrix': mtx.tolist()
             },
             'ReprojectionError': self.rpjerr
         }
+        # rational/thin prism/tilted 模型保存全部畸变系数
+        if dist.size > 5:
+            paramJsonStr['CameraParameters']['DistortionCoefficients'] = dist.ravel().tolist()
+        if self.std_intrinsics is not None:
+            paramJsonStr['StandardDeviations'] = {
+                name: float(v) for name, v in zip(INTRINSIC_NAMES[:4+dist.size], np.ravel(self.std_intrinsics))}
+        if self.uncertainty is not None:
+            paramJsonStr['Uncertainty'] = self.uncertainty
+        if self.model_table is not None:
+            paramJsonStr['DistortionModelSelection'] = self.model_table.to_dict('records')
         with open(f'{filename}', 'w') as f:
             json.dump(paramJsonStr, f, indent=4)
         pass
@@ -502,11 +578,30 @@ class TabSingleCam():
     # 相机校准线程
     def _run_camera_calibration_task(self, row, col, cellsize, results, filelist, dlg):
         # 创建单目校准类
-        calib = CalibBoard(row, col, cellsize, use_libcbdet=self.m_checkbox_use_libcbdetect.GetValue())
-        CALIB = calib.mono_calib_parallel if calib.USE_MT is True else calib.mono_calib
+        calib = CalibBoard(row, col, cellsize, use_libcbdet=self.m_checkbox_use_libcbdetect.GetValue(),
+                           prescreen=self.m_checkbox_prescreen.GetValue(), use_cache=self.m_checkbox_cache.GetValue(),
+                           pyramid=self.m_checkbox_pyramid.GetValue())
+        calib.dedup = self.m_checkbox_dedup.GetValue()
+        calib.engine = 'bundle' if self.m_checkbox_bundle.GetValue() else 'opencv'
+        calib.select_model = self.m_checkbox_select_model.GetValue()
+        calib.uncertainty = 'bootstrap' if self.m_checkbox_uncertainty.GetValue() else None
+        calib.auto_trim = self.m_checkbox_auto_trim.GetValue()
+        self.active_calib = calib
+        board = (row, col, cellsize, calib.use_libcbdet)
+        warm = self.warm_start is True and self.mtx is not None and self.warm_board == board
+        self.warm_start = False
+        # 检测进度回调在工作线程中执行，转到UI线程更新
+        def progress_cb(done, total, fname, status):
+            wx.CallAfter(self._camera_calibration_progress, dlg, done, total, fname, status)
         # 执行校准，并得到结果
-        ret, mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, shape, pts, err = CALIB(
-            results[0][0], filelist)
+        if warm is True:
+            ret, mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, shape, pts, err = calib.mono_calib_incremental(
+                results[0][0], filelist, self.mtx, self.dist, self.view_poses, progress_cb=progress_cb,
+                prev_corners=self.view_corners, shape=self.image_shape)
+        else:
+            CALIB = calib.mono_calib_parallel if calib.USE_MT is True else calib.mono_calib
+            ret, mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, shape, pts, err = CALIB(
+                results[0][0], filelist, progress_cb=progress_cb)
         
         # 检查ret是否为false
         if ret is False:
@@ -514,25 +609,38 @@ class TabSingleCam():
                          mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, err, None, None)
             return
         self.image_shape = shape
+        self.calib_board = board
         # draw all pts for double check
-        ## calculate rpj
-        RPJS=[]
-        for i in range(len(rvecs)):
-            rpjs, _ = cv2.projectPoints(calib.objp, np.asarray(rvecs[i]).reshape(-1,3), np.asarray(tvecs[i]).reshape(-1,3), mtx, dist)
-            RPJS.append(rpjs)
-        RPJS = np.asarray(RPJS).reshape(-1,2)
+        ## calculate rpj, (N,P,2) for all views
+        RPJS, residuals, _, _ = calib.reproject_views(pts, rvecs, tvecs, mtx, dist)
+        pts = np.asarray(pts).reshape(RPJS.shape)
+        # 自动剔除的角点不参与求解，误差和误差箭头只统计参与求解的角点
+        used = calib.used_corners(RPJS.shape[:2])
+        rpjes = calib.used_view_rms(residuals)
 
         img_for_dist_check = np.zeros((shape[1], shape[0], 3), dtype=np.uint8)
-        pts = np.asarray(pts).reshape(-1,2)
-        calib.draw_arrows(img_for_dist_check, pts, RPJS)
+        calib.draw_arrows(img_for_dist_check, pts[used], RPJS[used])
         #calib.draw_corners(img_for_dist_check, pts, False)
         self.monocheck = img_for_dist_check
 
         wx.CallAfter(self._camera_calibration_task_done, dlg, ret,
                      mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, err, pts, RPJS)
 
+    # 单张图片角点检测完成，无法检测到角点的图片立即在列表中标记
+    def _camera_calibration_progress(self, dlg, done, total, fname, status):
+        keep_going, _ = dlg.Update(done, f"Detecting corners {done}/{total}: {fname}")
+        if keep_going is False:
+            self.active_calib.cancel()
+        # 取消后剩余图片并非检测失败，不做标记
+        if status == 'rejected' and not self.active_calib.cancel_event.is_set():
+            self._set_rejected_flags([fname], self.active_calib.reject_reasons)
+            item = self.tree_items.get(fname)
+            if item is not None and item.IsOk():
+                self.m_treeCtl_images.SetItemImage(item, self.icon_q)
+
     def _camera_calibration_task_done(self, dlg, ret, mtx, dist, rvecs, tvecs, rpjes, rej_list, cal_list, err, pts, RPJS):
-        dlg.Update(1, "Finished")
+        base = dlg.GetRange() - 3
+        dlg.Update(base+1, "Finished")
         if ret is False:
             dlg.Destroy()
             # 使用wxpython创建一个msg box，并提示用户"标定失败"
@@ -544,10 +652,18 @@ class TabSingleCam():
         self.rpjerr = ret
         self.mtx = mtx
         self.dist = dist
+        self.std_intrinsics = self.active_calib.std_intrinsics
+        self.uncertainty = self.active_calib.uncertainty_report
+        self.model_table = self.active_calib.model_table
+        self.view_poses = dict(zip(cal_list, zip(rvecs, tvecs)))
+        # 重新标定时沿用这些角点，不再重复检测
+        self.view_corners = dict(zip(cal_list, pts))
+        self.warm_board = self.calib_board
         # update the database
-        dlg.Update(2, "Updating information of files with failed calibration...")
-        self._set_rejected_flags(rej_list)
-        dlg.Update(3, "Saving calibration results to the database...")
+        dlg.Update(base+2, "Updating information of files with failed calibration...")
+        self._set_rejected_flags(rej_list, self.active_calib.reject_reasons)
+        self._save_trim_audit(self.active_calib.trim_log)
+        dlg.Update(base+3, "Saving calibration results to the database...")
         self._save_each_image_rt_rpje(rvecs, tvecs, rpjes, cal_list, pts, RPJS)
         wx.Sleep(1)
         dlg.Destroy()
@@ -556,21 +672,32 @@ class TabSingleCam():
         # enalbe save
         self.m_save_calibration_btn.Enable(True)
         self.m_show_pts_dist_btn.Enable(True)
+        if self.model_table is not None:
+            self._show_model_table(self.active_calib.dist_model)
+
+    # 显示畸变模型比较结果
+    def _show_model_table(self, model: str):
+        table = self.model_table.to_string(index=False, float_format='{:.4f}'.format)
+        wx.MessageBox(f"Selected distortion model: {model}\n\n{table}", "Distortion model selection", wx.OK | wx.ICON_INFORMATION)
 
-    # 把无法找到角点的图片列表写入数据库
-    def _set_rejected_flags(self, filelist):
+    # 把无法找到角点的图片列表及拒绝原因写入数据库
+    def _set_rejected_flags(self, filelist, reasons: dict = None):
+        reasons = reasons or {}
         for f in filelist:
             self.db.modify_data(self.DB_TABLENAME,
-                                f'''SET isreject=1 WHERE filename=\'{f}\' ''')
+                                f'''SET isreject=1, rejreason=\'{reasons.get(f, 'no corners')}\' WHERE filename=\'{f}\' ''')
+
+    # 把自动剔除的视角和角点写入数据库
+    def _save_trim_audit(self, trim_log: list):
+        for rnd, kind, f, corner, error, threshold in trim_log:
+            self.db.write_data(self.DB_AUDIT_TABLENAME,
+                               f'''null, \'{f}\', {rnd}, \'{kind}\', {'null' if corner is None else corner}, {error}, {threshold}''')
 
     # 把标定结果写入数据库
     def _save_each_image_rt_rpje(self, rvecs, tvecs, rpjes, filelist, pts, RPJS):
         if len(rvecs) == len(filelist):
-            # devide pts/RPJS into each image by len(filelist)
-            pts_split = np.split(pts, len(filelist))
-            RPJS_split = np.split(RPJS, len(filelist))
-
-            for f, rv, tv, rpje, _pts, _RPJS in zip(filelist, rvecs, tvecs, rpjes, pts_split, RPJS_split):
+            # pts/RPJS: (N,P,2)，逐个视角保存
+            for f, rv, tv, rpje, _pts, _RPJS in zip(filelist, rvecs, tvecs, rpjes, pts, RPJS):
                 # convert rt vecs into quat
                 R, _ = cv2.Rodrigues(rv)
                 q = rot_2_quat(R)
@@ -578,7 +705,7 @@ class TabSingleCam():
                 # cors to blob
                 cors_bytes = pickle.dumps(_pts)
                 self.db.modify_data(
-                    self.DB_TABLENAME, f'''SET isreject=0, 
+                    self.DB_TABLENAME, f'''SET isreject=0, rejreason=null, 
                                         qw={float(q[0])}, 
                                         qx={float(q[1])},
                                         qy={float(q[2])},
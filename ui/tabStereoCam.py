@@ -50,7 +50,18 @@ class TabStereoCam():
         self.R = None
         self.T = None
         self.F = None
+        # 畸变模型比较结果(pandas.DataFrame)，未做模型选择时为 None
+        self.model_table = None
         self.E = None
+        # 上一次标定的标定板参数，用于增量重标定
+        self.warm_board = None
+        self.warm_start = False
+        # 上一次标定的角点 {(左图, 右图): (左角点, 右角点)}，重新标定时不再重复检测
+        self.view_corners = None
+        # 左图文件名到目录条目的映射，用于检测过程中逐对更新
+        self.tree_items = {}
+        # 正在执行的标定实例，用于取消
+        self.active_calib = None
         # init ui
         sizer = wx.BoxSizer(wx.VERTICAL)
         self.tab.SetSizer(sizer)
@@ -125,6 +136,27 @@ class TabStereoCam():
         # add use libcbdetect
         self.m_checkbox_use_libcbdetect = wx.CheckBox(self.tab, wx.ID_ANY, u"Use Libcbdetect")
         m_layout_actions_btns.Add(self.m_checkbox_use_libcbdetect, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 检测前预筛模糊/过曝/无标定板的图片
+        self.m_checkbox_prescreen = wx.CheckBox(self.tab, wx.ID_ANY, u"Pre-screen images")
+        m_layout_actions_btns.Add(self.m_checkbox_prescreen, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 缓存角点检测结果，重复标定同一组图片时跳过检测
+        self.m_checkbox_cache = wx.CheckBox(self.tab, wx.ID_ANY, u"Cache corners")
+        m_layout_actions_btns.Add(self.m_checkbox_cache, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 高分辨率图片先在缩小图上检测，再回到原图细化
+        self.m_checkbox_pyramid = wx.CheckBox(self.tab, wx.ID_ANY, u"Pyramid detection")
+        m_layout_actions_btns.Add(self.m_checkbox_pyramid, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 合并视频中相邻的近似重复帧
+        self.m_checkbox_dedup = wx.CheckBox(self.tab, wx.ID_ANY, u"Drop duplicate frames")
+        m_layout_actions_btns.Add(self.m_checkbox_dedup, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 使用光束法平差求解，同时优化两个相机的内参
+        self.m_checkbox_bundle = wx.CheckBox(self.tab, wx.ID_ANY, u"Bundle adjustment")
+        m_layout_actions_btns.Add(self.m_checkbox_bundle, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 交叉验证比较多种畸变模型，选择留出误差最小的模型
+        self.m_checkbox_select_model = wx.CheckBox(self.tab, wx.ID_ANY, u"Select distortion model")
+        m_layout_actions_btns.Add(self.m_checkbox_select_model, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
+        # 自动剔除离群图片对和角点，剔除记录写入 trim_audit 表
+        self.m_checkbox_auto_trim = wx.CheckBox(self.tab, wx.ID_ANY, u"Auto trim outliers")
+        m_layout_actions_btns.Add(self.m_checkbox_auto_trim, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 0)
         return m_layout_actions_btns
 
     def _create_main_view_layout(self, bitmapsize: wx.Size):
@@ -190,16 +222,17 @@ class TabStereoCam():
         # create a stereo camera calib table
         '''
         use quaternion and position to represent rotation and translation
-        |id integer|rootpath text|cameraid int|filename text|isreject bool|qw float |qx float  |qy float  |qz float  |tx float|ty float| tz float|  rpje| cors blob|
-        |----------|-------------|------------|-------------|-------------|---------|----------|----------|----------|--------|--------|---------|------|----------|
-        |    0     |c:\data\L    |0           |    img1.png |  False      |0.1085443|-0.2130855|-0.9618053|-0.1332042| -44.071| 272.898|-1388.602|0.1826|byte array|
-        |    1     |c:\data\R    |1           |    img1.png |  True       |         |          |          |          |        |        |         |      |          |
+        |id integer|rootpath text|cameraid int|filename text|isreject bool|rejreason text|qw float |qx float  |qy float  |qz float  |tx float|ty float| tz float|  rpje| cors blob|
+        |----------|-------------|------------|-------------|-------------|--------------|---------|----------|----------|----------|--------|--------|---------|------|----------|
+        |    0     |c:\data\L    |0           |    img1.png |  False      |              |0.1085443|-0.2130855|-0.9618053|-0.1332042| -44.071| 272.898|-1388.602|0.1826|byte array|
+        |    1     |c:\data\R    |1           |    img1.png |  True       |right: blurry |         |          |          |          |        |        |         |      |          |
         '''
         TABLE_SQL_STR = '''id INTEGER PRIMARY KEY AUTOINCREMENT, 
                             rootpath text,
                             cameraid int,
                             filename text, 
                             isreject bool, 
+                            rejreason text,
                             qw float, 
                             qx float, 
                             qy float, 
@@ -216,8 +249,28 @@ class TabStereoCam():
         if ret is not True:
             logger.debug(f'create db table {self.DB_TABLENAME} failed')
             return None
-        else:
-            return db
+        # 自动剔除的记录，左右图各一行; kind: 'view' 整对图片 / 'corner' 单个角点(左右图一起剔除)
+        # error 为左右误差的较大值
+        '''
+        |id integer|cameraid int|filename text|round int|kind text|corner int|error float|threshold float|
+        |----------|------------|-------------|---------|---------|----------|-----------|---------------|
+        |    0     |0           |    img3.png |    1    |view     |          |4.7612     |1.0            |
+        |    1     |1           |    img3.png |    1    |view     |          |4.7612     |1.0            |
+        '''
+        AUDIT_SQL_STR = '''id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            cameraid int,
+                            filename text,
+                            round int,
+                            kind text,
+                            corner int,
+                            error float,
+                            threshold float'''
+        self.DB_AUDIT_TABLENAME = 'trim_audit'
+        ret = db.create_table(self.DB_AUDIT_TABLENAME, AUDIT_SQL_STR)
+        if ret is not True:
+            logger.debug(f'create db table {self.DB_AUDIT_TABLENAME} failed')
+            return None
+        return db
 
     # 左侧树形目录显示每张标定结果的控件
     def create_treectrl(self):
@@ -263,10 +316,12 @@ class TabStereoCam():
         max_high_count = 0
 
         dirroot = tree.AddRoot('Filename: (Left/Right Reprojection Error)', image=0)
+        self.tree_items = {}
         if len(left_filelist) > 0:
             for lfname, lr, rfname, rr in zip(left_filelist, left_rpjes, right_filelist, right_rpjes):
                 newItem = tree.AppendItem(
                     dirroot, f'{lfname},{rfname}:({str(lr)},{str(rr)})', data=[lfname, rfname])
+                self.tree_items[lfname] = newItem
                 if left_max_err is not None and right_max_err is not None:
                     if (left_max_err == lr or right_max_err == rr) and max_high_count < 2:
                         max_high_count += 1
@@ -340,9 +395,11 @@ class TabStereoCam():
     # popup menu
     def on_recalib(self, evt):
         self.db.modify_data(self.DB_TABLENAME,
-                            f'''SET isreject=1 WHERE filename=\'{self._temp_right_menu_data[0]}\' ''')
+                            f'''SET isreject=1, rejreason='manual' WHERE filename=\'{self._temp_right_menu_data[0]}\' ''')
         self.db.modify_data(self.DB_TABLENAME,
-                            f'''SET isreject=1 WHERE filename=\'{self._temp_right_menu_data[1]}\' ''')
+                            f'''SET isreject=1, rejreason='manual' WHERE filename=\'{self._temp_right_menu_data[1]}\' ''')
+        # 以上一次的结果为初值重新标定
+        self.warm_start = True
         right_click_evt = wx.CommandEvent(
             wx.EVT_BUTTON.typeId, self.m_btn_calibrate.GetId())
         self.m_btn_calibrate.GetEventHandler().ProcessEvent(right_click_evt)
@@ -350,20 +407,24 @@ class TabStereoCam():
     def on_open_file_loader(self, evt):
         dlg_file_loader = self._init_checkerboard_loader(None, self)
         dlg_file_loader.ShowModal()
+        self.warm_board = None
+        self.view_corners = None
         self.m_textctl_left_path.SetValue(self.current_leftroot)
         self.m_textctl_right_path.SetValue(self.current_rightroot)
 
     def on_click_calibrate(self, evt):
         sqlresult = self.db.retrive_data(
             self.DB_TABLENAME, f'rootpath, cameraid, filename', f'WHERE isreject=0')
+        # 每对图片检测完成推进一格，最后3格为求解和保存
+        npairs = len([f for f in sqlresult if f[1] == 0])
         dlg = wx.ProgressDialog(
             "Calibration",
             "Calibrating ...",
-            maximum=3,
+            maximum=npairs+3,
             parent=self.tab,
-            style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE
+            style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE | wx.PD_CAN_ABORT
         )
-        dlg.Update(1, "Calculating")
+        dlg.Update(0, "Calculating")
         thread = threading.Thread(target=self._run_camera_calibration_task,
                                   args=(dlg, sqlresult))
         thread.start()
@@ -400,12 +461,12 @@ class TabStereoCam():
             'Scheme': 'opencv',
             'ImageShape':[self.image_shape[0], self.image_shape[1]],
             'CameraParameters1': {
-                'RadialDistortion': [dc1.tolist()[0][0], dc1.tolist()[0][1], dc1.tolist()[0][-1]],
+                'RadialDistortion': [dc1.tolist()[0][0], dc1.tolist()[0][1], dc1.tolist()[0][4]],
                 'TangentialDistortion': [dc1.tolist()[0][2], dc1.tolist()[0][3]],
                 'IntrinsicMatrix': cm1.tolist()
             },
             'CameraParameters2': {
-                'RadialDistortion': [dc2.tolist()[0][0], dc2.tolist()[0][1], dc2.tolist()[0][-1]],
+                'RadialDistortion': [dc2.tolist()[0][0], dc2.tolist()[0][1], dc2.tolist()[0][4]],
                 'TangentialDistortion': [dc2.tolist()[0][2], dc2.tolist()[0][3]],
                 'IntrinsicMatrix': cm2.tolist()
             },
@@ -414,6 +475,12 @@ class TabStereoCam():
             'FundamentalMatrix': f.tolist(),
             'EssentialMatrix': e.tolist()
         }
+        # rational/thin prism/tilted 模型保存全部畸变系数
+        for name, dc in (('CameraParameters1', dc1), ('CameraParameters2', dc2)):
+            if dc.size > 5:
+                paramJsonStr[name]['DistortionCoefficients'] = dc.ravel().tolist()
+        if self.model_table is not None:
+            paramJsonStr['DistortionModelSelection'] = self.model_table.to_dict('records')
         with open(f'{filename}', 'w') as f:
             json.dump(paramJsonStr, f, indent=4)
 
@@ -430,38 +497,79 @@ class TabStereoCam():
         lfilelist = [f[2] for f in left_file_list]
         rfilelist = [f[2] for f in right_file_list]
 
-        calib = CalibBoard(row, col, cellsize, use_libcbdet=self.m_checkbox_use_libcbdetect.GetValue())
-        CALIB = calib.stereo_calib_parallel if calib.USE_MT is True else calib.stereo_calib
-
-        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rej_list, calib_list, shape, lpts, rpts, err = CALIB(
-            left_file_list[0][0], right_file_list[0][0], lfilelist, rfilelist)
+        calib = CalibBoard(row, col, cellsize, use_libcbdet=self.m_checkbox_use_libcbdetect.GetValue(),
+                           prescreen=self.m_checkbox_prescreen.GetValue(), use_cache=self.m_checkbox_cache.GetValue(),
+                           pyramid=self.m_checkbox_pyramid.GetValue())
+        calib.dedup = self.m_checkbox_dedup.GetValue()
+        calib.engine = 'bundle' if self.m_checkbox_bundle.GetValue() else 'opencv'
+        calib.select_model = self.m_checkbox_select_model.GetValue()
+        calib.auto_trim = self.m_checkbox_auto_trim.GetValue()
+        self.active_calib = calib
+        board = (row, col, cellsize, calib.use_libcbdet)
+        warm = self.warm_start is True and self.mtx1 is not None and self.warm_board == board
+        self.warm_start = False
+
+        # 检测进度回调在工作线程中执行，转到UI线程更新
+        def progress_cb(done, total, fnames, status):
+            wx.CallAfter(self._camera_calibration_progress, dlg, done, total, fnames, status)
+
+        if warm is True:
+            ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rej_list, calib_list, shape, lpts, rpts, err = calib.stereo_calib_incremental(
+                left_file_list[0][0], right_file_list[0][0], lfilelist, rfilelist,
+                self.mtx1, self.dist1, self.mtx2, self.dist2, self.R, self.T, progress_cb=progress_cb,
+                prev_corners=self.view_corners, shape=self.image_shape)
+        else:
+            CALIB = calib.stereo_calib_parallel if calib.USE_MT is True else calib.stereo_calib
+            ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rej_list, calib_list, shape, lpts, rpts, err = CALIB(
+                left_file_list[0][0], right_file_list[0][0], lfilelist, rfilelist, progress_cb=progress_cb)
 
         # 检查ret是否为false
         if ret is False:
-            dlg.Update(2, "Calibration Failed")
+            wx.CallAfter(dlg.Update, dlg.GetRange()-1, "Calibration Failed")
             wx.CallAfter(self._camera_calibration_task_done, dlg, (ret, mtx_l0, dist_l0,
                      mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rej_list, calib_list, err, None, None))
             return
 
         self.image_shape = shape
+        self.calib_board = board
         # draw all pts for double check
         img_for_dist_check = np.zeros((shape[1], shape[0], 3), dtype=np.uint8)
-        lpts = np.asarray(lpts).reshape(-1,2)
-        rpts = np.asarray(rpts).reshape(-1,2)
+        # calculate rpj, (N,P,2) for all views
+        RPJS, residuals, _, _ = calib.reproject_views(lpts, rvecs, tvecs, mtx_l0, dist_l0)
+        lpts = np.asarray(lpts).reshape(RPJS.shape)
+        rpts = np.asarray(rpts).reshape(RPJS.shape)
+        # 自动剔除的角点不参与求解，误差和误差箭头只统计参与求解的角点(左右图剔除同一组角点)
+        used = calib.used_corners(RPJS.shape[:2])
+        if calib.trim_mask is not None:
+            # 右相机位姿 = R * 左相机位姿 + T
+            rvec_lr, _ = cv2.Rodrigues(np.asarray(R, np.float64))
+            poses_r = [cv2.composeRT(np.asarray(rv, np.float64), np.asarray(tv, np.float64), rvec_lr,
+                                     np.asarray(T, np.float64).reshape(3, 1))[:2] for rv, tv in zip(rvecs, tvecs)]
+            _, residuals_r, _, _ = calib.reproject_views(
+                rpts, [p[0] for p in poses_r], [p[1] for p in poses_r], mtx_r0, dist_r0)
+            pererr = np.stack((calib.used_view_rms(residuals), calib.used_view_rms(residuals_r)), axis=1)
         #calib.draw_corners(img_for_dist_check, pts, False)
-        RPJS=[]
-        for i in range(len(rvecs)):
-            rpjs, _ = cv2.projectPoints(calib.objp, np.asarray(rvecs[i]).reshape(-1,3), np.asarray(tvecs[i]).reshape(-1,3), mtx_l0, dist_l0)
-            RPJS.append(rpjs)
-        RPJS = np.asarray(RPJS).reshape(-1,2)
-        calib.draw_arrows(img_for_dist_check,lpts, RPJS)
+        calib.draw_arrows(img_for_dist_check, lpts[used], RPJS[used])
         self.stereocheck = img_for_dist_check
 
         wx.CallAfter(self._camera_calibration_task_done, dlg, (ret, mtx_l0, dist_l0,
                      mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rej_list, calib_list, err, lpts, rpts))
 
+    # 一对图片角点检测完成，无法检测到角点的图片对立即在列表中标记
+    def _camera_calibration_progress(self, dlg, done, total, fnames, status):
+        keep_going, _ = dlg.Update(done, f"Detecting corners {done}/{total}: {fnames[0]},{fnames[1]}")
+        if keep_going is False:
+            self.active_calib.cancel()
+        # 取消后剩余图片并非检测失败，不做标记
+        if status == 'rejected' and not self.active_calib.cancel_event.is_set():
+            self._set_rejected_flags([fnames], self.active_calib.reject_reasons)
+            item = self.tree_items.get(fnames[0])
+            if item is not None and item.IsOk():
+                self.m_treectrl.SetItemImage(item, self.icon_q)
+
     def _camera_calibration_task_done(self, dlg, data: tuple):
-        dlg.Update(2, "Finished")
+        base = dlg.GetRange() - 3
+        dlg.Update(base+2, "Finished")
         if data[0] is False:
             dlg.Destroy()
             wx.Sleep(1)
@@ -479,6 +587,8 @@ class TabStereoCam():
         self.T = data[6]
         self.E = data[7]
         self.F = data[8]
+        self.warm_board = self.calib_board
+        self.model_table = self.active_calib.model_table
         rvecs = data[9]
         tvecs = data[10]
         pererr = data[11]
@@ -487,20 +597,38 @@ class TabStereoCam():
         errtype = data[14]
         lpts = data[15]
         rpts = data[16]
-        dlg.Update(3, "Save calibration results to the database ...")
-        self._set_rejected_flags(rej_list)
+        self.view_corners = {tuple(pair): (lc, rc) for pair, lc, rc in zip(calib_list, lpts, rpts)}
+        dlg.Update(base+3, "Save calibration results to the database ...")
+        self._set_rejected_flags(rej_list, self.active_calib.reject_reasons)
+        self._save_trim_audit(self.active_calib.trim_log)
         self._save_each_image_rt_rpje((rvecs, tvecs, pererr, calib_list, lpts, rpts))
         dlg.Destroy()
         self.update_treectrl()
         self.m_btn_save_calibration.Enable()
         self.m_btn_show_pts_dist.Enable()
+        if self.model_table is not None:
+            self._show_model_table(self.active_calib.dist_model)
 
-    def _set_rejected_flags(self, rejlist: list):
+    # 显示畸变模型比较结果
+    def _show_model_table(self, model: str):
+        table = self.model_table.to_string(index=False, float_format='{:.4f}'.format)
+        wx.MessageBox(f"Selected distortion model: {model}\n\n{table}", "Distortion model selection", wx.OK | wx.ICON_INFORMATION)
+
+    def _set_rejected_flags(self, rejlist: list, reasons: dict = None):
+        reasons = reasons or {}
         for f in rejlist:
+            reason = reasons.get(tuple(f), 'no corners')
             self.db.modify_data(self.DB_TABLENAME,
-                                f'''SET isreject=1 WHERE filename=\'{f[0]}\' ''')
+                                f'''SET isreject=1, rejreason=\'{reason}\' WHERE filename=\'{f[0]}\' ''')
             self.db.modify_data(self.DB_TABLENAME,
-                                f'''SET isreject=1 WHERE filename=\'{f[1]}\' ''')
+                                f'''SET isreject=1, rejreason=\'{reason}\' WHERE filename=\'{f[1]}\' ''')
+
+    # 把自动剔除的图片对和角点写入数据库
+    def _save_trim_audit(self, trim_log: list):
+        for rnd, kind, f, corner, error, threshold in trim_log:
+            for cameraid, fname in enumerate(f):
+                self.db.write_data(self.DB_AUDIT_TABLENAME,
+                                   f'''null, {cameraid}, \'{fname}\', {rnd}, \'{kind}\', {'null' if corner is None else corner}, {error}, {threshold}''')
 
     def _save_each_image_rt_rpje(self, data: tuple):
         rvecs = data[0]
@@ -510,11 +638,8 @@ class TabStereoCam():
         lpts = data[4]
         rpts = data[5]
         if len(rvecs) == len(calib_list):
-            # devide pts/RPJS into each image by len(calib_list)
-            lpts_split = np.split(lpts, len(calib_list))
-            rpts_split = np.split(rpts, len(calib_list))
-
-            for f, rv, tv, rpje, _lpts, _rpts in zip(calib_list, rvecs, tvecs, pererr, lpts_split, rpts_split):
+            # lpts/rpts: (N,P,2)，逐个视角保存
+            for f, rv, tv, rpje, _lpts, _rpts in zip(calib_list, rvecs, tvecs, pererr, lpts, rpts):
                 R, _ = cv2.Rodrigues(rv)
                 q = rot_2_quat(R)
                 lrpje = "{:.3f}".format(float(rpje[0]))
@@ -524,7 +649,7 @@ class TabStereoCam():
                 
                 self.db.modify_data(
                     self.DB_TABLENAME,
-                    f'''SET isreject=0,
+                    f'''SET isreject=0, rejreason=null,
                     qw={float(q[0])},
                     qx={float(q[1])},
                     qy={float(q[2])},
@@ -538,7 +663,7 @@ class TabStereoCam():
                     ''', (lcors_bytes,))
                 self.db.modify_data(
                     self.DB_TABLENAME,
-                    f'''SET isreject=0,
+                    f'''SET isreject=0, rejreason=null,
                     qw={float(q[0])},
                     qx={float(q[1])},
                     qy={float(q[2])},
@@ -703,12 +828,13 @@ class StereoFileLoader(wx.Dialog):
                                 parent=self,
                                 style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
         self.pp.db.delete_data(self.pp.DB_TABLENAME, f"WHERE 1=1")
+        self.pp.db.delete_data(self.pp.DB_AUDIT_TABLENAME, f"WHERE 1=1")
         for litem, ritem in zip(self.pp.current_leftfile_list, self.pp.current_rightfile_list):
             count += 1
             self.pp.db.write_data(
-                self.pp.DB_TABLENAME, f'null, \'{lp}\', 0,\'{litem}\', 0, null, null, null, null, null, null, null, null, null')
+                self.pp.DB_TABLENAME, f'null, \'{lp}\', 0,\'{litem}\', 0, null, null, null, null, null, null, null, null, null, null')
             self.pp.db.write_data(
-                self.pp.DB_TABLENAME, f'null, \'{rp}\', 1,\'{ritem}\', 0, null, null, null, null, null, null, null, null, null')
+                self.pp.DB_TABLENAME, f'null, \'{rp}\', 1,\'{ritem}\', 0, null, null, null, null, null, null, null, null, null, null')
             (keep_going, skip) = dlg.Update(count, f'added {count} images')
         dlg.Destroy()
         self.pp.update_treectrl()
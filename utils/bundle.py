@@ -0,0 +1,295 @@
+import numpy as np
+from loguru import logger
+from scipy.spatial.transform import Rotation
+from utils.projection import rodrigues_batch, distort_normalized, pad_dist
+
+# opencv stdDeviationsIntrinsics 的长度: fx, fy, cx, cy, k1..k6, s1..s4, tauX, tauY
+N_INTRINSIC_STD = 18
+
+
+# 批量计算平面标定板到图像的单应矩阵(归一化 DLT), objxy (P,2), imgpoints (N,P,2) -> (N,3,3)
+def homographies_batch(objxy, imgpoints):
+    objxy = np.asarray(objxy, np.float64)
+    imgpoints = np.asarray(imgpoints, np.float64).reshape(-1, len(objxy), 2)
+    n, p = imgpoints.shape[:2]
+
+    def normalizer(pts):
+        mean = pts.mean(axis=-2)
+        scale = np.sqrt(2)/np.maximum(np.linalg.norm(pts - mean[..., None, :], axis=-1).mean(axis=-1), 1e-12)
+        T = np.zeros(pts.shape[:-2] + (3, 3))
+        T[..., 0, 0] = T[..., 1, 1] = scale
+        T[..., 0, 2], T[..., 1, 2] = -scale*mean[..., 0], -scale*mean[..., 1]
+        T[..., 2, 2] = 1
+        return T, (pts - mean[..., None, :])*scale[..., None, None]
+
+    T_obj, src = normalizer(objxy)
+    T_img, dst = normalizer(imgpoints)
+    A = np.zeros((n, 2*p, 9))
+    A[:, 0::2, 0:2] = src
+    A[:, 0::2, 2] = 1
+    A[:, 0::2, 6:8] = -dst[..., 0:1]*src
+    A[:, 0::2, 8] = -dst[..., 0]
+    A[:, 1::2, 3:5] = src
+    A[:, 1::2, 5] = 1
+    A[:, 1::2, 6:8] = -dst[..., 1:2]*src
+    A[:, 1::2, 8] = -dst[..., 1]
+    H = np.linalg.svd(A, full_matrices=False)[2][:, -1].reshape(n, 3, 3)
+    H = np.linalg.inv(T_img) @ H @ T_obj
+    return H/H[:, 2:3, 2:3]
+
+
+# 由单应矩阵求焦距(张正友法，主点固定在图像中心、无倾斜)
+def init_intrinsics(H, shape):
+    w, h = shape
+    K = np.array([[1., 0, (w-1)/2], [0, 1., (h-1)/2], [0, 0, 1]])
+    Hc = np.linalg.inv(K) @ H
+    h1, h2 = Hc[:, :, 0], Hc[:, :, 1]
+    # 约束 h1^T B h2 = 0, h1^T B h1 = h2^T B h2, B = diag(1/fx^2, 1/fy^2, 1)
+    A = np.concatenate((h1[:, :2]*h2[:, :2], h1[:, :2]**2 - h2[:, :2]**2))
+    b = -np.concatenate((h1[:, 2]*h2[:, 2], h1[:, 2]**2 - h2[:, 2]**2))
+    uv = np.linalg.lstsq(A, b, rcond=None)[0]
+    if np.any(uv <= 0):
+        # 近似正对的视角无法确定焦距，退回到图像尺寸
+        uv = np.full(2, 1/max(w, h)**2)
+    K[0, 0], K[1, 1] = 1/np.sqrt(uv)
+    return K
+
+
+# 由单应矩阵和内参求每个视角的位姿, 返回 rvecs (N,3), tvecs (N,3)
+def init_poses(H, K):
+    M = np.linalg.inv(K) @ H
+    lam = 2/(np.linalg.norm(M[:, :, 0], axis=1) + np.linalg.norm(M[:, :, 1], axis=1))
+    # 标定板必须在相机前方
+    lam *= np.where(M[:, 2, 2] < 0, -1, 1)
+    r1, r2, t = M[:, :, 0]*lam[:, None], M[:, :, 1]*lam[:, None], M[:, :, 2]*lam[:, None]
+    R = np.stack((r1, r2, np.cross(r1, r2)), axis=2)
+    U, _, Vt = np.linalg.svd(R)
+    R = U @ Vt
+    return Rotation.from_matrix(R).as_rotvec(), t
+
+
+# 雅可比矩阵分块稀疏: 每个视角只涉及共享的相机参数(及双目的右相机位姿)和自身的位姿，
+# 用 schur 补消去位姿块，每次迭代的耗时与视角数成线性关系
+class BundleAdjuster():
+    '''
+    levenberg-marquardt refinement of intrinsics, distortion and board poses,
+    results use the calibrateCameraExtended / stereoCalibrateExtended layout
+    '''
+
+    def __init__(self, n_dist: int = 5, loss: str = 'linear', f_scale: float = 1.0, max_iter: int = 100, tol: float = 1e-10):
+        # 畸变系数个数，与 opencv 默认模型一致 (k1, k2, p1, p2, k3)
+        self.n_dist = n_dist
+        # 鲁棒核: 'linear' / 'huber' / 'soft_l1' / 'cauchy'，f_scale 为内点阈值(pixel)，按角点的重投影误差加权
+        self.loss = loss
+        self.f_scale = f_scale
+        self.max_iter = max_iter
+        # 代价的相对下降小于 tol 时停止
+        self.tol = tol
+
+    @property
+    def n_cam(self):
+        return 4 + self.n_dist
+
+    def _unpack_camera(self, x):
+        fx, fy, cx, cy = x[:4]
+        return np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]]), x[4:self.n_cam]
+
+    def _pack_camera(self, mtx, dist):
+        mtx = np.asarray(mtx, np.float64)
+        return np.concatenate(([mtx[0, 0], mtx[1, 1], mtx[0, 2], mtx[1, 2]], pad_dist(dist)[:self.n_dist]))
+
+    @staticmethod
+    def _project(objp, rmats, tvecs, cam):
+        fx, fy, cx, cy = cam[:4]
+        X = objp @ rmats.transpose(0, 2, 1) + tvecs[:, None, :]
+        xd, yd = distort_normalized(X[..., 0]/X[..., 2], X[..., 1]/X[..., 2], cam[4:])
+        return np.stack((fx*xd + cx, fy*yd + cy), axis=-1)
+
+    # 鲁棒核, e2 为角点误差的平方, 返回 (代价, IRLS 权重)
+    def _robust(self, e2):
+        f2 = self.f_scale**2
+        if self.loss == 'huber':
+            e = np.sqrt(e2)
+            inlier = e <= self.f_scale
+            return np.where(inlier, e2, 2*self.f_scale*e - f2), np.where(inlier, 1.0, self.f_scale/np.maximum(e, 1e-12))
+        if self.loss == 'soft_l1':
+            z = np.sqrt(1 + e2/f2)
+            return 2*f2*(z - 1), 1/z
+        if self.loss == 'cauchy':
+            return f2*np.log1p(e2/f2), 1/(1 + e2/f2)
+        return e2, np.ones_like(e2)
+
+    # 中心差分求雅可比的两个块: 相机块 (N,M,kc)，位姿块 (N,M,6)
+    # 各视角互不相关，位姿的同一分量可以对所有视角同时扰动
+    @staticmethod
+    def _jacobian(fun, cam, poses):
+        n, kc = len(poses), len(cam)
+        Jc = []
+        for j in range(kc):
+            h = 1e-6*max(abs(cam[j]), 1.0)
+            step = np.zeros(kc)
+            step[j] = h
+            Jc.append((fun(cam + step, poses) - fun(cam - step, poses))/(2*h))
+        Jp = []
+        for j in range(6):
+            h = 1e-6*np.maximum(np.abs(poses[:, j]), 1.0)
+            step = np.zeros((n, 6))
+            step[:, j] = h
+            Jp.append((fun(cam, poses + step) - fun(cam, poses - step))/(2*h[:, None]))
+        return np.stack(Jc, axis=-1), np.stack(Jp, axis=-1)
+
+    @staticmethod
+    def _normal_blocks(Jc, Jp, r):
+        Jc2 = Jc.reshape(-1, Jc.shape[-1])
+        U = Jc2.T @ Jc2
+        W = Jc.transpose(0, 2, 1) @ Jp
+        V = Jp.transpose(0, 2, 1) @ Jp
+        return U, W, V, Jc2.T @ r.ravel(), (Jp.transpose(0, 2, 1) @ r[..., None])[..., 0]
+
+    def _optimize(self, fun, cam, poses):
+        '''
+        fun(cam, poses) -> residuals (N, M), residual pairs (x, y) of one corner are adjacent
+        return (cam, poses, residuals, (U, W, V) normal blocks at the solution)
+        '''
+        def evaluate(cam, poses):
+            r = fun(cam, poses)
+            rho, w = self._robust((r.reshape(len(r), -1, 2)**2).sum(axis=-1))
+            return r, rho.sum(), np.repeat(np.sqrt(w), 2, axis=1)
+
+        r, cost, sw = evaluate(cam, poses)
+        lam = 1e-3
+        for it in range(self.max_iter):
+            Jc, Jp = self._jacobian(fun, cam, poses)
+            Jc, Jp = Jc*sw[..., None], Jp*sw[..., None]
+            U, W, V, gc, gp = self._normal_blocks(Jc, Jp, r*sw)
+            improved = False
+            while lam < 1e16:
+                # marquardt 阻尼: 放大法方程对角线
+                Ud = U + lam*np.diag(np.diag(U))
+                Vd = V + lam*np.einsum('nii->ni', V)[:, :, None]*np.eye(6)
+                Vinv = np.linalg.inv(Vd)
+                WV = W @ Vinv
+                S = Ud - np.einsum('nij,nlj->il', WV, W)
+                dc = np.linalg.solve(S, -(gc - np.einsum('nij,nj->i', WV, gp)))
+                dp = -np.einsum('nij,nj->ni', Vinv, gp + np.einsum('nji,j->ni', W, dc))
+                r_new, cost_new, sw_new = evaluate(cam + dc, poses + dp)
+                if cost_new < cost:
+                    improved = True
+                    break
+                lam *= 10
+            if improved is False:
+                break
+            rel = (cost - cost_new)/max(cost, 1e-300)
+            cam, poses, r, cost, sw = cam + dc, poses + dp, r_new, cost_new, sw_new
+            lam = max(lam/10, 1e-12)
+            if rel < self.tol:
+                break
+        logger.debug(f'bundle adjustment: {it+1} iterations, cost {cost}')
+        Jc, Jp = self._jacobian(fun, cam, poses)
+        U, W, V, _, _ = self._normal_blocks(Jc*sw[..., None], Jp*sw[..., None], r*sw)
+        return cam, poses, r, (U, W, V)
+
+    @staticmethod
+    def _std_devs(blocks, sq_err: float, n_residuals: int):
+        '''
+        standard deviations from (J^T J)^-1 * sigma^2 like opencv, the pose block is block diagonal
+        so the camera block is inverted through its schur complement
+        return (std of the camera parameters, std of the 6n pose parameters)
+        '''
+        U, W, V = blocks
+        k, n = len(U), len(V)
+        Vinv = np.linalg.pinv(V)
+        WV = W @ Vinv
+        cov_cam = np.linalg.pinv(U - np.einsum('nij,nlj->il', WV, W))
+        var_pose = np.einsum('nii->ni', Vinv) + np.einsum('nki,kl,nli->ni', WV, cov_cam, WV)
+        sigma2 = sq_err/max(n_residuals - k - 6*n, 1)
+        return np.sqrt(np.abs(np.diag(cov_cam))*sigma2), np.sqrt(np.abs(var_pose)*sigma2).ravel()
+
+    def init_camera(self, objp, imgpoints, shape):
+        '''
+        closed-form start: batched homographies -> focal length -> board poses, zero distortion
+        return (mtx, rvecs (N,3), tvecs (N,3))
+        '''
+        H = homographies_batch(objp[:, :2], imgpoints)
+        mtx = init_intrinsics(H, shape)
+        rvecs, tvecs = init_poses(H, mtx)
+        return mtx, rvecs, tvecs
+
+    def calibrate(self, objpoints, imgpoints, shape, mtx=None, dist=None, rvecs=None, tvecs=None):
+        '''
+        mono bundle adjustment, mtx/dist/rvecs/tvecs are optional initial guesses
+        return (rms, mtx, dist, rvecs, tvecs, stdIntrinsics, stdExtrinsics, perViewErrors)
+        '''
+        objp = np.asarray(objpoints[0], np.float64).reshape(-1, 3)
+        pts = np.asarray(imgpoints, np.float64).reshape(len(imgpoints), -1, 2)
+        n, p = pts.shape[:2]
+        if mtx is None:
+            mtx, rv, tv = self.init_camera(objp, pts, shape)
+            dist = np.zeros(self.n_dist)
+        elif rvecs is None or tvecs is None:
+            H = homographies_batch(objp[:, :2], pts)
+            rv, tv = init_poses(H, np.asarray(mtx, np.float64))
+        else:
+            rv = np.asarray(rvecs, np.float64).reshape(n, 3)
+            tv = np.asarray(tvecs, np.float64).reshape(n, 3)
+        if dist is None:
+            dist = np.zeros(self.n_dist)
+
+        def fun(cam, poses):
+            return (self._project(objp, rodrigues_batch(poses[:, :3]), poses[:, 3:], cam) - pts).reshape(n, -1)
+
+        cam, poses, r, blocks = self._optimize(fun, self._pack_camera(mtx, dist), np.hstack((rv, tv)))
+        mtx, dist = self._unpack_camera(cam)
+        err2 = (r.reshape(n, p, 2)**2).sum(axis=-1)
+        std_cam, std_pose = self._std_devs(blocks, err2.sum(), 2*n*p)
+        stdintri = np.zeros((N_INTRINSIC_STD, 1))
+        stdintri[:len(std_cam), 0] = std_cam
+        return (float(np.sqrt(err2.mean())), mtx, dist.reshape(1, -1),
+                tuple(r.reshape(3, 1) for r in poses[:, :3]), tuple(t.reshape(3, 1) for t in poses[:, 3:]),
+                stdintri, std_pose.reshape(-1, 1), np.sqrt(err2.mean(axis=1)).reshape(-1, 1))
+
+    def stereo_calibrate(self, objpoints, imgpoints_left, imgpoints_right, shape, mono_left, mono_right, R=None, T=None):
+        '''
+        stereo bundle adjustment over both cameras, the right camera pose and the left board poses
+        mono_left/mono_right: (rms, mtx, dist, rvecs, tvecs, ...) from calibrate(), used as start values,
+        R/T are estimated from the per-view relative poses when not given
+        return (rms, mtx_l, dist_l, mtx_r, dist_r, R, T, E, F, rvecs, tvecs, perViewErrors)
+        '''
+        objp = np.asarray(objpoints[0], np.float64).reshape(-1, 3)
+        pts_l = np.asarray(imgpoints_left, np.float64).reshape(len(imgpoints_left), -1, 2)
+        pts_r = np.asarray(imgpoints_right, np.float64).reshape(pts_l.shape)
+        n, p = pts_l.shape[:2]
+        rv_l = np.asarray(mono_left[3], np.float64).reshape(n, 3)
+        tv_l = np.asarray(mono_left[4], np.float64).reshape(n, 3)
+        if R is None or T is None:
+            # 各视角相对位姿的均值
+            rel = Rotation.from_rotvec(np.asarray(mono_right[3], np.float64).reshape(n, 3))*Rotation.from_rotvec(rv_l).inv()
+            R = rel.mean().as_matrix()
+            T = np.median(np.asarray(mono_right[4], np.float64).reshape(n, 3) - tv_l @ R.T, axis=0)
+        k = self.n_cam
+        # 相机块: 左相机, 右相机, 右相机相对左相机的旋转向量和平移
+        cam0 = np.concatenate((self._pack_camera(mono_left[1], mono_left[2]), self._pack_camera(mono_right[1], mono_right[2]),
+                               Rotation.from_matrix(np.asarray(R, np.float64)).as_rotvec(), np.asarray(T, np.float64).ravel()))
+
+        def fun(cam, poses):
+            rmats_l = rodrigues_batch(poses[:, :3])
+            proj_l = self._project(objp, rmats_l, poses[:, 3:], cam[:k])
+            # 右相机位姿 = R * 左相机位姿 + T
+            Rr = rodrigues_batch(cam[2*k:2*k+3])[0]
+            proj_r = self._project(objp, Rr @ rmats_l, poses[:, 3:] @ Rr.T + cam[2*k+3:], cam[k:2*k])
+            return np.concatenate(((proj_l - pts_l).reshape(n, -1), (proj_r - pts_r).reshape(n, -1)), axis=1)
+
+        cam, poses, r, _ = self._optimize(fun, cam0, np.hstack((rv_l, tv_l)))
+        mtx_l, dist_l = self._unpack_camera(cam)
+        mtx_r, dist_r = self._unpack_camera(cam[k:])
+        R = rodrigues_batch(cam[2*k:2*k+3])[0]
+        T = cam[2*k+3:].reshape(3, 1)
+        err2 = (r.reshape(n, 2, p, 2)**2).sum(axis=-1)
+        Tx = np.array([[0, -T[2, 0], T[1, 0]], [T[2, 0], 0, -T[0, 0]], [-T[1, 0], T[0, 0], 0]])
+        E = Tx @ R
+        F = np.linalg.inv(mtx_r).T @ E @ np.linalg.inv(mtx_l)
+        if abs(F[2, 2]) > 0:
+            F /= F[2, 2]
+        return (float(np.sqrt(err2.mean())), mtx_l, dist_l.reshape(1, -1), mtx_r, dist_r.reshape(1, -1), R, T, E, F,
+                tuple(r.reshape(3, 1) for r in poses[:, :3]), tuple(t.reshape(3, 1) for t in poses[:, 3:]),
+                np.sqrt(err2.mean(axis=2)))
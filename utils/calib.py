@@ -7,12 +7,46 @@ import os
 import time
 import json
 import math
-from multiprocessing import Pool
-from functools import partial
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 from scipy.spatial.transform import Rotation
+from scipy.stats import norm
 from utils.checkerboard import detect_checkerboard
+from utils.cornercache import CornerCache, DEFAULT_CACHE_DIR
+from utils.calibpool import SHARED_POOL, _mono_task, _stereo_task, _rt_task, _hash_task, _model_task, _resample_task
 from utils.err import CalibErrType
+from utils.quality import QualityScreen
+from utils.dedup import FrameDeduper
+from utils.projection import rodrigues_batch, project_points_batch, reprojection_residuals
+from utils.bundle import BundleAdjuster
+from utils.params import SHARED_PARAMS, parse_camera, parse_size, parse_stereo_rt
+
+SB_FLAGS = cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_EXHAUSTIVE | cv2.CALIB_CB_ACCURACY | cv2.CALIB_CB_MARKER
+# 逐级检测中非穷举检测使用的 flags
+SB_FAST_FLAGS = SB_FLAGS & ~cv2.CALIB_CB_EXHAUSTIVE
+# 角点检测各阶段: 缓存命中, 预筛, 预筛的标定板检查(不拒绝), 棋盘格存在性检测, 非穷举检测, 穷举检测, 金字塔检测及其校验
+DETECT_STAGES = ('cached', 'prescreen', 'prescreen_board', 'presence', 'fast', 'exhaustive', 'pyramid_detect', 'pyramid_verify')
+# 畸变模型及对应的标定 flags，按系数个数从少到多排列
+DIST_MODELS = {
+    'standard': 0,
+    'rational': cv2.CALIB_RATIONAL_MODEL,
+    'thin_prism': cv2.CALIB_RATIONAL_MODEL | cv2.CALIB_THIN_PRISM_MODEL,
+    'tilted': cv2.CALIB_RATIONAL_MODEL | cv2.CALIB_THIN_PRISM_MODEL | cv2.CALIB_TILTED_MODEL,
+}
+DIST_MODEL_SIZES = {'standard': 5, 'rational': 8, 'thin_prism': 12, 'tilted': 14}
+# 内参及畸变系数的名称，与 opencv stdDeviationsIntrinsics 的顺序一致
+INTRINSIC_NAMES = ('fx', 'fy', 'cx', 'cy', 'k1', 'k2', 'p1', 'p2', 'k3', 'k4', 'k5', 'k6',
+                   's1', 's2', 's3', 's4', 'tauX', 'tauY')
+
+
+# 根据畸变系数个数判断畸变模型
+def dist_model_of(dist):
+    n = np.asarray(dist).size
+    for model, size in DIST_MODEL_SIZES.items():
+        if n <= size:
+            return model
+    return 'tilted'
 
 # 定义一个枚举类型，包含如下类型: CHESSBORD, CHARUCO, APRILTAG
 class CalibPatternType(Enum):
@@ -68,53 +102,24 @@ def load_handeye_param(filename:str):
     he = jstr[f'{ELEMENT_NAME}']['Matrix']
     return np.array(he)
 
+# 参数文件由 SHARED_PARAMS 缓存，文件未修改时不再重复解析
 def load_camera_param(filename: str, need_trans=False, camera_id=False, need_rt=False, need_size=False):
-    # load parameters
-    with open(filename) as f:
-        jstr = json.load(f)
-
-    NEED_TRANS = need_trans
-    if 'Scheme' in jstr:
-        if jstr['Scheme'] != 'opencv':
-            NEED_TRANS = True
-
-    if 'CameraParameters' in jstr:
-        ELEMENT_NAME = 'CameraParameters'
-    elif camera_id is False and 'CameraParameters1' in jstr:
-        ELEMENT_NAME = 'CameraParameters1'
-    elif camera_id is True and 'CameraParameters2' in jstr:
-        ELEMENT_NAME = 'CameraParameters2'
-    else:
+    jstr = SHARED_PARAMS.json(filename)
+    mtx, dist = parse_camera(jstr, need_trans, camera_id)
+    if mtx is None:
         logger.debug("json file load err")
         return None, None
-
-    intri = jstr[f'{ELEMENT_NAME}']['IntrinsicMatrix']
-    dist_r = jstr[f'{ELEMENT_NAME}']['RadialDistortion']
-    dist_t = jstr[f'{ELEMENT_NAME}']['TangentialDistortion']
-
-    mtx = np.array(intri)
-    if NEED_TRANS:
-        mtx = mtx.T
-    dist = np.array(
-        [dist_r[:2] + dist_t + [dist_r[-1]]]
-    )
     if need_rt is not True:
         if need_size is not True:
             return mtx, dist
         else:
-            w,h = None, None
-            if 'ImageShape' in jstr:
-                imageshape = jstr['ImageShape']
-                w,h = imageshape[0], imageshape[1]
-            return mtx, dist, w, h    
+            w, h = parse_size(jstr)
+            return mtx, dist, w, h
     else:
-        if 'RotationOfCamera2' in jstr and 'TranslationOfCamera2' in jstr:
-            rot2 = jstr['RotationOfCamera2']
-            trans2 = jstr['TranslationOfCamera2']
-        else:
+        rot2, trans2 = parse_stereo_rt(jstr)
+        if rot2 is None:
             logger.debug("Can't find RotationOfCamera2 and TranslationOfCamera2 in json file")
-            return mtx, dist, None, None
-        return mtx, dist, np.array(rot2), np.array(trans2)
+        return mtx, dist, rot2, trans2
 
 def quat_2_rot(q: np.array):
     q = q / np.linalg.norm(q)
@@ -374,9 +379,37 @@ class HandEye():
 
 
 class CalibBoard():
-    def __init__(self, row, col, cellsize, use_mt: bool = True, use_libcbdet = False, pattern=CalibPatternType.CHESSBOARD, charuco_dict=aruco.DICT_4X4_1000, charuco_size=3):
+    def __init__(self, row, col, cellsize, use_mt: bool = True, use_libcbdet = False, pattern=CalibPatternType.CHESSBOARD, charuco_dict=aruco.DICT_4X4_1000, charuco_size=3, use_cache: bool = False, cache_dir: str = DEFAULT_CACHE_DIR, pyramid: bool = False, pyramid_max_side: int = 1600, cascade: bool = False, prescreen: bool = False, pyramid_verified: bool = None):
+        # 工作进程用于重建标定板的配置
+        self.board_config = dict(row=row, col=col, cellsize=cellsize, use_mt=False, use_libcbdet=use_libcbdet,
+                                 pattern=pattern, charuco_dict=charuco_dict, charuco_size=charuco_size,
+                                 use_cache=use_cache, cache_dir=cache_dir,
+                                 pyramid=pyramid, pyramid_max_side=pyramid_max_side, cascade=cascade,
+                                 prescreen=prescreen, pyramid_verified=pyramid_verified)
         # use libcbdetect
         self.use_libcbdet=use_libcbdet
+        # 逐级检测：checkChessboard -> 非穷举 -> 穷举，只有失败时才升级; 存在性检测失败时跳过非穷举检测，不直接拒绝
+        self.cascade = cascade
+        # 存在性检测时缩小图的长边
+        self.presence_max_side = 1000
+        self.detect_stats = self.new_detect_stats()
+        # 金字塔检测：在缩小图上找角点，再回到原图上做亚像素细化
+        self.pyramid = pyramid
+        self.pyramid_max_side = pyramid_max_side
+        # 与原图检测结果的平均偏差容限(pixel)，首张图会做一次对比校验
+        self.pyramid_tol = 0.1
+        # None: 尚未校验; True: 校验通过; False: 校验失败，退回原图检测
+        # 多进程检测前由主进程校验，结果通过 board_config 传给工作进程
+        self.pyramid_verified = pyramid_verified
+        self.subpix_criteria = (cv2.TERM_CRITERIA_EPS +
+                                cv2.TERM_CRITERIA_MAX_ITER, 40, 0.001)
+        # 角点缓存(默认关闭)，重复标定时跳过角点检测; 缓存文件在 cache_dir 下，CornerCache.clear 可清空
+        self.corner_cache = CornerCache(cache_dir) if use_cache else None
+        # 检测前的图像质量预筛(清晰度/曝光)，直接拒绝明显无法检测的图片; 是否有标定板只作参考，不拒绝
+        self.quality = None
+        if prescreen is True:
+            self.quality = QualityScreen(
+                (row-1, col-1) if pattern == CalibPatternType.CHESSBOARD and not use_libcbdet else None)
         # use multi-threading
         self.USE_MT = use_mt
         # checkerboard pattern
@@ -385,6 +418,79 @@ class CalibBoard():
         self.CELLSIZE = cellsize
         self.criteria = (cv2.TERM_CRITERIA_EPS +
                          cv2.TERM_CRITERIA_MAX_ITER, 300000, 1e-16)
+        # 增量校准从上一次的解出发，只需少量迭代
+        self.warm_criteria = (cv2.TERM_CRITERIA_EPS +
+                              cv2.TERM_CRITERIA_MAX_ITER, 200, 1e-12)
+        # 检测到足够多的图片后提前求解一个初值，检测结束后从该初值继续求解
+        self.early_solve_views = 20
+        # 单张图片角点检测的时间上限(秒)，超时的图片按拒绝处理，None 表示不限制(默认)，仅多进程模式下生效
+        self.detect_timeout = None
+        # 取消标定，检测中的任务被终止，未检测的图片不再处理
+        self.cancel_event = threading.Event()
+        # 被拒绝的图片及原因: 'no corners' / 'timeout' / 'cancelled' / 'duplicate of xxx' / 预筛原因
+        self.reject_reasons = {}
+        # 合并视频中相邻的近似重复帧，只检测代表帧; dedup_groups 记录 {代表帧: [被合并的帧]}
+        self.dedup = False
+        self.deduper = FrameDeduper()
+        self.dedup_groups = {}
+        # 视角过多时只在信息量最大的子集上求解，其余视角用求得的内参验证
+        # max_views 直接限制子集大小; solve_budget(秒) 根据试算耗时估计子集大小
+        self.max_views = None
+        self.solve_budget = None
+        self.budget_pilot_views = 30
+        # 最近一次求解使用的视角序号，None 表示使用了全部视角
+        self.selected_views = None
+        # 设置 solve_budget 后求解分段进行，每段迭代 budget_chunk_iters 次，
+        # RMS 相对改进小于 min_rms_gain 或超出时间预算时停止
+        self.budget_chunk_iters = 5
+        self.min_rms_gain = 1e-4
+        self._solve_deadline = None
+        # 最近一次限时求解的 RMS 轨迹 {'mono'/'left'/'right'/'stereo': [(elapsed, rms), ...]}
+        self.solve_trajectory = {}
+        # 求解引擎: 'opencv' 使用 calibrateCamera/stereoCalibrate; 'bundle' 使用稀疏光束法平差，
+        # 视角很多时更快，双目时同时优化两个相机的内参，可通过 bundle.loss 设置鲁棒核
+        self.engine = 'opencv'
+        self.bundle = BundleAdjuster()
+        # 双目时左右相机的单目求解在两个线程中同时进行，单核机器上没有收益
+        self.concurrent_solve = (os.cpu_count() or 1) > 1
+        # 畸变模型: DIST_MODELS 中的一种
+        # select_model 为 True 时先用 k 折交叉验证比较 model_candidates，留出视角的重投影误差
+        # 不超过最优值 (1+model_tolerance) 倍的模型中选系数最少的，比较结果保存在 model_table
+        self.dist_model = 'standard'
+        self.select_model = False
+        self.model_candidates = tuple(DIST_MODELS)
+        self.model_folds = 5
+        self.model_tolerance = 0.02
+        self.model_table = None
+        # 模型比较只需要相对误差，限制迭代次数避免高阶模型长时间不收敛
+        self.model_criteria = (cv2.TERM_CRITERIA_EPS +
+                               cv2.TERM_CRITERIA_MAX_ITER, 1000, 1e-12)
+        # 最近一次单目求解的 opencv 标准差 (stdDeviationsIntrinsics, stdDeviationsExtrinsics)
+        self.std_intrinsics = None
+        self.std_extrinsics = None
+        # 稳定性评估: None / 'bootstrap' (有放回重采样 uncertainty_samples 次) / 'kfold' (留一折重解 model_folds 次)
+        # 结果为各参数的置信区间，保存在 uncertainty_report
+        self.uncertainty = None
+        self.uncertainty_samples = 50
+        self.uncertainty_level = 0.95
+        self.uncertainty_seed = 0
+        self.uncertainty_report = None
+        # 自动剔除离群视角和角点: 每轮按 中位数 + k*MAD 的鲁棒阈值(不低于 floor 像素)剔除后热启动重新求解，
+        # 剔除的视角不超过总数的 trim_max_fraction 且至少保留 trim_min_views 个，
+        # 剩余角点不足 trim_min_corners 比例的视角整体剔除; 光束法引擎依靠鲁棒核处理离群角点，只剔除视角
+        # 剔除记录 trim_log: [(轮次, 'view'/'corner', 文件名, 角点序号, 误差, 阈值), ...]
+        self.auto_trim = False
+        self.trim_view_k = 3.0
+        self.trim_corner_k = 5.0
+        self.trim_view_floor = 1.0
+        self.trim_corner_floor = 1.5
+        self.trim_min_views = 6
+        self.trim_max_fraction = 0.2
+        self.trim_min_corners = 0.5
+        self.trim_max_rounds = 5
+        self.trim_log = []
+        # 剔除后保留视角中参与求解的角点 (n,P) bool，与返回的 imgpoints 一一对应; None 表示全部角点都参与求解
+        self.trim_mask = None
         
         # charuco board
         self.calib_pattern = pattern
@@ -399,125 +505,425 @@ class CalibBoard():
 
     # 单目校准
     @timer_decorator
-    def mono_calib(self, rootpath: str, filelist: list):
-        objpoints = []  # 3d points in real world space
-        imgpoints = []  # 2d points in image plane.
-        rejected_files = []  # 无法获取角点的图片列表
-        calibrated_files = []  # 校准成功的文件列表
-
-        for fname in filelist:
-            img = cv2.imread(os.path.join(rootpath, fname))
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            ret, cors = self.find_corners(gray)
-            if ret is not True:
-                # remember the rejected files
-                rejected_files.append(fname)
-            else:
-                calibrated_files.append(fname)
-                objpoints.append(self.objp)
-                imgpoints.append(cors)
+    def mono_calib(self, rootpath: str, filelist: list, progress_cb=None):
+        objpoints, imgpoints, rejected_files, calibrated_files, shape, _ = self._detect_mono_corners(
+            rootpath, filelist, parallel=False, progress_cb=progress_cb)
+        self._apply_model_selection(imgpoints, shape, parallel=False)
 
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
         # 检查角点size是否为0
         if len(imgpoints) == 0:
             return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
 
-        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, perverrs = cv2.calibrateCameraExtended(
-            objpoints, imgpoints, gray.shape[::-1], None, None, criteria=self.criteria)        
+        result = self._calibrate_mono(objpoints, imgpoints, shape)
+        if self.auto_trim is True:
+            result, kept = self.trim_mono_outliers(objpoints, imgpoints, shape, result, calibrated_files)
+            imgpoints = [imgpoints[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, perverrs = result
 
+        self._record_uncertainty(imgpoints, shape, mtx, dist, stdintri, stdextri, parallel=False)
         # TODO evaluate the results
-        return ret, mtx, dist, rvecs, tvecs, perverrs, rejected_files, calibrated_files, gray.shape[::-1], imgpoints, CalibErrType.CAL_OK
+        return ret, mtx, dist, rvecs, tvecs, perverrs, rejected_files, calibrated_files, shape, imgpoints, CalibErrType.CAL_OK
 
     # parallen mono calib
     @timer_decorator
-    def mono_calib_parallel(self, rootpath: str, filelist: str):
-        objpoints = []  # 3d points in real world space
-        imgpoints = []  # 2d points in image plane.
-        rejected_files = []  # 无法获取角点的图片列表
-        calibrated_files = []  # 校准成功的文件列表
+    def mono_calib_parallel(self, rootpath: str, filelist: str, progress_cb=None):
+        objpoints, imgpoints, rejected_files, calibrated_files, shape, guess = self._detect_mono_corners(
+            rootpath, filelist, parallel=True, progress_cb=progress_cb, early_solve=True)
+        self._apply_model_selection(imgpoints, shape)
 
-        # 尝试读取一张图片，用于后续读取图片尺寸
-        image_for_shape = cv2.imread(os.path.join(rootpath, filelist[0]), 0)
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
+        # 检查角点size是否为0
+        if len(imgpoints) == 0:
+            return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
 
-        with Pool(min(len(filelist), os.cpu_count()-1)) as p:
-            results = p.map(
-                partial(self._process_image_corners, rootpath), filelist)
+        if guess is not None:
+            # 提前求得的初值未收敛，仍按完整的终止条件求解
+            result = self._calibrate_mono(objpoints, imgpoints, shape, guess[0], guess[1], criteria=self.criteria)
+        else:
+            result = self._calibrate_mono(objpoints, imgpoints, shape)
+        if self.auto_trim is True:
+            result, kept = self.trim_mono_outliers(objpoints, imgpoints, shape, result, calibrated_files)
+            imgpoints = [imgpoints[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, perverrs = result
+
+        self._record_uncertainty(imgpoints, shape, mtx, dist, stdintri, stdextri)
+        # TODO evaluate the results
+        return ret, mtx, dist, rvecs, tvecs, perverrs, rejected_files, calibrated_files, shape, imgpoints, CalibErrType.CAL_OK
 
-        for fname, objp, cors, status in results:
-            if status == 'rejected':
-                rejected_files.append(fname)
-            else:
-                calibrated_files.append(fname)
-                objpoints.append(objp)
-                imgpoints.append(cors)
-        
+    # 增量单目校准：剔除部分图片后，以上一次的内参、畸变和每张图的位姿为初值重新求解
+    # prev_poses: {filename: (rvec, tvec)}，缺少任意一张图的位姿时只使用内参初值
+    # prev_corners: {filename: corners}，与 shape 一起传入时沿用上一次的角点，只检测其中没有的图片
+    @timer_decorator
+    def mono_calib_incremental(self, rootpath: str, filelist: list, mtx, dist, prev_poses: dict = None, progress_cb=None,
+                               prev_corners: dict = None, shape=None):
+        if prev_corners is None or shape is None:
+            objpoints, imgpoints, rejected_files, calibrated_files, shape, _ = self._detect_mono_corners(
+                rootpath, filelist, parallel=self.USE_MT, progress_cb=progress_cb)
+        else:
+            objpoints, imgpoints, rejected_files, calibrated_files, shape = self._reuse_mono_corners(
+                rootpath, filelist, prev_corners, shape, progress_cb)
+        # 沿用上一次标定的畸变模型
+        self.dist_model = dist_model_of(dist)
+
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
         # 检查角点size是否为0
         if len(imgpoints) == 0:
             return False, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
 
-        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, perverrs = cv2.calibrateCameraExtended(
-            objpoints, imgpoints, image_for_shape.shape[::-1], None, None, criteria=self.criteria)
+        rvecs, tvecs = None, None
+        if prev_poses is not None and all(f in prev_poses for f in calibrated_files):
+            rvecs = [np.asarray(prev_poses[f][0], np.float64).reshape(3, 1) for f in calibrated_files]
+            tvecs = [np.asarray(prev_poses[f][1], np.float64).reshape(3, 1) for f in calibrated_files]
 
-        # TODO evaluate the results
-        return ret, mtx, dist, rvecs, tvecs, perverrs, rejected_files, calibrated_files, image_for_shape.shape[::-1], imgpoints, CalibErrType.CAL_OK
+        result = self._calibrate_mono(objpoints, imgpoints, shape, mtx, dist, rvecs, tvecs)
+        if self.auto_trim is True:
+            result, kept = self.trim_mono_outliers(objpoints, imgpoints, shape, result, calibrated_files)
+            imgpoints = [imgpoints[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, perverrs = result
+        self._record_uncertainty(imgpoints, shape, mtx, dist, stdintri, stdextri, parallel=self.USE_MT)
+
+        return ret, mtx, dist, rvecs, tvecs, perverrs, rejected_files, calibrated_files, shape, imgpoints, CalibErrType.CAL_OK
 
     # 双目校准
     @timer_decorator
-    def stereo_calib(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: str):
-        objpoints = []  # 3d points in real world space
-        imgpoints_left = []  # 2d points in left image plane.
-        imgpoints_right = []  # 2d points in right image plane.
-        rejected_files = []  # 无法获取角点的图片列表
-        calibrated_files = []  # 校准成功的文件列表
+    def stereo_calib(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: str, progress_cb=None):
+        objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape, _ = self._detect_stereo_corners(
+            leftrootpath, rightrootpath, leftfilelist, rightfilelist, parallel=False, progress_cb=progress_cb)
+        self._apply_model_selection(imgpoints_left, shape, imgpoints_right, parallel=False)
 
-        for lf, rf in zip(leftfilelist, rightfilelist):
-            leftimg = cv2.imread(f'{os.path.join(leftrootpath,lf)}', 0)
-            rightimg = cv2.imread(f'{os.path.join(rightrootpath,rf)}', 0)
-            ret_l, cors_l = self.find_corners(leftimg)
-            ret_r, cors_r = self.find_corners(rightimg)
-            if ret_l is not True or ret_r is not True:
-                rejected_files.append([lf, rf])
-            else:
-                calibrated_files.append([lf, rf])
-                objpoints.append(self.objp)
-                imgpoints_left.append(cors_l)
-                imgpoints_right.append(cors_r)
-        
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
         # 检查角点size是否为0
         if len(imgpoints_left) == 0 or len(imgpoints_right) == 0:
             return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
-        # single calibrate
-        ret_l, mtx_l, dist_l, rvecs_l, tvecs_l, stdintri_l, stdextri_l, pererr = cv2.calibrateCameraExtended(
-            objpoints, imgpoints_left, leftimg.shape[::-1], None, None, criteria=self.criteria)
-        ret_r, mtx_r, dist_r, rvecs_r, tvecs_r, stdintri_r, stdextri_r, pererr = cv2.calibrateCameraExtended(
-            objpoints, imgpoints_right, rightimg.shape[::-1], None, None, criteria=self.criteria)
-        # stereo calibrate
-        # ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F = cv2.stereoCalibrate(
-        #     objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, leftimg.shape[::-1], criteria=self.criteria)
-        # 创建旋转矩阵和平移向量的初始值
-        R = np.eye(3)  # 3x3的单位矩阵
-        T = np.zeros((3, 1))  # 3x1的零向量
-        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr = cv2.stereoCalibrateExtended(
-            objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, leftimg.shape[::-1], R, T, criteria=self.criteria)
-
-        return ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rejected_files, calibrated_files, leftimg.shape[::-1], imgpoints_left, imgpoints_right, CalibErrType.CAL_OK
+
+        result = self._calibrate_stereo(
+            objpoints, imgpoints_left, imgpoints_right, shape)
+        if self.auto_trim is True:
+            result, kept = self.trim_stereo_outliers(
+                objpoints, imgpoints_left, imgpoints_right, shape, result, calibrated_files)
+            imgpoints_left = [imgpoints_left[i] for i in kept]
+            imgpoints_right = [imgpoints_right[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr = result
+
+        return ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rejected_files, calibrated_files, shape, imgpoints_left, imgpoints_right, CalibErrType.CAL_OK
 
     @timer_decorator
-    def stereo_calib_parallel(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list):
+    def stereo_calib_parallel(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, progress_cb=None):
+        objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape, guess = self._detect_stereo_corners(
+            leftrootpath, rightrootpath, leftfilelist, rightfilelist, parallel=True, progress_cb=progress_cb, early_solve=True)
+        self._apply_model_selection(imgpoints_left, shape, imgpoints_right)
+
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
+        # 检查角点size是否为0
+        if len(imgpoints_left) == 0 or len(imgpoints_right) == 0:
+            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
+
+        result = self._calibrate_stereo(
+            objpoints, imgpoints_left, imgpoints_right, shape, guess=guess)
+        if self.auto_trim is True:
+            result, kept = self.trim_stereo_outliers(
+                objpoints, imgpoints_left, imgpoints_right, shape, result, calibrated_files)
+            imgpoints_left = [imgpoints_left[i] for i in kept]
+            imgpoints_right = [imgpoints_right[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr = result
+
+        return ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rejected_files, calibrated_files, shape, imgpoints_left, imgpoints_right, CalibErrType.CAL_OK
+
+    # 增量双目校准：以上一次的左右内参、畸变以及R,T为初值重新求解
+    # prev_corners: {(lfname, rfname): (lcors, rcors)}，与 shape 一起传入时沿用上一次的角点，只检测其中没有的图片
+    @timer_decorator
+    def stereo_calib_incremental(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, mtx_l, dist_l, mtx_r, dist_r, R, T, progress_cb=None,
+                                 prev_corners: dict = None, shape=None):
+        if prev_corners is None or shape is None:
+            objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape, _ = self._detect_stereo_corners(
+                leftrootpath, rightrootpath, leftfilelist, rightfilelist, parallel=self.USE_MT, progress_cb=progress_cb)
+        else:
+            objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape = self._reuse_stereo_corners(
+                leftrootpath, rightrootpath, leftfilelist, rightfilelist, prev_corners, shape, progress_cb)
+        # 沿用上一次标定的畸变模型
+        self.dist_model = dist_model_of(dist_l)
+
+        if self.cancel_event.is_set():
+            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CANCELLED
+        # 检查角点size是否为0
+        if len(imgpoints_left) == 0 or len(imgpoints_right) == 0:
+            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
+
+        result = self._calibrate_stereo(
+            objpoints, imgpoints_left, imgpoints_right, shape, (mtx_l, dist_l, mtx_r, dist_r, R, T))
+        if self.auto_trim is True:
+            result, kept = self.trim_stereo_outliers(
+                objpoints, imgpoints_left, imgpoints_right, shape, result, calibrated_files)
+            imgpoints_left = [imgpoints_left[i] for i in kept]
+            imgpoints_right = [imgpoints_right[i] for i in kept]
+            calibrated_files, rejected_files = self._split_trimmed(kept, calibrated_files, rejected_files)
+        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr = result
+
+        return ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rejected_files, calibrated_files, shape, imgpoints_left, imgpoints_right, CalibErrType.CAL_OK
+
+    # 取消正在进行的检测，可在任意线程调用
+    def cancel(self):
+        self.cancel_event.set()
+
+    # 按完成顺序逐张返回单目检测结果 (fname, cors, shape, status, reason, stats)
+    def iter_mono_corners(self, rootpath: str, filelist: list, parallel: bool = True):
+        tasks = [(rootpath, fname) for fname in filelist]
+        if parallel is True:
+            self.verify_pyramid([os.path.join(rootpath, fname) for fname in filelist])
+            for idx, result, reason in SHARED_POOL.imap_deadline(
+                    self.board_config, _mono_task, tasks, self.detect_timeout, self.cancel_event):
+                if reason is not None:
+                    result = (filelist[idx], None, None, 'rejected', reason, self.new_detect_stats())
+                self._record_reject(result[0], result[3], result[4])
+                yield result
+        else:
+            for task in tasks:
+                if self.cancel_event.is_set():
+                    result = (task[1], None, None, 'rejected', 'cancelled', self.new_detect_stats())
+                else:
+                    result = self._process_image_corners(*task)
+                self._record_reject(result[0], result[3], result[4])
+                yield result
+
+    # 按完成顺序逐对返回双目检测结果 (lfname, rfname, lcors, rcors, shape, status, reason, stats)
+    def iter_stereo_corners(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, parallel: bool = True):
+        tasks = [(lf, rf, leftrootpath, rightrootpath) for lf, rf in zip(leftfilelist, rightfilelist)]
+        if parallel is True:
+            self.verify_pyramid([os.path.join(leftrootpath, lf) for lf in leftfilelist])
+            for idx, result, reason in SHARED_POOL.imap_deadline(
+                    self.board_config, _stereo_task, tasks, self.detect_timeout, self.cancel_event):
+                if reason is not None:
+                    result = (tasks[idx][0], tasks[idx][1], None, None, None, 'rejected', reason, self.new_detect_stats())
+                self._record_reject((result[0], result[1]), result[5], result[6])
+                yield result
+        else:
+            for task in tasks:
+                if self.cancel_event.is_set():
+                    result = (task[0], task[1], None, None, None, 'rejected', 'cancelled', self.new_detect_stats())
+                else:
+                    result = self._stereo_process_image_corners(task)
+                self._record_reject((result[0], result[1]), result[5], result[6])
+                yield result
+
+    # 计算文件的 dHash，多进程时在进程池中执行
+    def _hash_files(self, paths: list, parallel: bool):
+        tasks = [(path, self.deduper.hash_size) for path in paths]
+        if parallel is True:
+            with SHARED_POOL.session(self.board_config) as p:
+                return p.map(_hash_task, tasks, chunksize=8)
+        return [_hash_task(task) for task in tasks]
+
+    def _record_duplicates(self, groups: dict):
+        self.dedup_groups.update(groups)
+        for rep, dups in groups.items():
+            for name in dups:
+                self.reject_reasons[name] = f'duplicate of {rep[0] if isinstance(rep, tuple) else rep}'
+        if len(groups) > 0:
+            logger.info(f'folded {sum(len(v) for v in groups.values())} duplicate frames into {len(groups)} representatives')
+
+    # 返回去重后的单目文件列表
+    def _fold_mono_duplicates(self, rootpath: str, filelist: list, parallel: bool):
+        hashes = self._hash_files([os.path.join(rootpath, f) for f in filelist], parallel)
+        kept, groups = self.deduper.fold(filelist, hashes)
+        self._record_duplicates(groups)
+        return kept
+
+    # 返回去重后的双目文件列表，左右图都重复时才合并
+    def _fold_stereo_duplicates(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, parallel: bool):
+        pairs = list(zip(leftfilelist, rightfilelist))
+        hashes = self._hash_files([os.path.join(leftrootpath, lf) for lf, _ in pairs] +
+                                  [os.path.join(rightrootpath, rf) for _, rf in pairs], parallel)
+        pair_hashes = [None if lh is None or rh is None else np.concatenate((lh, rh))
+                       for lh, rh in zip(hashes[:len(pairs)], hashes[len(pairs):])]
+        deduper = FrameDeduper(self.deduper.hash_size, 2*self.deduper.max_dist)
+        kept, groups = deduper.fold(pairs, pair_hashes)
+        self._record_duplicates(groups)
+        return [lf for lf, _ in kept], [rf for _, rf in kept]
+
+    def _record_reject(self, name, status: str, reason: str = None):
+        if status != 'rejected':
+            self.reject_reasons.pop(name, None)
+        else:
+            self.reject_reasons[name] = reason or 'no corners'
+
+    # 已有角点的图片直接计入进度，其余图片重新检测，结果按原始文件顺序整理
+    def _reuse_mono_corners(self, rootpath: str, filelist: list, prev_corners: dict, shape, progress_cb=None):
+        known = [f for f in filelist if f in prev_corners]
+        missing = [f for f in filelist if f not in prev_corners]
+        total = len(filelist)
+        for done, fname in enumerate(known, 1):
+            if progress_cb is not None:
+                progress_cb(done, total, fname, 'calibrated')
+        found = {}
+        if len(missing) > 0:
+            def _progress(done, _, fname, status):
+                if progress_cb is not None:
+                    progress_cb(len(known)+done, total, fname, status)
+            _, imgpoints, _, calibrated_files, _, _ = self._detect_mono_corners(
+                rootpath, missing, parallel=self.USE_MT, progress_cb=_progress)
+            found = dict(zip(calibrated_files, imgpoints))
+        logger.info(f'reused corners of {len(known)} images, detected {len(missing)}')
+
+        objpoints, imgpoints, rejected_files, calibrated_files = [], [], [], []
+        for fname in filelist:
+            cors = prev_corners[fname] if fname in prev_corners else found.get(fname)
+            if cors is None:
+                rejected_files.append(fname)
+                continue
+            calibrated_files.append(fname)
+            objpoints.append(self.objp)
+            imgpoints.append(np.asarray(cors, np.float32).reshape(-1, 1, 2))
+        return objpoints, imgpoints, rejected_files, calibrated_files, shape
+
+    def _reuse_stereo_corners(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, prev_corners: dict, shape, progress_cb=None):
+        pairs = list(zip(leftfilelist, rightfilelist))
+        known = [p for p in pairs if p in prev_corners]
+        missing = [p for p in pairs if p not in prev_corners]
+        total = len(pairs)
+        for done, pair in enumerate(known, 1):
+            if progress_cb is not None:
+                progress_cb(done, total, list(pair), 'calibrated')
+        found = {}
+        if len(missing) > 0:
+            def _progress(done, _, fname, status):
+                if progress_cb is not None:
+                    progress_cb(len(known)+done, total, fname, status)
+            _, left, right, _, calibrated_files, _, _ = self._detect_stereo_corners(
+                leftrootpath, rightrootpath, [lf for lf, _ in missing], [rf for _, rf in missing],
+                parallel=self.USE_MT, progress_cb=_progress)
+            found = {tuple(pair): (lcors, rcors) for pair, lcors, rcors in zip(calibrated_files, left, right)}
+        logger.info(f'reused corners of {len(known)} image pairs, detected {len(missing)}')
+
+        objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files = [], [], [], [], []
+        for pair in pairs:
+            cors = prev_corners[pair] if pair in prev_corners else found.get(pair)
+            if cors is None:
+                rejected_files.append(list(pair))
+                continue
+            calibrated_files.append(list(pair))
+            objpoints.append(self.objp)
+            imgpoints_left.append(np.asarray(cors[0], np.float32).reshape(-1, 1, 2))
+            imgpoints_right.append(np.asarray(cors[1], np.float32).reshape(-1, 1, 2))
+        return objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape
+
+    # 单目角点检测; progress_cb(done, total, fname, status) 每完成一张图调用一次
+    # early_solve 为 True 时，检测到 early_solve_views 张后在后台线程先求一个初值
+    def _detect_mono_corners(self, rootpath: str, filelist: list, parallel: bool, progress_cb=None, early_solve: bool = False):
+        objpoints = []  # 3d points in real world space
+        imgpoints = []  # 2d points in image plane.
+        rejected_files = []  # 无法获取角点的图片列表
+        calibrated_files = []  # 校准成功的文件列表
+
+        results = {}
+        found = []
+        shape = None
+        executor, early = None, None
+        total = len(filelist)
+        kept = filelist
+        if self.dedup is True:
+            kept = self._fold_mono_duplicates(rootpath, filelist, parallel)
+        # 被合并的重复帧直接计入进度
+        done = 0
+        kept_set = set(kept)
+        for fname in [f for f in filelist if f not in kept_set]:
+            done += 1
+            if progress_cb is not None:
+                progress_cb(done, total, fname, 'rejected')
+        for done, result in enumerate(self.iter_mono_corners(rootpath, kept, parallel), done+1):
+            fname, cors, _shape, status, _, stats = result
+            results[fname] = result
+            self.merge_detect_stats(stats)
+            shape = _shape if shape is None else shape
+            if status != 'rejected':
+                found.append(cors)
+            if progress_cb is not None:
+                progress_cb(done, total, fname, status)
+            if early_solve is True and early is None and len(found) >= self.early_solve_views \
+                    and total - done >= self.early_solve_views:
+                executor = ThreadPoolExecutor(max_workers=1)
+                early = executor.submit(cv2.calibrateCamera, [self.objp]*len(found), list(found), shape,
+                                        None, None, criteria=self.warm_criteria)
+
+        # 结果按原始文件顺序整理
+        for fname in filelist:
+            if fname not in results:
+                rejected_files.append(fname)
+                continue
+            _, cors, _, status, _, _ = results[fname]
+            if status == 'rejected':
+                rejected_files.append(fname)
+            else:
+                calibrated_files.append(fname)
+                objpoints.append(self.objp)
+                imgpoints.append(cors)
+        logger.info(f'corner detection stats: {self.detect_stats_summary()}')
+
+        guess = None
+        if early is not None:
+            _, mtx, dist, _, _ = early.result()
+            executor.shutdown()
+            guess = (mtx, dist)
+        return objpoints, imgpoints, rejected_files, calibrated_files, shape, guess
+
+    # 双目角点检测; progress_cb(done, total, [lfname, rfname], status) 每完成一对图调用一次
+    # early_solve 为 True 时，检测到 early_solve_views 对后在后台线程同时求左右相机的初值，与剩余的检测并行
+    def _detect_stereo_corners(self, leftrootpath: str, rightrootpath: str, leftfilelist: list, rightfilelist: list, parallel: bool, progress_cb=None, early_solve: bool = False):
         objpoints = []  # 3d points in real world space
         imgpoints_left = []  # 2d points in left image plane.
         imgpoints_right = []  # 2d points in right image plane.
         rejected_files = []  # 无法获取角点的图片列表
         calibrated_files = []  # 校准成功的文件列表
 
-        # 尝试读取一张图片，用于后续读取图片尺寸
-        image_for_shape = cv2.imread(
-            os.path.join(leftrootpath, leftfilelist[0]), 0)
-
-        with Pool(min(len(leftfilelist), os.cpu_count())) as p:
-            results = p.map(self._stereo_process_image_corners, [(lf, rf, leftrootpath, rightrootpath) for lf, rf in zip(
-                leftfilelist, rightfilelist)])
-
-        for lfname, rfname, lcors, rcors, status in results:
+        results = {}
+        found_left, found_right = [], []
+        shape = None
+        executor, early = None, None
+        total = min(len(leftfilelist), len(rightfilelist))
+        kept_left, kept_right = leftfilelist, rightfilelist
+        if self.dedup is True:
+            kept_left, kept_right = self._fold_stereo_duplicates(
+                leftrootpath, rightrootpath, leftfilelist, rightfilelist, parallel)
+        # 被合并的重复帧直接计入进度
+        done = 0
+        kept_set = set(zip(kept_left, kept_right))
+        for pair in [p for p in zip(leftfilelist, rightfilelist) if p not in kept_set]:
+            done += 1
+            if progress_cb is not None:
+                progress_cb(done, total, list(pair), 'rejected')
+        for done, result in enumerate(self.iter_stereo_corners(leftrootpath, rightrootpath, kept_left, kept_right, parallel), done+1):
+            lfname, rfname, lcors, rcors, _shape, status, _, stats = result
+            results[(lfname, rfname)] = result
+            self.merge_detect_stats(stats)
+            shape = _shape if shape is None else shape
+            if status != 'rejected':
+                found_left.append(lcors)
+                found_right.append(rcors)
+            if progress_cb is not None:
+                progress_cb(done, total, [lfname, rfname], status)
+            if early_solve is True and early is None and len(found_left) >= self.early_solve_views \
+                    and total - done >= self.early_solve_views:
+                executor = ThreadPoolExecutor(max_workers=2)
+                early = [executor.submit(cv2.calibrateCamera, [self.objp]*len(found), list(found), shape,
+                                         None, None, criteria=self.warm_criteria)
+                         for found in (found_left, found_right)]
+
+        # 结果按原始文件顺序整理
+        for lf, rf in zip(leftfilelist, rightfilelist):
+            if (lf, rf) not in results:
+                rejected_files.append([lf, rf])
+                continue
+            lfname, rfname, lcors, rcors, _, status, _, _ = results[(lf, rf)]
             if status == 'rejected':
                 rejected_files.append([lfname, rfname])
             else:
@@ -525,39 +931,563 @@ class CalibBoard():
                 objpoints.append(self.objp)
                 imgpoints_left.append(lcors)
                 imgpoints_right.append(rcors)
-        # 检查角点size是否为0
-        if len(imgpoints_left) == 0 or len(imgpoints_right) == 0:
-            return False, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, CalibErrType.CAL_CORNER_DET_ERR
-        
+        logger.info(f'corner detection stats: {self.detect_stats_summary()}')
+
+        guess = None
+        if early is not None:
+            (_, mtx_l, dist_l, _, _), (_, mtx_r, dist_r, _, _) = early[0].result(), early[1].result()
+            executor.shutdown()
+            guess = (mtx_l, dist_l, mtx_r, dist_r)
+        return objpoints, imgpoints_left, imgpoints_right, rejected_files, calibrated_files, shape, guess
+
+    # 单目求解; 传入mtx/dist时作为初值(warm start)，同时传入rvecs/tvecs时也作为外参初值
+    # criteria 为 None 时，有初值用 warm_criteria，否则用 criteria
+    def _calibrate_mono(self, objpoints, imgpoints, shape, mtx=None, dist=None, rvecs=None, tvecs=None, criteria=None):
+        self.selected_views = None
+        self.trim_mask = None
+        self.solve_trajectory = {}
+        start = time.time()
+        selected = None
+        if rvecs is None:
+            selected = self._select_subset(objpoints, imgpoints, shape)
+        self._start_budget(start)
+        try:
+            if selected is not None:
+                return self._calibrate_mono_subset(objpoints, imgpoints, shape, selected, mtx, dist, criteria)
+            return self._solve_mono(objpoints, imgpoints, shape, mtx, dist, rvecs, tvecs, criteria=criteria)
+        finally:
+            self._solve_deadline = None
+
+    def _start_budget(self, start):
+        self._solve_deadline = None if self.solve_budget is None else start + self.solve_budget
+
+    # share: 本次求解可使用的剩余时间比例
+    def _remaining_budget(self, share: float = 1.0):
+        if self._solve_deadline is None:
+            return None
+        return max(0.0, self._solve_deadline - time.time())*share
+
+    def _solve_mono(self, objpoints, imgpoints, shape, mtx=None, dist=None, rvecs=None, tvecs=None, share: float = 1.0, label: str = 'mono', criteria=None):
+        if self.engine == 'bundle':
+            self.bundle.n_dist = DIST_MODEL_SIZES[self.dist_model]
+            return self.bundle.calibrate(objpoints, imgpoints, shape, mtx, dist, rvecs, tvecs)
+        budget = self._remaining_budget(share)
+        if budget is not None:
+            result, self.solve_trajectory[label] = self.calibrate_camera_budgeted(
+                objpoints, imgpoints, shape, budget, self.min_rms_gain, mtx, dist, rvecs, tvecs)
+        elif mtx is None:
+            result = cv2.calibrateCameraExtended(
+                objpoints, imgpoints, shape, None, None, flags=DIST_MODELS[self.dist_model], criteria=self.criteria)
+        else:
+            flags = cv2.CALIB_USE_INTRINSIC_GUESS | DIST_MODELS[self.dist_model]
+            if rvecs is not None and tvecs is not None:
+                flags |= cv2.CALIB_USE_EXTRINSIC_GUESS
+            result = cv2.calibrateCameraExtended(
+                objpoints, imgpoints, shape, np.array(mtx, np.float64), np.array(dist, np.float64), rvecs, tvecs,
+                flags=flags, criteria=self.warm_criteria if criteria is None else criteria)
+        # opencv 的 rational 模型也返回 14 个系数，按模型截取
+        return result[:2] + (result[2][:, :DIST_MODEL_SIZES[self.dist_model]],) + result[3:]
+
+    # 双目求解; warm = (mtx_l, dist_l, mtx_r, dist_r, R, T) 时以上一次结果为初值
+    # guess = (mtx_l, dist_l, mtx_r, dist_r) 只作为左右单目求解的初值
+    def _calibrate_stereo(self, objpoints, imgpoints_left, imgpoints_right, shape, warm=None, guess=None):
+        self.selected_views = None
+        self.trim_mask = None
+        self.solve_trajectory = {}
+        start = time.time()
+        selected = None
+        if warm is None:
+            selected = self._select_subset(objpoints, imgpoints_left, shape, imgpoints_right)
+        self._start_budget(start)
+        try:
+            if selected is not None:
+                return self._calibrate_stereo_subset(objpoints, imgpoints_left, imgpoints_right, shape, selected, guess)
+            return self._solve_stereo(objpoints, imgpoints_left, imgpoints_right, shape, warm, guess)
+        finally:
+            self._solve_deadline = None
+
+    # 左右相机的单目求解互不相关，在两个线程中同时进行(opencv 求解时释放 GIL)
+    def _solve_mono_pair(self, objpoints, imgpoints_left, imgpoints_right, shape, guess=None, criteria=None):
+        mtx_l, dist_l, mtx_r, dist_r = (None, None, None, None) if guess is None else guess
+        if self.concurrent_solve is False:
+            # 限时求解时剩余时间在左、右、双目三步之间均分
+            return (self._solve_mono(objpoints, imgpoints_left, shape, mtx_l, dist_l, share=1/3, label='left', criteria=criteria),
+                    self._solve_mono(objpoints, imgpoints_right, shape, mtx_r, dist_r, share=1/2, label='right', criteria=criteria))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # 限时求解时两者各用剩余时间的一半，其余留给双目求解
+            left = executor.submit(self._solve_mono, objpoints, imgpoints_left, shape, mtx_l, dist_l,
+                                   share=1/2, label='left', criteria=criteria)
+            right = executor.submit(self._solve_mono, objpoints, imgpoints_right, shape, mtx_r, dist_r,
+                                    share=1/2, label='right', criteria=criteria)
+            return left.result(), right.result()
+
+    def _solve_stereo(self, objpoints, imgpoints_left, imgpoints_right, shape, warm=None, guess=None):
+        R, T = None, None
+        # 只有 guess(提前求得的初值)时按完整的终止条件求解，warm(上一次的收敛解)时用 warm_criteria
+        criteria = self.criteria
+        if warm is not None:
+            guess, (R, T) = warm[:4], warm[4:]
+            criteria = None
         # single calibrate for each camera
-        ret_l, mtx_l, dist_l, rvecs_l, tvecs_l, stdintri_l, stdextri_l, pererr = cv2.calibrateCameraExtended(
-            objpoints, imgpoints_left, image_for_shape.shape[::-1], None, None, criteria=self.criteria)
-        ret_r, mtx_r, dist_r, rvecs_r, tvecs_r, stdintri_r, stdextri_r, pererr = cv2.calibrateCameraExtended(
-            objpoints, imgpoints_right, image_for_shape.shape[::-1], None, None, criteria=self.criteria)
-
-        # 创建旋转矩阵和平移向量的初始值
-        R = np.eye(3)  # 3x3的单位矩阵
-        T = np.zeros((3, 1))  # 3x1的零向量
-        ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr = cv2.stereoCalibrateExtended(
-            objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, image_for_shape.shape[::-1], R, T, criteria=self.criteria)
-
-        return ret, mtx_l0, dist_l0, mtx_r0, dist_r0, R, T, E, F, rvecs, tvecs, pererr, rejected_files, calibrated_files, image_for_shape.shape[::-1], imgpoints_left, imgpoints_right, CalibErrType.CAL_OK
+        mono_l, mono_r = self._solve_mono_pair(objpoints, imgpoints_left, imgpoints_right, shape, guess, criteria)
+        if self.engine == 'bundle':
+            return self.bundle.stereo_calibrate(objpoints, imgpoints_left, imgpoints_right, shape, mono_l, mono_r, R, T)
+        mtx_l, dist_l, mtx_r, dist_r = mono_l[1], mono_l[2], mono_r[1], mono_r[2]
+        budget = self._remaining_budget()
+        if budget is not None:
+            result, self.solve_trajectory['stereo'] = self.stereo_calibrate_budgeted(
+                objpoints, imgpoints_left, imgpoints_right, shape, budget, self.min_rms_gain,
+                mtx_l, dist_l, mtx_r, dist_r, R, T)
+            return result
+        if R is None:
+            # 创建旋转矩阵和平移向量的初始值
+            R = np.eye(3)  # 3x3的单位矩阵
+            T = np.zeros((3, 1))  # 3x1的零向量
+            return cv2.stereoCalibrateExtended(
+                objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, shape, R, T, criteria=self.criteria)
+        return cv2.stereoCalibrateExtended(
+            objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, shape,
+            np.array(R, np.float64), np.array(T, np.float64).reshape(3, 1),
+            flags=cv2.CALIB_FIX_INTRINSIC | cv2.CALIB_USE_EXTRINSIC_GUESS, criteria=self.warm_criteria)
+
+    # 限时单目求解: 每段迭代 budget_chunk_iters 次后从当前解继续，记录每段结束时的 RMS
+    # RMS 相对改进不超过 min_gain 或下一段会超出 budget(秒) 时停止，至少求解一段
+    # 返回 (calibrateCameraExtended 的结果, [(elapsed, rms), ...])
+    def calibrate_camera_budgeted(self, objpoints, imgpoints, shape, budget: float, min_gain: float = 1e-4,
+                                  mtx=None, dist=None, rvecs=None, tvecs=None):
+        start = time.time()
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, self.budget_chunk_iters, 1e-16)
+        model_flags = DIST_MODELS[self.dist_model]
+        flags = model_flags
+        if mtx is not None:
+            mtx, dist = np.array(mtx, np.float64), np.array(dist, np.float64)
+            flags |= cv2.CALIB_USE_INTRINSIC_GUESS
+            if rvecs is not None and tvecs is not None:
+                flags |= cv2.CALIB_USE_EXTRINSIC_GUESS
+        trajectory = []
+        while True:
+            result = cv2.calibrateCameraExtended(
+                objpoints, imgpoints, shape, mtx, dist, rvecs, tvecs, flags=flags, criteria=criteria)
+            rms, mtx, dist, rvecs, tvecs = result[:5]
+            elapsed = time.time() - start
+            trajectory.append((elapsed, rms))
+            flags = cv2.CALIB_USE_INTRINSIC_GUESS | cv2.CALIB_USE_EXTRINSIC_GUESS | model_flags
+            if len(trajectory) > 1 and trajectory[-2][1] - rms <= min_gain*trajectory[-2][1]:
+                break
+            if elapsed + elapsed/len(trajectory) > budget:
+                break
+        logger.debug(f'budgeted solve: {len(trajectory)} chunks, rms {trajectory[0][1]} -> {trajectory[-1][1]} in {elapsed:.3f}s')
+        return result, trajectory
+
+    # 限时双目求解(固定内参)，规则同 calibrate_camera_budgeted
+    # 返回 (stereoCalibrateExtended 的结果, [(elapsed, rms), ...])
+    def stereo_calibrate_budgeted(self, objpoints, imgpoints_left, imgpoints_right, shape, budget: float, min_gain: float = 1e-4,
+                                  mtx_l=None, dist_l=None, mtx_r=None, dist_r=None, R=None, T=None):
+        start = time.time()
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, self.budget_chunk_iters, 1e-16)
+        flags = cv2.CALIB_FIX_INTRINSIC
+        if R is not None and T is not None:
+            R, T = np.array(R, np.float64), np.array(T, np.float64).reshape(3, 1)
+            flags |= cv2.CALIB_USE_EXTRINSIC_GUESS
+        else:
+            R, T = np.eye(3), np.zeros((3, 1))
+        trajectory = []
+        while True:
+            result = cv2.stereoCalibrateExtended(
+                objpoints, imgpoints_left, imgpoints_right, mtx_l, dist_l, mtx_r, dist_r, shape, R, T,
+                flags=flags, criteria=criteria)
+            rms, R, T = result[0], result[5], result[6]
+            elapsed = time.time() - start
+            trajectory.append((elapsed, rms))
+            flags = cv2.CALIB_FIX_INTRINSIC | cv2.CALIB_USE_EXTRINSIC_GUESS
+            if len(trajectory) > 1 and trajectory[-2][1] - rms <= min_gain*trajectory[-2][1]:
+                break
+            if elapsed + elapsed/len(trajectory) > budget:
+                break
+        return result, trajectory
+
+    # 在训练视角上拟合畸变模型，返回 (model, 训练 RMS, 留出视角的误差平方和, 留出视角的角点数)
+    # 留出视角的位姿用拟合的内参由 solvePnP 求得
+    def fit_distortion_model(self, args):
+        model, train, test, shape = args
+        ret, mtx, dist = cv2.calibrateCameraExtended(
+            [self.objp]*len(train), train, shape, None, None, flags=DIST_MODELS[model], criteria=self.model_criteria)[:3]
+        rvecs, tvecs = self._estimate_poses(test, mtx, dist, {})
+        _, residuals, _, _ = reprojection_residuals(self.objp, test, rvecs, tvecs, mtx, dist)
+        return model, ret, float((residuals**2).sum()), residuals.shape[0]*residuals.shape[1]
+
+    def select_distortion_model(self, imgpoints, shape, imgpoints_right=None, parallel: bool = True):
+        '''
+        k-fold comparison of the candidate distortion models on the detected corners,
+        views are assigned to folds round-robin, every (model, camera, fold) fit is an independent task
+        return (best model, comparison table) or (self.dist_model, None) when there are too few views
+        table columns: model, coeffs, train_rms, heldout_rms
+        '''
+        n = len(imgpoints)
+        k = min(self.model_folds, n//2)
+        if k < 2:
+            logger.warning(f'too few views ({n}) for distortion model selection')
+            return self.dist_model, None
+        tasks = []
+        for model in self.model_candidates:
+            for pts in (imgpoints, imgpoints_right):
+                if pts is None:
+                    continue
+                for fold in range(k):
+                    train = [pts[i] for i in range(n) if i % k != fold]
+                    test = [pts[i] for i in range(n) if i % k == fold]
+                    tasks.append((model, train, test, shape))
+        results = []
+        if parallel is True:
+            for _, result, reason in SHARED_POOL.imap_deadline(
+                    self.board_config, _model_task, tasks, cancel_event=self.cancel_event):
+                if reason is None:
+                    results.append(result)
+        else:
+            for task in tasks:
+                if self.cancel_event.is_set():
+                    break
+                results.append(self.fit_distortion_model(task))
+        if len(results) < len(tasks):
+            return self.dist_model, None
+
+        rows = []
+        for model in self.model_candidates:
+            fits = [r for r in results if r[0] == model]
+            rows.append([model, DIST_MODEL_SIZES[model], float(np.mean([r[1] for r in fits])),
+                         float(np.sqrt(sum(r[2] for r in fits)/sum(r[3] for r in fits)))])
+        table = pd.DataFrame(rows, columns=['model', 'coeffs', 'train_rms', 'heldout_rms'])
+        limit = table['heldout_rms'].min()*(1 + self.model_tolerance)
+        best = table[table['heldout_rms'] <= limit].sort_values('coeffs').iloc[0]['model']
+        logger.info(f'distortion model selection, best {best}:\n{table.to_string(index=False)}')
+        return best, table
+
+    def _apply_model_selection(self, imgpoints, shape, imgpoints_right=None, parallel: bool = True):
+        if self.select_model is True and len(imgpoints) > 0 and not self.cancel_event.is_set():
+            self.dist_model, self.model_table = self.select_distortion_model(imgpoints, shape, imgpoints_right, parallel)
+
+    # 在重采样的视角上以完整解为初值重新求解，返回 [fx, fy, cx, cy, 畸变系数...]
+    def fit_resample(self, args):
+        imgpoints, shape, mtx, dist = args
+        size = np.size(dist)
+        flags = cv2.CALIB_USE_INTRINSIC_GUESS | DIST_MODELS[dist_model_of(dist)]
+        _, mtx, dist = cv2.calibrateCameraExtended(
+            [self.objp]*len(imgpoints), imgpoints, shape, np.array(mtx, np.float64), np.array(dist, np.float64),
+            None, None, flags=flags, criteria=self.warm_criteria)[:3]
+        return np.concatenate(([mtx[0, 0], mtx[1, 1], mtx[0, 2], mtx[1, 2]], np.ravel(dist)[:size]))
+
+    def estimate_uncertainty(self, imgpoints, shape, mtx, dist, stdintri=None, method: str = 'bootstrap', parallel: bool = True):
+        '''
+        stability of the intrinsics under view resampling, every resample is solved on the worker pool
+        bootstrap: uncertainty_samples draws with replacement, percentile interval
+        kfold: leave one of model_folds folds out, jackknife standard error, normal interval
+        return {'method', 'samples', 'level', 'parameters': {name: {'value', 'std', 'spread', 'ci'}}}
+        'std' is the opencv standard deviation, 'spread' the standard error from resampling,
+        None when there are too few views or the run was cancelled
+        '''
+        n = len(imgpoints)
+        if method == 'kfold':
+            k = min(self.model_folds, n)
+            samples = [[i for i in range(n) if i % k != fold] for fold in range(k)]
+        else:
+            rng = np.random.default_rng(self.uncertainty_seed)
+            samples = [rng.integers(0, n, n) for _ in range(self.uncertainty_samples)]
+        if n < 3 or len(samples) < 2:
+            logger.warning(f'too few views ({n}) for uncertainty estimation')
+            return None
+        tasks = [([imgpoints[i] for i in idx], shape, mtx, dist) for idx in samples]
+        results = []
+        if parallel is True:
+            for _, result, reason in SHARED_POOL.imap_deadline(
+                    self.board_config, _resample_task, tasks, cancel_event=self.cancel_event):
+                if reason is None:
+                    results.append(result)
+        else:
+            for task in tasks:
+                if self.cancel_event.is_set():
+                    break
+                results.append(self.fit_resample(task))
+        if len(results) < len(tasks):
+            return None
+
+        est = np.array(results)
+        value = np.concatenate(([mtx[0, 0], mtx[1, 1], mtx[0, 2], mtx[1, 2]], np.ravel(dist)))
+        alpha = 1 - self.uncertainty_level
+        if method == 'kfold':
+            spread = np.sqrt((len(est) - 1)/len(est)*((est - est.mean(axis=0))**2).sum(axis=0))
+            z = norm.ppf(1 - alpha/2)
+            lo, hi = value - z*spread, value + z*spread
+        else:
+            spread = est.std(axis=0, ddof=1)
+            lo, hi = np.percentile(est, [100*alpha/2, 100*(1 - alpha/2)], axis=0)
+        parameters = {}
+        for i, name in enumerate(INTRINSIC_NAMES[:len(value)]):
+            parameters[name] = {'value': float(value[i]),
+                                'std': None if stdintri is None else float(np.ravel(stdintri)[i]),
+                                'spread': float(spread[i]), 'ci': [float(lo[i]), float(hi[i])]}
+        return {'method': method, 'samples': len(est), 'level': self.uncertainty_level, 'parameters': parameters}
+
+    # 保存 opencv 标准差，并按需评估稳定性
+    def _record_uncertainty(self, imgpoints, shape, mtx, dist, stdintri, stdextri, parallel: bool = True):
+        self.std_intrinsics, self.std_extrinsics = stdintri, stdextri
+        self.uncertainty_report = None
+        if self.uncertainty is not None and not self.cancel_event.is_set():
+            self.uncertainty_report = self.estimate_uncertainty(
+                imgpoints, shape, mtx, dist, stdintri, self.uncertainty, parallel)
+            if self.uncertainty_report is not None:
+                ci = {k: [round(x, 4) for x in v['ci']] for k, v in self.uncertainty_report['parameters'].items()}
+                logger.info(f'{self.uncertainty} {self.uncertainty_level:.0%} intervals: {ci}')
+
+    # 每个视角的选择特征: 覆盖的图像网格、标定板法向(倾斜)、距离的对数
+    # 用假设的内参(f=max(w,h)，主点在图像中心)由单应分解，只用于比较视角之间的差异
+    def _view_features(self, imgpoints, shape, grid=(8, 6)):
+        w, h = shape
+        f = float(max(w, h))
+        Kinv = np.linalg.inv(np.array([[f, 0, w/2], [0, f, h/2], [0, 0, 1]]))
+        pts = np.asarray(imgpoints, np.float64).reshape(len(imgpoints), -1, 2)
+        # 角点落在哪些网格
+        gx = np.clip((pts[..., 0]*grid[0]/w).astype(int), 0, grid[0]-1)
+        gy = np.clip((pts[..., 1]*grid[1]/h).astype(int), 0, grid[1]-1)
+        occ = np.zeros((len(pts), grid[0]*grid[1]), bool)
+        occ[np.arange(len(pts))[:, None], gy*grid[0] + gx] = True
+        tilts = np.zeros((len(pts), 2))
+        logd = np.zeros(len(pts))
+        for i, p in enumerate(pts):
+            H, _ = cv2.findHomography(self.objp[:, :2], p)
+            if H is None:
+                continue
+            B = Kinv @ H
+            lam = 1.0/np.linalg.norm(B[:, 0])
+            normal = np.cross(B[:, 0]*lam, B[:, 1]*lam)
+            normal /= np.linalg.norm(normal)
+            tilts[i] = normal[:2]*np.sign(normal[2])
+            logd[i] = np.log(max(abs(B[2, 2]*lam), 1e-6))
+        return occ, tilts, logd
+
+    # 贪心选择信息量最大的 n 个视角: 新增的网格覆盖 + 倾斜方向差异 + 距离差异，返回按选择顺序排列的序号
+    def select_views(self, imgpoints, shape, n, imgpoints_right=None):
+        occ, tilts, logd = self._view_features(imgpoints, shape)
+        if imgpoints_right is not None:
+            occ = np.hstack((occ, self._view_features(imgpoints_right, shape)[0]))
+        count = np.zeros(occ.shape[1])
+        min_tilt = np.full(len(occ), np.inf)
+        min_dist = np.full(len(occ), np.inf)
+        dist_scale = max(np.ptp(logd), 1e-6)
+        order = []
+        available = np.ones(len(occ), bool)
+        for _ in range(min(n, len(occ))):
+            # 每个网格被覆盖得越少，新增覆盖的权重越大
+            coverage = (occ/(1.0 + count)).sum(axis=1)/occ.shape[1]
+            if len(order) == 0:
+                score = coverage
+            else:
+                score = coverage + np.minimum(min_tilt, 1.0) + np.minimum(min_dist/dist_scale, 1.0)
+            score[~available] = -np.inf
+            idx = int(np.argmax(score))
+            order.append(idx)
+            available[idx] = False
+            count += occ[idx]
+            min_tilt = np.minimum(min_tilt, np.linalg.norm(tilts - tilts[idx], axis=1))
+            min_dist = np.minimum(min_dist, np.abs(logd - logd[idx]))
+        return order
+
+    # 返回参与求解的视角序号，None 表示使用全部视角
+    def _select_subset(self, objpoints, imgpoints, shape, imgpoints_right=None):
+        n = len(imgpoints)
+        limit = n if self.max_views is None else min(n, self.max_views)
+        if limit >= n and (self.solve_budget is None or n <= self.budget_pilot_views):
+            return None
+        order = self.select_views(imgpoints, shape, limit, imgpoints_right)
+        if self.solve_budget is not None and limit > self.budget_pilot_views:
+            # 试算一次小规模求解，LM 求解耗时约随视角数的三次方增长，双目约为单目的三倍
+            pilot = order[:self.budget_pilot_views]
+            start = time.time()
+            self._solve_mono([objpoints[i] for i in pilot], [imgpoints[i] for i in pilot], shape)
+            cost = max(time.time() - start, 1e-6)*(1 if imgpoints_right is None else 3)
+            limit = min(limit, max(len(pilot), int(len(pilot)*(self.solve_budget/cost)**(1/3))))
+        if limit >= n:
+            return None
+        logger.info(f'solve on {limit} of {n} views')
+        return sorted(order[:limit])
+
+    # 用已求得的内参计算所有视角的位姿，已知位姿的视角(poses: {序号: (rvec, tvec)})直接使用
+    def _estimate_poses(self, imgpoints, mtx, dist, poses: dict):
+        rvecs, tvecs = [], []
+        for i, cors in enumerate(imgpoints):
+            if i in poses:
+                rvec, tvec = poses[i]
+            else:
+                _, rvec, tvec = cv2.solvePnP(self.objp, cors, mtx, dist)
+            rvecs.append(np.asarray(rvec, np.float64).reshape(3, 1))
+            tvecs.append(np.asarray(tvec, np.float64).reshape(3, 1))
+        return rvecs, tvecs
+
+    # 所有视角的逐点平方误差 (N,P)
+    @staticmethod
+    def _view_sq_errors(objpoints, imgpoints, rmats, tvecs, mtx, dist):
+        proj = project_points_batch(objpoints, rmats, tvecs, mtx, dist)
+        pts = np.asarray(imgpoints, np.float64).reshape(proj.shape)
+        return ((proj - pts)**2).sum(axis=-1)
+
+    def _calibrate_mono_subset(self, objpoints, imgpoints, shape, selected, mtx=None, dist=None, criteria=None):
+        ret, mtx, dist, rvecs, tvecs, stdintri, stdextri, _ = self._solve_mono(
+            [objpoints[i] for i in selected], [imgpoints[i] for i in selected], shape, mtx, dist, criteria=criteria)
+        rvecs, tvecs = self._estimate_poses(
+            imgpoints, mtx, dist, dict(zip(selected, zip(rvecs, tvecs))))
+        _, _, perverrs, stats = reprojection_residuals(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+        perverrs = perverrs.reshape(-1, 1)
+        # 未参与求解的视角没有外参标准差
+        stdextri_all = np.full((6*len(imgpoints), 1), np.nan)
+        for k, i in enumerate(selected):
+            stdextri_all[6*i:6*i+6] = stdextri[6*k:6*k+6]
+        self.selected_views = selected
+        logger.info(f'subset rms {ret}, all views rms {stats["rms"]}')
+        return stats['rms'], mtx, dist, tuple(rvecs), tuple(tvecs), stdintri, stdextri_all, perverrs
+
+    def _calibrate_stereo_subset(self, objpoints, imgpoints_left, imgpoints_right, shape, selected, guess=None):
+        ret, mtx_l, dist_l, mtx_r, dist_r, R, T, E, F, rvecs, tvecs, _ = self._solve_stereo(
+            [objpoints[i] for i in selected], [imgpoints_left[i] for i in selected],
+            [imgpoints_right[i] for i in selected], shape, guess=guess)
+        rvecs, tvecs = self._estimate_poses(
+            imgpoints_left, mtx_l, dist_l, dict(zip(selected, zip(rvecs, tvecs))))
+        rmats_l = rodrigues_batch(np.hstack(rvecs).T)
+        tvecs_l = np.hstack(tvecs).T
+        # 右相机位姿 = R * 左相机位姿 + T
+        rmats_r = np.einsum('ij,njk->nik', R, rmats_l)
+        tvecs_r = tvecs_l @ R.T + np.asarray(T).reshape(1, 3)
+        err2_l = self._view_sq_errors(objpoints, imgpoints_left, rmats_l, tvecs_l, mtx_l, dist_l)
+        err2_r = self._view_sq_errors(objpoints, imgpoints_right, rmats_r, tvecs_r, mtx_r, dist_r)
+        perverrs = np.stack((np.sqrt(err2_l.mean(axis=1)), np.sqrt(err2_r.mean(axis=1))), axis=1)
+        rms = float(np.sqrt((err2_l.mean() + err2_r.mean())/2))
+        self.selected_views = selected
+        logger.info(f'subset rms {ret}, all views rms {rms}')
+        return rms, mtx_l, dist_l, mtx_r, dist_r, R, T, E, F, tuple(rvecs), tuple(tvecs), perverrs
+
+    # 鲁棒阈值: 中位数 + k 倍 MAD 估计的标准差，不低于 floor
+    @staticmethod
+    def _robust_threshold(values, k: float, floor: float):
+        med = np.median(values)
+        return max(floor, float(med + k*1.4826*np.median(np.abs(values - med))))
+
+    # 一轮剔除; err2 (n,P) 为保留视角全部角点的平方误差，mask (n,P) 为参与求解的角点，原地更新
+    # 先剔除离群角点，再按剩余角点的 rms 剔除视角，返回本轮剔除的视角在 kept 中的位置
+    def _trim_round(self, rnd: int, err2, mask, kept: list, names: list, max_drop: int):
+        err = np.sqrt(err2)
+        if self.engine != 'bundle':
+            corner_th = self._robust_threshold(err[mask], self.trim_corner_k, self.trim_corner_floor)
+            bad = mask & (err > corner_th)
+            # 离群角点会拉偏位姿，使相邻角点的误差也变大，每轮每个视角只剔除误差最大的一个
+            worst = np.argmax(np.where(mask, err, -1), axis=1)
+            for j in np.flatnonzero(bad.any(axis=1)):
+                # 离群角点过多的视角留给视角阈值判断
+                if (mask[j] & ~bad[j]).sum() < self.trim_min_corners*mask.shape[1]:
+                    continue
+                mask[j, worst[j]] = False
+                self.trim_log.append((rnd, 'corner', names[kept[j]], int(worst[j]), float(err[j, worst[j]]), corner_th))
+        view_err = np.sqrt((err2*mask).sum(axis=1)/mask.sum(axis=1))
+        view_th = self._robust_threshold(view_err, self.trim_view_k, self.trim_view_floor)
+        drop = []
+        for j in np.argsort(-view_err)[:max(max_drop, 0)]:
+            if view_err[j] <= view_th:
+                break
+            name = names[kept[j]]
+            drop.append(j)
+            self.trim_log.append((rnd, 'view', name, None, float(view_err[j]), view_th))
+            self._record_reject(tuple(name) if isinstance(name, list) else name,
+                                'rejected', f'outlier view (rms {view_err[j]:.2f})')
+        return drop
+
+    # 迭代剔除离群视角和角点，每轮以上一轮的解为初值重新求解，没有新的剔除时停止
+    # sq_errors(kept, result) 返回保留视角全部角点的平方误差 (n,P)
+    # solve(kept, mask, result, local) 返回新的求解结果，local 为保留视角在上一轮中的位置
+    def _trim_outliers(self, n: int, names: list, result, sq_errors, solve):
+        self.trim_log = []
+        kept = list(range(n))
+        mask = None
+        max_total = min(int(self.trim_max_fraction*n), n - self.trim_min_views)
+        for rnd in range(1, self.trim_max_rounds+1):
+            if self.cancel_event.is_set():
+                break
+            err2 = sq_errors(kept, result)
+            mask = np.ones(err2.shape, bool) if mask is None else mask
+            count = mask.sum()
+            drop = self._trim_round(rnd, err2, mask, kept, names, max_total - (n - len(kept)))
+            trimmed = count - mask.sum()
+            if len(drop) == 0 and trimmed == 0:
+                break
+            local = [j for j in range(len(kept)) if j not in drop]
+            kept, mask = [kept[j] for j in local], mask[local]
+            result = solve(kept, mask, result, local)
+            logger.info(f'trim round {rnd}: dropped {len(drop)} views, {trimmed} corners, rms {result[0]}')
+        if mask is not None and not mask.all():
+            self.trim_mask = mask
+        return result, kept
+
+    # 单目离群剔除，result 为 _calibrate_mono 的结果，返回 (新的结果, 保留的视角序号)
+    def trim_mono_outliers(self, objpoints, imgpoints, shape, result, names: list):
+        def sq_errors(kept, result):
+            return self._view_sq_errors(
+                np.asarray([objpoints[i] for i in kept]), [imgpoints[i] for i in kept],
+                rodrigues_batch(np.hstack(result[3]).T), np.hstack(result[4]).T, result[1], result[2])
+
+        def solve(kept, mask, result, local):
+            return self._solve_mono(
+                [objpoints[i][m] for i, m in zip(kept, mask)], [imgpoints[i][m] for i, m in zip(kept, mask)],
+                shape, result[1], result[2], [result[3][j] for j in local], [result[4][j] for j in local])
+        return self._trim_outliers(len(imgpoints), names, result, sq_errors, solve)
+
+    # 双目离群剔除，每个角点取左右误差的较大值，左右图中的同一角点一起剔除
+    def trim_stereo_outliers(self, objpoints, imgpoints_left, imgpoints_right, shape, result, names: list):
+        def sq_errors(kept, result):
+            _, mtx_l, dist_l, mtx_r, dist_r, R, T = result[:7]
+            objs = np.asarray([objpoints[i] for i in kept])
+            rmats_l = rodrigues_batch(np.hstack(result[9]).T)
+            tvecs_l = np.hstack(result[10]).T
+            # 右相机位姿 = R * 左相机位姿 + T
+            rmats_r = np.einsum('ij,njk->nik', R, rmats_l)
+            tvecs_r = tvecs_l @ R.T + np.asarray(T).reshape(1, 3)
+            return np.maximum(
+                self._view_sq_errors(objs, [imgpoints_left[i] for i in kept], rmats_l, tvecs_l, mtx_l, dist_l),
+                self._view_sq_errors(objs, [imgpoints_right[i] for i in kept], rmats_r, tvecs_r, mtx_r, dist_r))
+
+        def solve(kept, mask, result, local):
+            return self._solve_stereo(
+                [objpoints[i][m] for i, m in zip(kept, mask)], [imgpoints_left[i][m] for i, m in zip(kept, mask)],
+                [imgpoints_right[i][m] for i, m in zip(kept, mask)], shape, warm=result[1:7])
+        return self._trim_outliers(len(imgpoints_left), names, result, sq_errors, solve)
+
+    # 按剔除结果拆分文件列表，被剔除的视角计入 rejected_files
+    @staticmethod
+    def _split_trimmed(kept: list, calibrated_files: list, rejected_files: list):
+        kept_set = set(kept)
+        dropped = [f for i, f in enumerate(calibrated_files) if i not in kept_set]
+        return [calibrated_files[i] for i in kept], rejected_files + dropped
 
     # 重投影误差
 
     def rpje(self, corners, r, t, cameraMatrix, distCoeffs):
-        points_number = self.ROW_COR*self.COL_COR
-        imgpts, _ = cv2.projectPoints(
-            self.objp, r, t, cameraMatrix, distCoeffs)
-
-        err = np.linalg.norm(
-            (imgpts.reshape(points_number, -1) - corners.reshape(points_number, -1)), axis=1)
-        sum_err = np.sum(err**2)
-        err_rms = np.sqrt(sum_err/points_number)
-        return err_rms
+        _, _, perview, _ = reprojection_residuals(
+            self.objp, [corners], [r], [t], cameraMatrix, distCoeffs)
+        return perview[0]
+
+    # 所有视角的重投影，返回 (projected (N,P,2), residuals (N,P,2), per-view rms (N,), stats)
+    def reproject_views(self, imgpoints, rvecs, tvecs, cameraMatrix, distCoeffs):
+        return reprojection_residuals(self.objp, imgpoints, rvecs, tvecs, cameraMatrix, distCoeffs)
+
+    # 参与求解的角点 (N,P) bool，自动剔除的角点为 False
+    def used_corners(self, shape):
+        if self.trim_mask is None:
+            return np.ones(shape, bool)
+        return np.asarray(self.trim_mask, bool).reshape(shape)
+
+    # 每个视角只统计参与求解的角点的 rms，residuals 为 reproject_views 返回的 (N,P,2)
+    def used_view_rms(self, residuals):
+        err2 = (np.asarray(residuals, np.float64)**2).sum(axis=-1)
+        used = self.used_corners(err2.shape)
+        return np.sqrt((err2*used).sum(axis=1)/used.sum(axis=1))
 
     # 查找角点
-    def find_corners(self, grayimg: np.array):
+    def find_corners(self, grayimg: np.array, stats: dict = None):
         if self.use_libcbdet: # https://www.cvlibs.net/software/libcbdetect/
             cors , score = detect_checkerboard(grayimg, (self.COL_COR, self.ROW_COR))
             if score < 1.0:
@@ -567,8 +1497,17 @@ class CalibBoard():
         else:
             if self.calib_pattern == CalibPatternType.CHARUCO:
                 ret, sub_corners = False, None
-            ret, sub_corners = cv2.findChessboardCornersSB(
-                grayimg, (self.ROW_COR, self.COL_COR), cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_EXHAUSTIVE | cv2.CALIB_CB_ACCURACY | cv2.CALIB_CB_MARKER)
+            if self.pyramid is True and self.pyramid_verified is not False:
+                ret, sub_corners = self._find_corners_pyramid(grayimg, stats)
+                if ret is True and self.pyramid_verified is None:
+                    ok, dev = self.check_pyramid_accuracy(grayimg, sub_corners, stats)
+                    # 原图上也找不到角点时无法校验，留给下一张图
+                    if dev is not None:
+                        self._set_pyramid_verified(ok, dev)
+                        ret = ok
+                if ret is True:
+                    return ret, sub_corners
+            ret, sub_corners = self._find_corners_full(grayimg, stats)
             if ret is True:
                 # remove cornerSubPix call due to findChessboardCornersSB already included the subpix
                 # sub_corners = cv2.cornerSubPix(
@@ -577,17 +1516,195 @@ class CalibBoard():
             else:
                 return ret, None
 
+    def _find_corners_full(self, grayimg: np.array, stats: dict = None):
+        size = (self.ROW_COR, self.COL_COR)
+        stats = self.detect_stats if stats is None else stats
+        if self.cascade is not True:
+            start = time.time()
+            ret, cors = cv2.findChessboardCornersSB(grayimg, size, SB_FLAGS)
+            self._record_stage(stats, 'exhaustive', ret, start)
+            return ret, cors
+
+        # 1. 缩小图上快速判断是否存在棋盘格
+        start = time.time()
+        scale = max(1.0, max(grayimg.shape[:2]) / self.presence_max_side)
+        small = cv2.resize(grayimg, None, fx=1.0/scale, fy=1.0/scale, interpolation=cv2.INTER_AREA)
+        present = cv2.checkChessboard(small, size)
+        self._record_stage(stats, 'presence', present, start)
+        # 2. 非穷举检测，大部分清晰图片在这一步就能找到
+        # 高分辨率图中较小的标定板在缩小图上可能检测不到，此时跳过这一步直接穷举检测，而不是拒绝
+        if present is True:
+            start = time.time()
+            ret, cors = cv2.findChessboardCornersSB(grayimg, size, SB_FAST_FLAGS)
+            self._record_stage(stats, 'fast', ret, start)
+            if ret is True:
+                return ret, cors
+        # 3. 穷举检测
+        start = time.time()
+        ret, cors = cv2.findChessboardCornersSB(grayimg, size, SB_FLAGS)
+        self._record_stage(stats, 'exhaustive', ret, start)
+        return ret, cors
+
+    @staticmethod
+    def new_detect_stats():
+        return {stage: {'calls': 0, 'hits': 0, 'seconds': 0.0} for stage in DETECT_STAGES}
+
+    @staticmethod
+    def _record_stage(stats: dict, stage: str, hit: bool, start_time: float):
+        stats[stage]['calls'] += 1
+        stats[stage]['hits'] += int(hit is True)
+        stats[stage]['seconds'] += time.time() - start_time
+
+    # 合并工作进程返回的统计
+    def merge_detect_stats(self, stats: dict):
+        for stage, v in stats.items():
+            for k in v:
+                self.detect_stats[stage][k] += v[k]
+
+    # 各阶段命中率及耗时
+    def detect_stats_summary(self):
+        summary = {}
+        for stage, v in self.detect_stats.items():
+            rate = v['hits'] / v['calls'] if v['calls'] > 0 else None
+            summary[stage] = {'calls': v['calls'], 'hits': v['hits'], 'hit_rate': rate, 'seconds': v['seconds']}
+        return summary
+
+    # 金字塔缩放倍数(2的幂)，使长边不超过 pyramid_max_side
+    def _pyramid_scale(self, grayimg: np.array):
+        scale = 1
+        while max(grayimg.shape[:2]) / scale > self.pyramid_max_side:
+            scale *= 2
+        return scale
+
+    # 由粗到细：缩小图上检测，原图上在小窗口内细化; 整体记入 'pyramid_detect'
+    def _find_corners_pyramid(self, grayimg: np.array, stats: dict = None):
+        stats = self.detect_stats if stats is None else stats
+        scale = self._pyramid_scale(grayimg)
+        if scale == 1:
+            return False, None
+        start = time.time()
+        ret, cors = self._coarse_to_fine(grayimg, scale)
+        self._record_stage(stats, 'pyramid_detect', ret, start)
+        return ret, cors
+
+    def _coarse_to_fine(self, grayimg: np.array, scale: int):
+        small = cv2.resize(grayimg, None, fx=1.0/scale, fy=1.0/scale, interpolation=cv2.INTER_AREA)
+        # 缩小图上的各阶段不计入原图检测的统计
+        ret, cors = self._find_corners_full(small, self.new_detect_stats())
+        if ret is not True:
+            return False, None
+
+        # 像素中心对齐后放大到原图坐标
+        est = ((cors + 0.5) * scale - 0.5).astype(np.float32)
+        # 细化窗口取0.4个格子，既覆盖放大后的误差，又不会跨到相邻角点
+        grid = est.reshape(self.COL_COR, self.ROW_COR, 2)
+        spacing = min(np.min(np.linalg.norm(np.diff(grid, axis=0), axis=2)),
+                      np.min(np.linalg.norm(np.diff(grid, axis=1), axis=2)))
+        win = int(0.4*spacing)
+        if win < 2:
+            return False, None
+        refined = cv2.cornerSubPix(grayimg, est.copy(), (win, win), (-1, -1), self.subpix_criteria)
+
+        # 细化位移超过一个缩放单元，说明粗检测不可靠
+        shift = np.linalg.norm((refined - est).reshape(-1, 2), axis=1)
+        if np.max(shift) > scale:
+            logger.debug(f'pyramid refine shift {np.max(shift):.3f} too large, fallback to full resolution')
+            return False, None
+        return True, refined
+
+    # 与原图检测结果对比，返回 (是否在容限内, 平均偏差); 原图检测记入 'pyramid_verify'
+    def check_pyramid_accuracy(self, grayimg: np.array, pyramid_corners=None, stats: dict = None):
+        stats = self.detect_stats if stats is None else stats
+        if pyramid_corners is None:
+            ret, pyramid_corners = self._find_corners_pyramid(grayimg, stats)
+            if ret is not True:
+                return False, None
+        start = time.time()
+        ret, full_corners = self._find_corners_full(grayimg, self.new_detect_stats())
+        if ret is not True:
+            self._record_stage(stats, 'pyramid_verify', False, start)
+            return False, None
+        dev = np.mean(np.linalg.norm((pyramid_corners - full_corners).reshape(-1, 2), axis=1))
+        ok = bool(dev <= self.pyramid_tol)
+        self._record_stage(stats, 'pyramid_verify', ok, start)
+        return ok, float(dev)
+
+    def _set_pyramid_verified(self, ok: bool, dev: float):
+        self.pyramid_verified = ok
+        self.board_config['pyramid_verified'] = ok
+        if ok is not True:
+            logger.warning(f'pyramid corners deviate {dev:.3f}px from full resolution, pyramid detection disabled')
+
+    # 多进程检测前在主进程中用前几张图校验一次，避免每个工作进程各自重复校验
+    def verify_pyramid(self, paths: list, max_tries: int = 3):
+        if self.pyramid is not True or self.use_libcbdet or self.pyramid_verified is not None:
+            return self.pyramid_verified
+        for path in paths[:max_tries]:
+            img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            ok, dev = self.check_pyramid_accuracy(img)
+            if dev is not None:
+                self._set_pyramid_verified(ok, dev)
+                break
+        return self.pyramid_verified
+
+    # 角点检测相关的设置，作为角点缓存key的一部分
+    def detector_signature(self):
+        sig = f'{self.calib_pattern.name}|{self.ROW_COR}x{self.COL_COR}|libcbdet={self.use_libcbdet}'
+        if self.pyramid is True:
+            sig += f'|pyramid={self.pyramid_max_side}'
+        if self.cascade is True:
+            # 各级的参数及存在性检测失败后直接穷举(不拒绝)，任何一项改变都会使旧缓存失效
+            sig += f'|cascade=presence{self.presence_max_side}:fast{SB_FAST_FLAGS}:exhaustive{SB_FLAGS}:fallthrough'
+        if self.quality is not None:
+            sig += f'|prescreen={self.quality.signature()}'
+        return sig
+
+    # 从文件查找角点，优先读取角点缓存; 返回 (ret, cors, (w, h), reason)，reason 为拒绝原因
+    def find_corners_in_file(self, filepath: str, stats: dict = None):
+        stats = self.detect_stats if stats is None else stats
+        buf = np.fromfile(filepath, dtype=np.uint8)
+        key = None
+        if self.corner_cache is not None:
+            start = time.time()
+            key = CornerCache.make_key(
+                CornerCache.content_hash(buf), self.detector_signature())
+            hit, ret, cors, shape, reason = self.corner_cache.load(key)
+            self._record_stage(stats, 'cached', hit, start)
+            if hit is True:
+                return ret, cors, shape, reason
+
+        img = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+        shape = img.shape[::-1]
+        reason = None
+        if self.quality is not None:
+            start = time.time()
+            ok, reason = self.quality.check(img)
+            self._record_stage(stats, 'prescreen', ok, start)
+            if ok is not True:
+                ret, cors = False, None
+            elif self.quality.pattern_size is not None:
+                # 只记录命中率，看不到标定板的图片仍然进行检测
+                start = time.time()
+                self._record_stage(stats, 'prescreen_board', self.quality.board_visible(img), start)
+        if reason is None:
+            ret, cors = self.find_corners(img, stats)
+            reason = None if ret is True else 'no corners'
+        if key is not None:
+            self.corner_cache.save(key, ret, cors, shape, reason)
+        return ret, cors, shape, reason
+
     # 计算单张棋盘格的R,T
     def calculate_img_rt(self, grayimg, cameraMatrix, distCoeffs, vis=False):
         _, cors = self.find_corners(grayimg)
         if _ is not True:
             return None, None, None
 
-        ret, rvecs, tvecs, inliers = cv2.solvePnPRansac(
-            self.objp, cors.reshape(-1, 2), cameraMatrix, distCoeffs)
+        R, tvecs = self._solve_img_rt(cors, cameraMatrix, distCoeffs)
         if vis is True:
             imgpts, _ = cv2.projectPoints(
-                self.objp, rvecs, tvecs, cameraMatrix, distCoeffs)
+                self.objp, cv2.Rodrigues(R)[0], tvecs, cameraMatrix, distCoeffs)
             ret = None
             img = cv2.drawChessboardCorners(
                 grayimg, (self.ROW_COR, self.COL_COR), cors, ret)
@@ -596,26 +1713,38 @@ class CalibBoard():
             cv2.imshow('image', img)
             cv2.waitKey(1)
 
-        R, _ = cv2.Rodrigues(rvecs)
-
         return R, tvecs, cors
 
+    def _solve_img_rt(self, cors, cameraMatrix, distCoeffs):
+        ret, rvecs, tvecs, inliers = cv2.solvePnPRansac(
+            self.objp, cors.reshape(-1, 2), cameraMatrix, distCoeffs)
+        R, _ = cv2.Rodrigues(rvecs)
+        return R, tvecs
+
     def calculate_img_rt_mono(self, args):
-        rej_flag = False
         root, filename, mtx, dist = args
-        img = cv2.imread(os.path.join(root, filename), 0)
-        R, tvecs, cors = self.calculate_img_rt(img, mtx, dist)
+        ret, cors, _, _ = self.find_corners_in_file(os.path.join(root, filename))
         # 记录无法检测角点的文件名
-        if R is None:
-            rej_flag = True
-        return (R, tvecs, rej_flag, cors)
+        if ret is not True:
+            return (None, None, True, None)
+        R, tvecs = self._solve_img_rt(cors, mtx, dist)
+        return (R, tvecs, False, cors)
 
     # 多线程计算棋盘格R,T
     @timer_decorator
-    def calculate_img_rt_parallel(self, root, imagelist, mtx, dist):
-        with Pool(min(len(imagelist), os.cpu_count())) as p:
-            results = p.map(self.calculate_img_rt_mono, [
-                            (root, filename, mtx, dist) for filename in imagelist])
+    def calculate_img_rt_parallel(self, root, imagelist, mtx, dist, progress_cb=None):
+        results = [None]*len(imagelist)
+        tasks = [(root, filename, mtx, dist) for filename in imagelist]
+        self.verify_pyramid([os.path.join(root, filename) for filename in imagelist])
+        for done, (idx, result, reason) in enumerate(SHARED_POOL.imap_deadline(
+                self.board_config, _rt_task, tasks, self.detect_timeout, self.cancel_event), 1):
+            # 超时或取消的图片与检测失败的图片同样标记为拒绝
+            if reason is not None:
+                result = (None, None, True, None)
+            results[idx] = result
+            self._record_reject(imagelist[idx], 'rejected' if result[2] is True else 'calibrated', reason)
+            if progress_cb is not None:
+                progress_cb(done, len(imagelist), imagelist[idx], 'rejected' if result[2] is True else 'calibrated')
         return results
 
     # 画角点
@@ -648,24 +1777,26 @@ class CalibBoard():
     
     # parallel processing the image
     def _process_image_corners(self, rootpath: str, fname: str):
-        img = cv2.imread(os.path.join(rootpath, fname), 0)
-        ret, cors = self.find_corners(img)
+        stats = self.new_detect_stats()
+        ret, cors, shape, reason = self.find_corners_in_file(os.path.join(rootpath, fname), stats)
         if ret is not True:
-            return (fname, None, None, 'rejected')
+            return (fname, None, shape, 'rejected', reason, stats)
         else:
-            return (fname, self.objp, cors, 'calibrated')
+            return (fname, cors, shape, 'calibrated', None, stats)
 
     # stereo parellel processing the image
     def _stereo_process_image_corners(self, args):
         lfname, rfname, lrootpath, rrootpath = args
-        limg = cv2.imread(os.path.join(lrootpath, lfname), 0)
-        rimg = cv2.imread(os.path.join(rrootpath, rfname), 0)
-        lret, lcors = self.find_corners(limg)
-        rret, rcors = self.find_corners(rimg)
-        if lret is not True or rret is not True:
-            return (lfname, rfname, None, None, 'rejected')
+        stats = self.new_detect_stats()
+        lret, lcors, shape, lreason = self.find_corners_in_file(os.path.join(lrootpath, lfname), stats)
+        # 左图已被拒绝时不再检测右图
+        if lret is not True:
+            return (lfname, rfname, None, None, shape, 'rejected', f'left: {lreason}', stats)
+        rret, rcors, _, rreason = self.find_corners_in_file(os.path.join(rrootpath, rfname), stats)
+        if rret is not True:
+            return (lfname, rfname, None, None, shape, 'rejected', f'right: {rreason}', stats)
         else:
-            return (lfname, rfname, lcors, rcors, 'calibrated')
+            return (lfname, rfname, lcors, rcors, shape, 'calibrated', None, stats)
 
 
 class CubeCalibTarget():
@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+from collections import deque
+import atexit
+import threading
+from contextlib import contextmanager
+from multiprocessing import Pool, Queue
+from loguru import logger
+from utils.dedup import file_dhash
+
+# 工作进程内常驻的标定板实例，由 _init_worker 根据配置创建
+_worker_board = None
+# 任务开始时向主进程报告任务序号，主进程据此计算每个任务的耗时
+_started_queue = None
+
+
+def _init_worker(board_config: dict, started_queue=None):
+    global _worker_board, _started_queue
+    # 避免循环导入，在工作进程内再导入
+    from utils.calib import CalibBoard
+    _worker_board = CalibBoard(**board_config)
+    _started_queue = started_queue
+
+
+def _keyed_task(args):
+    idx, func, task = args
+    if _started_queue is not None:
+        _started_queue.put(idx)
+    return func(task)
+
+
+def _mono_task(args):
+    rootpath, fname = args
+    return _worker_board._process_image_corners(rootpath, fname)
+
+
+def _stereo_task(args):
+    return _worker_board._stereo_process_image_corners(args)
+
+
+def _rt_task(args):
+    return _worker_board.calculate_img_rt_mono(args)
+
+
+def _model_task(args):
+    return _worker_board.fit_distortion_model(args)
+
+
+def _resample_task(args):
+    return _worker_board.fit_resample(args)
+
+
+def _hash_task(args):
+    filepath, hash_size = args
+    return file_dhash(filepath, hash_size)
+
+
+class CalibWorkerPool():
+    '''
+    long-lived process pool shared by the Mono/Stereo/HandEye tabs,
+    workers hold the CalibBoard locally so tasks only carry file names
+    '''
+
+    def __init__(self, processes: int = None):
+        self.processes = processes or max(1, os.cpu_count()-1)
+        self.pool = None
+        self.board_key = None
+        self.started = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_key(board_config: dict):
+        return tuple(sorted((k, repr(v)) for k, v in board_config.items()))
+
+    # 同一时间只允许一个标定任务使用进程池，标定板配置变化时重建进程池
+    @contextmanager
+    def session(self, board_config: dict):
+        with self._lock:
+            self._ensure(board_config)
+            yield self.pool
+
+    def _ensure(self, board_config: dict):
+        key = self._make_key(board_config)
+        if self.pool is None or self.board_key != key:
+            self._close()
+            logger.debug(f'start calib worker pool with {self.processes} processes')
+            self.started = Queue()
+            self.pool = Pool(self.processes, initializer=_init_worker, initargs=(board_config, self.started))
+            self.board_key = key
+
+    def imap_deadline(self, board_config: dict, func, tasks: list, timeout: float = None, cancel_event=None, poll: float = 0.05):
+        '''
+        yield (idx, result, reason) in completion order,
+        reason is None on success, 'timeout' when a task runs longer than timeout seconds,
+        'cancelled' for every unfinished task once cancel_event is set.
+        at most one task per worker is in flight. a stuck worker cannot be interrupted, so after a timeout
+        no new task is submitted, the other running tasks finish, and only then the pool is recycled
+        '''
+        with self._lock:
+            todo = deque(enumerate(tasks))
+            while len(todo) > 0:
+                self._ensure(board_config)
+                asyncs = {}
+                started = {}
+                # 超时但仍占用工作进程的任务
+                stuck = {}
+                while True:
+                    # 发生超时后不再提交新任务
+                    while len(stuck) == 0 and len(todo) > 0 and len(asyncs) < self.processes:
+                        idx, task = todo.popleft()
+                        asyncs[idx] = self.pool.apply_async(_keyed_task, ((idx, func, task),))
+                    if len(asyncs) == 0:
+                        break
+                    # 记录各任务的开始时间
+                    while True:
+                        try:
+                            started.setdefault(self.started.get_nowait(), time.monotonic())
+                        except queue.Empty:
+                            break
+                    if cancel_event is not None and cancel_event.is_set():
+                        logger.info('calib workers cancelled')
+                        self._close()
+                        for idx in list(asyncs) + [idx for idx, _ in todo]:
+                            yield idx, None, 'cancelled'
+                        return
+                    now = time.monotonic()
+                    for idx, ar in list(asyncs.items()):
+                        if ar.ready():
+                            del asyncs[idx]
+                            yield idx, ar.get(), None
+                        elif timeout is not None and idx in started and now - started[idx] > timeout:
+                            logger.warning(f'calib task {idx} exceeded {timeout}s budget')
+                            stuck[idx] = asyncs.pop(idx)
+                            yield idx, None, 'timeout'
+                    if len(asyncs) > 0:
+                        next(iter(asyncs.values())).wait(poll)
+                if any(not ar.ready() for ar in stuck.values()):
+                    # 其余任务都已完成，只终止仍被超时任务占用的进程池，未提交的任务在新进程池中继续
+                    self._close()
+
+    def _close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        if self.started is not None:
+            self.started.close()
+        self.pool = None
+        self.board_key = None
+        self.started = None
+
+    def shutdown(self):
+        with self._lock:
+            self._close()
+
+
+SHARED_POOL = CalibWorkerPool()
+atexit.register(SHARED_POOL.shutdown)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import numpy as np
+from functools import lru_cache
 from scipy import signal
+from scipy import fft as sp_fft
 from scipy.spatial import cKDTree
 from numpy import pi
 from scipy.cluster.vq import kmeans
@@ -20,12 +22,6 @@ def create_correlation_patch(angle_1,angle_2,radius):
     width  = radius*2+1
     height = radius*2+1
 
-    # initialize template
-    template = []
-    for i in range(4):
-        x = np.zeros((height, width))
-        template.append(x)
-
     # midpoint
     mu = radius
     mv = radius
@@ -34,53 +30,153 @@ def create_correlation_patch(angle_1,angle_2,radius):
     n1 = [-np.sin(angle_1), np.cos(angle_1)]
     n2 = [-np.sin(angle_2), np.cos(angle_2)]
 
-    # for all points in template do
-    for u in range(width):
-        for v in range(height):
-            # vector
-            vec  = [u-mu, v-mv]
-            dist = np.linalg.norm(vec)
-
-            # check on which side of the normals we are
-            s1 = np.dot(vec, n1)
-            s2 = np.dot(vec, n2)
-
-            if dist <= radius:
-                if s1 <= -0.1 and s2 <= -0.1:
-                    template[0][v,u] = 1
-                elif s1 >= 0.1 and s2 >= 0.1:
-                    template[1][v,u] = 1
-                elif s1 <= -0.1 and s2 >= 0.1:
-                    template[2][v,u] = 1
-                elif s1 >= 0.1 and s2 <= -0.1:
-                    template[3][v,u] = 1
-
-    # # normalize
-    for i in range(4):
-        template[i] /= np.sum(template[i])
-
-    return template
-
-def detect_corners_template(gray, template, mode='same'):
-    img_corners = [None]*4
-    for i in range(4):
-        if GPUTOOLS and mode == 'same':
-            img_corners[i] = gputools.convolve(gray, template[i])
+    # vectors from the midpoint to all points in template
+    v, u = np.mgrid[:height, :width]
+    du = u - mu
+    dv = v - mv
+    inside = np.sqrt(du*du + dv*dv) <= radius
+
+    # check on which side of the normals we are
+    s1 = du*n1[0] + dv*n1[1]
+    s2 = du*n2[0] + dv*n2[1]
+
+    template = [inside & (s1 <= -0.1) & (s2 <= -0.1),
+                inside & (s1 >= 0.1) & (s2 >= 0.1),
+                inside & (s1 <= -0.1) & (s2 >= 0.1),
+                inside & (s1 >= 0.1) & (s2 <= -0.1)]
+
+    # normalize
+    return [t / np.sum(t) for t in template]
+
+
+@lru_cache(maxsize=16)
+def template_bank(radiuses):
+    """
+    correlation templates for all TPROPS angle pairs and the given radiuses,
+    in the order detect_corners visits them. Built once per radius set and
+    kept for the life of the process, so worker processes reuse it across images.
+    """
+    bank = []
+    for angle_1, angle_2 in TPROPS:
+        for radius in radiuses:
+            template = create_correlation_patch(angle_1, angle_2, radius)
+            for t in template:
+                t.flags.writeable = False
+            bank.append(template)
+    return tuple(bank)
+
+def convolve_scipy(gray, kernels, mode='same'):
+    return [signal.convolve(gray, k, mode=mode) for k in kernels]
+
+
+def convolve_gputools(gray, kernels):
+    return [gputools.convolve(gray, k) for k in kernels]
+
+
+def convolve_opencv(gray, kernels):
+    # filter2D is a correlation: flip the kernel, zero border to match scipy's 'same'
+    gray = np.asarray(gray, np.float64)
+    return [cv2.filter2D(gray, cv2.CV_64F, np.ascontiguousarray(k[::-1, ::-1]),
+                         borderType=cv2.BORDER_CONSTANT) for k in kernels]
+
+
+class FftConvolver:
+    """
+    'same' convolution of one image with many kernels, the forward transform
+    of the image is computed once and shared by all kernels up to max_radius
+    """
+    def __init__(self, gray, max_radius):
+        self.shape = gray.shape
+        self.pad = max_radius
+        self.fshape = tuple(sp_fft.next_fast_len(n + 2*max_radius, True) for n in gray.shape)
+        self.spectrum = sp_fft.rfft2(np.asarray(gray, np.float64), self.fshape, workers=-1)
+
+    def __call__(self, kernels):
+        r = (kernels[0].shape[0] - 1) // 2
+        assert r <= self.pad, 'kernel larger than max_radius'
+        kf = sp_fft.rfft2(np.asarray(kernels), self.fshape, workers=-1)
+        full = sp_fft.irfft2(kf * self.spectrum, self.fshape, workers=-1)
+        h, w = self.shape
+        return list(full[:, r:r+h, r:r+w])
+
+
+CONV_BACKENDS = ('auto', 'scipy', 'opencv', 'fft', 'gputools')
+# 'auto' uses the shared fft only for large kernels on small images,
+# filter2D is faster for the radiuses used by detect_checkerboard.
+# measured on one core, 10 angle pairs x 4 kernels per radius:
+#   2048x1536, radius 16-48: filter2D 1.1-1.8s, fft 2.2-2.6s
+#   640x480: fft only wins from radius ~48 on (0.30s vs 0.34s)
+# filter2D cost grows with the kernel area while the fft cost is flat in the
+# radius but grows with the padded image, hence both limits below
+FFT_MIN_RADIUS = 40
+FFT_MAX_PIXELS = 1000000
+
+def make_convolver(gray, max_radius, backend='auto'):
+    """
+    returns f(kernels) -> list of 'same' convolutions of gray with each kernel
+    """
+    if backend not in CONV_BACKENDS:
+        raise ValueError(f'unknown convolution backend {backend}')
+    if backend == 'auto':
+        if GPUTOOLS:
+            backend = 'gputools'
+        elif max_radius >= FFT_MIN_RADIUS and gray.size <= FFT_MAX_PIXELS:
+            backend = 'fft'
         else:
-            img_corners[i] = signal.convolve(gray, template[i], mode=mode)
+            backend = 'opencv'
+
+    if backend == 'fft':
+        return FftConvolver(gray, max_radius)
+    if backend == 'opencv':
+        return lambda kernels: convolve_opencv(gray, kernels)
+    if backend == 'gputools':
+        return lambda kernels: convolve_gputools(gray, kernels)
+    return lambda kernels: convolve_scipy(gray, kernels)
+
+
+def check_backends(shape=(240, 320), radiuses=(6, 10, 48), tol=1e-9, seed=0):
+    """
+    compares the float64 backends (opencv, fft) against scipy 'same' convolution
+    on a random image, returns {backend: max abs error}, raises if any exceeds tol.
+    gputools runs in float32 and is not checked here
+    """
+    gray = np.random.default_rng(seed).random(shape) * 255
+    backends = ['opencv', 'fft']
+    errors = dict.fromkeys(backends, 0.0)
+    for radius in radiuses:
+        kernels = create_correlation_patch(pi/8, 3*pi/8, radius)
+        ref = convolve_scipy(gray, kernels)
+        for backend in backends:
+            out = make_convolver(gray, radius, backend)(kernels)
+            err = max(np.abs(np.asarray(o, np.float64) - r).max() for o, r in zip(out, ref))
+            errors[backend] = max(errors[backend], float(err))
+    bad = {b: e for b, e in errors.items() if e > tol}
+    if len(bad) > 0:
+        raise AssertionError(f'convolution backends differ from scipy: {bad}')
+    return errors
+
+
+def detect_corners_template(gray, template, mode='same', convolve=None):
+    if convolve is not None:
+        img_corners = convolve(template)
+    elif GPUTOOLS and mode == 'same':
+        img_corners = convolve_gputools(gray, template)
+    else:
+        img_corners = convolve_scipy(gray, template, mode=mode)
 
-    img_corners_mu = np.mean(img_corners, axis=0)
+    a, b, c, d = img_corners
+    img_corners_mu = (a + b + c + d) / 4
 
-    arr = np.array([img_corners[0]-img_corners_mu, img_corners[1]-img_corners_mu,
-                    img_corners_mu-img_corners[2], img_corners_mu-img_corners[3]])
+    e0, e1 = a - img_corners_mu, b - img_corners_mu
+    e2, e3 = img_corners_mu - c, img_corners_mu - d
     # case 1: a=white, b=black
-    img_corners_1 = np.min(arr, axis=0)
+    img_corners_1 = np.minimum(np.minimum(e0, e1), np.minimum(e2, e3))
 
     # case 2: b=white, a=black
-    img_corners_2 = np.min(-arr, axis=0)
+    img_corners_2 = -np.maximum(np.maximum(e0, e1), np.maximum(e2, e3))
 
     # combine both
-    img_corners = np.max([img_corners_1, img_corners_2], axis=0)
+    img_corners = np.maximum(img_corners_1, img_corners_2)
 
     return img_corners
 
@@ -93,112 +189,152 @@ TPROPS = [[0, pi/2], [pi/4, -pi/4],
 # TPROPS = [[0, pi/2], [0, -pi/4], [0, pi/4]]
 RADIUS = [6, 8, 10]
 
-def detect_corners(gray, radiuses=RADIUS):
+def detect_corners(gray, radiuses=RADIUS, backend='auto'):
     out = np.zeros(gray.shape)
+    convolve = make_convolver(gray, max(radiuses), backend)
 
-    for angle_1, angle_2 in TPROPS:
-        for radius in radiuses:
-            temp = create_correlation_patch(angle_1, angle_2, radius)
-            corr = detect_corners_template(gray, temp)
-            out = np.max([corr, out], axis=0)
+    for temp in template_bank(tuple(radiuses)):
+        corr = detect_corners_template(gray, temp, convolve=convolve)
+        np.maximum(out, corr, out=out)
 
     return out
 
 def get_corner_candidates(corr, step=40, thres=0.01):
-    out = []
-    check = set()
-    for i in range(0, corr.shape[0], step//2):
-        for j in range(0, corr.shape[1], step//2):
-            region = corr[i:i+step, j:j+step]
-            ix = np.argmax(region)
-            r, c = np.unravel_index(ix, region.shape)
-            val = region[r, c]
-            if val > thres and (r+i, c+j) not in check:
-                out.append( (r+i, c+j, val) )
-                check.add( (r+i, c+j) )
-    return np.array(out)
+    """
+    maximum of every step x step window, windows start every step//2 pixels.
+    returns (row, col, value) for maxima above thres, in window scan order
+    """
+    stride = step//2
+    kernel = np.ones((step, step), np.uint8)
+    corr = np.asarray(corr, np.float64)
+
+    # window maxima, dilate covers [i, i+step) x [j, j+step) from the top-left anchor
+    win_max = cv2.dilate(corr, kernel, anchor=(0, 0))[::stride, ::stride]
+
+    # smallest maximum among the windows covering each pixel,
+    # a pixel is the maximum of some window iff it reaches this value
+    grid = np.full(corr.shape, np.inf)
+    grid[::stride, ::stride] = win_max
+    cover_min = cv2.erode(grid, kernel, anchor=(step-1, step-1))
+
+    rows, cols = np.nonzero((corr >= cover_min) & (corr > thres))
+    if len(rows) == 0:
+        return np.array([])
+    vals = corr[rows, cols]
+
+    # order by the first window (in scan order) that picks each pixel
+    nwin_r, nwin_c = win_max.shape
+    k = np.arange(-(-step // stride))
+    wr = rows[:, None, None] // stride - k[None, :, None]
+    wc = cols[:, None, None] // stride - k[None, None, :]
+    valid = (wr >= 0) & (wc >= 0) & (wr*stride + step > rows[:, None, None]) \
+        & (wc*stride + step > cols[:, None, None])
+    wr_c = np.clip(wr, 0, nwin_r-1)
+    wc_c = np.clip(wc, 0, nwin_c-1)
+    valid &= win_max[wr_c, wc_c] == vals[:, None, None]
+    first = np.where(valid, wr_c*nwin_c + wc_c, np.iinfo(np.int64).max).reshape(len(rows), -1).min(axis=1)
+    order = np.argsort(first, kind='stable')
+
+    return np.column_stack([rows[order], cols[order], vals[order]])
 
 def non_maximum_suppression(corners, dist=40):
+    """
+    drops every corner with a stronger corner within dist,
+    equal scores keep the lower index
+    """
     tree = cKDTree(corners[:, :2])
+    pairs = tree.query_pairs(dist, output_type='ndarray')
+
+    rank = np.empty(len(corners), np.int64)
+    rank[np.argsort(-corners[:, 2], kind='stable')] = np.arange(len(corners))
+    weak = np.where(rank[pairs[:, 0]] > rank[pairs[:, 1]], pairs[:, 0], pairs[:, 1])
+
     good = np.ones(len(corners), dtype='bool')
-    for (a, b) in tree.query_pairs(dist):
-        if not good[a] or not good[b]:
-            continue
-        sa = corners[a, 2]
-        sb = corners[b, 2]
-        if sa >= sb:
-            good[b] = False
-        else:
-            good[a] = False
+    good[weak] = False
     return corners[good]
 
 def solve_patch_corner(dx, dy):
-    matsum = np.zeros((2,2))
-    pointsum = np.zeros(2)
-    for i in range(dx.shape[0]):
-        for j in range(dx.shape[1]):
-            vec = [dy[i,j], dx[i,j]]
-            pos = (i,j)
-            mat = np.outer(vec, vec)
-            pointsum += mat.dot(pos)
-            matsum += mat
-
-    try:
-        minv = np.linalg.inv(matsum)
-    except np.linalg.LinAlgError:
-        return None
-
-    newp = minv.dot(pointsum)
+    """
+    least squares corner position (i, j) in window coordinates, every pixel
+    gradient vec = (dy, dx) at pos = (i, j) adds vec vec^T to the normal matrix
+    and vec vec^T pos to the right hand side.
+    dx, dy are (h, w) windows or (n, h, w) stacks of windows; a single window
+    returns None and a stack returns nan rows for singular systems
+    """
+    single = np.ndim(dx) == 2
+    vec = np.stack([np.asarray(dy, np.float64), np.asarray(dx, np.float64)], axis=-3)
+    if single:
+        vec = vec[None]
+    pos = np.indices(vec.shape[-2:])
+
+    matsum = np.einsum('naij,nbij->nab', vec, vec)
+    pointsum = np.einsum('naij,nij->na', vec, np.einsum('nbij,bij->nij', vec, pos))
+
+    det = matsum[:, 0, 0]*matsum[:, 1, 1] - matsum[:, 0, 1]*matsum[:, 1, 0]
+    singular = ~(np.abs(det) > 1e-12 * matsum[:, 0, 0] * matsum[:, 1, 1])
+    matsum[singular] = np.eye(2)
+    newp = np.linalg.solve(matsum, pointsum[..., None])[..., 0]
+    newp[singular] = np.nan
+
+    if single:
+        return None if singular[0] else newp[0]
     return newp
 
-def get_angle_modes(corners, gray, winsize=11):
+class ImageFeatures:
+    """
+    per-image gradients computed once and shared by every detection stage,
+    all float32 and the same shape as the image
+    """
+    def __init__(self, gray):
+        self.dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        self.dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+        self.magnitude = cv2.magnitude(self.dx, self.dy)
+        # edge orientation in [0, pi)
+        self.orientation = np.mod(np.arctan2(self.dy, self.dx), np.float32(pi))
+
+    def window(self, y, x, halfwin):
+        sl = np.s_[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
+        return self.dx[sl], self.dy[sl], self.magnitude[sl], self.orientation[sl]
+
+
+def sample_angle_modes(mag, ori):
+    weights = mag.flatten().astype(np.float64)
+    sim = np.random.choice(ori.flatten(), p=weights/np.sum(weights), size=weights.size*5)
+    means, distortion = kmeans(sim, 2)
+    return means
+
+
+def get_angle_modes(corners, gray, winsize=11, features=None):
     halfwin = (winsize-1)//2
     out = []
+    if features is None:
+        features = ImageFeatures(gray)
 
     for i, corner in enumerate(corners):
         y, x = corner[:2]
         y = int(round(y))
         x = int(round(x))
 
-        dx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        dy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-
-        gg = gray[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-        rx = dx[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-        ry = dy[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-
-        angs = np.mod(np.angle(rx + ry*1j).flatten(), np.pi)
-        absr = np.abs(rx + ry*1j)
-        weights = absr.flatten()
-        sim = np.random.choice(angs, p=weights/np.sum(weights), size=len(angs)*5)
-        means, distortion = kmeans(sim, 2)
-
-        out.append(means)
+        _, _, mag, ori = features.window(y, x, halfwin)
+        out.append(sample_angle_modes(mag, ori))
 
     return np.array(out)
 
-def score_corners(corners, gray, winsize=11):
+def score_corners(corners, gray, winsize=11, features=None):
     halfwin = (winsize-1)//2
 
     scores = np.zeros(corners.shape[0])
+    if features is None:
+        features = ImageFeatures(gray)
 
     for i, corner in enumerate(corners):
         y, x, score = corner
         y = int(round(y))
         x = int(round(x))
 
-        dx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        dy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-
         gg = gray[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-        rx = dx[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-        ry = dy[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-
-        angs = np.mod(np.angle(rx + ry*1j).flatten(), np.pi)
-        absr = np.abs(rx + ry*1j)
-        weights = absr.flatten()
-        sim = np.random.choice(angs, p=weights/np.sum(weights), size=len(angs)*5)
-        means, distortion = kmeans(sim, 2)
+        _, _, mag, ori = features.window(y, x, halfwin)
+        means = sample_angle_modes(mag, ori)
 
         patch = create_correlation_patch(means[0], means[1], halfwin)
         new_score = np.max(detect_corners_template(gg, patch, mode='valid'))
@@ -208,38 +344,59 @@ def score_corners(corners, gray, winsize=11):
     return scores
 
 
-def refine_corners(corners, gray, winsize=11, check_only=False):
+def refine_corners(corners, gray, winsize=11, check_only=False, features=None, iterations=1):
+    """
+    sub-pixel refinement of all corners at once. with iterations > 1 the window
+    is re-centered on the rounded result and solved again until it stops moving,
+    as libcbdetect does
+    """
     halfwin = (winsize-1)//2
 
-    out = []
-
-    dx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    dy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-
-    for corner in corners:
-        y, x, score = corner
-        y = int(round(y))
-        x = int(round(x))
-
-        rx = dx[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-        ry = dy[y-halfwin:y+halfwin+1, x-halfwin:x+halfwin+1]
-
-        newp = solve_patch_corner(rx, ry)
-        if newp is None:
-            continue # bad point
-
-        newp = newp - [halfwin, halfwin]
-        if np.any(np.abs(newp) > halfwin+1):
-            continue # bad point
-
-        coord = newp + [y, x]
-        if check_only:
-            out.append([y, x, score])
-        else:
-            out.append([coord[0], coord[1], score])
-
-    return np.array(out)
+    if features is None:
+        features = ImageFeatures(gray)
+    if len(corners) == 0:
+        return np.array([])
 
+    h, w = features.dx.shape
+    y = np.round(corners[:, 0]).astype(np.int64)
+    x = np.round(corners[:, 1]).astype(np.int64)
+    cy, cx = y.copy(), x.copy()
+    coord = np.zeros((len(corners), 2))
+    good = np.ones(len(corners), dtype='bool')
+    off = np.arange(-halfwin, halfwin+1)
+
+    for it in range(iterations):
+        # windows starting above or left of the image are bad points,
+        # windows past the bottom or right edge are cut there
+        good &= (cy >= halfwin) & (cx >= halfwin) & (cy-halfwin < h) & (cx-halfwin < w)
+        ix = np.nonzero(good)[0]
+        rows = cy[ix, None] + off
+        cols = cx[ix, None] + off
+        inside = (rows < h)[:, :, None] & (cols < w)[:, None, :]
+        rr = np.minimum(rows, h-1)[:, :, None]
+        cc = np.minimum(cols, w-1)[:, None, :]
+        rx = np.where(inside, features.dx[rr, cc], 0)
+        ry = np.where(inside, features.dy[rr, cc], 0)
+
+        newp = solve_patch_corner(rx, ry) - [halfwin, halfwin]
+        # singular systems are nan and fail here too
+        ok = np.all(np.abs(newp) <= halfwin+1, axis=1)
+        good[ix[~ok]] = False
+        ix = ix[ok]
+        coord[ix] = newp[ok] + np.column_stack([cy[ix], cx[ix]])
+
+        ny = np.round(coord[:, 0]).astype(np.int64)
+        nx = np.round(coord[:, 1]).astype(np.int64)
+        moved = good & ((ny != cy) | (nx != cx))
+        if not np.any(moved):
+            break
+        cy[moved], cx[moved] = ny[moved], nx[moved]
+
+    if not np.any(good):
+        return np.array([])
+    if check_only:
+        return np.column_stack([y, x, corners[:, 2]])[good].astype(np.float64)
+    return np.column_stack([coord, corners[:, 2]])[good]
 
 
 def normalize_image(img):
@@ -285,7 +442,7 @@ def make_mask_line(shape, start, end, thickness=2):
 
 
 # TODO: this should be replaced by the growing checkerboard from the Geiger et al paper
-def reorder_checkerboard(corners, gray, size=(9,6)):
+def reorder_checkerboard(corners, gray, size=(9,6), features=None):
     corners_xy = corners[:, :2]
 
     tree = cKDTree(corners_xy)
@@ -294,9 +451,9 @@ def reorder_checkerboard(corners, gray, size=(9,6)):
     corner_mid = corners_xy[ix_mid]
     dists, ixs = tree.query(corner_mid, k=7)
 
-    dx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    dy = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    dmag = np.abs(dx + dy*1j)
+    if features is None:
+        features = ImageFeatures(gray)
+    dmag = features.magnitude
 
     ixs = [i for i in ixs[1:] if i < corners_xy.shape[0]]
 
@@ -407,8 +564,9 @@ def detect_checkerboard(gray, size=(9,6), winsize=9, trim=False):
     if len(corners) < size[0]*size[1]:
         return None, 1.0
 
+    features = ImageFeatures(diff)
     corners = non_maximum_suppression(corners, winsize-2)
-    corners_sp = refine_corners(corners, diff, winsize=winsize+2)
+    corners_sp = refine_corners(corners, diff, winsize=winsize+2, features=features)
     # corners_sp = refine_corners(corners_sp, diff, winsize=max(winsize//2-1,5),
     #                             check_only=True)
     # corners_sp = refine_corners(corners_sp, diff, winsize=5,
@@ -423,7 +581,7 @@ def detect_checkerboard(gray, size=(9,6), winsize=9, trim=False):
 
     best_ix = np.argsort(-scores)[:num_corners+3]
     best_corners = corners_sp[np.sort(best_ix)]
-    best_corners, max_dist = reorder_checkerboard(best_corners, diff, size)
+    best_corners, max_dist = reorder_checkerboard(best_corners, diff, size, features)
 
     check_score = checkerboard_score(best_corners, size)
 
@@ -434,7 +592,7 @@ def detect_checkerboard(gray, size=(9,6), winsize=9, trim=False):
         # print('trying with extra points...')
         best_ix = np.argsort(-scores)[:num_corners+10]
         best_corners = corners_sp[np.sort(best_ix)]
-        best_corners, max_dist = reorder_checkerboard(best_corners, diff, size)
+        best_corners, max_dist = reorder_checkerboard(best_corners, diff, size, features)
         check_score = checkerboard_score(best_corners, size)
 
     # corner_scores = best_corners[:, 2]
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import numpy as np
+from loguru import logger
+
+# 默认缓存目录，所有标定页共用
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.calibrationtool', 'corners')
+
+
+# key 为图片内容哈希 + 检测设置; 每个条目保存 cors, shape 以及拒绝原因，拒绝的图片也会缓存
+class CornerCache():
+    '''
+    on-disk corner cache keyed by image content and detector settings
+    '''
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(data) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, signature: str) -> str:
+        return hashlib.sha1(f'{content_hash}|{signature}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npz')
+
+    # 返回 (hit, ret, cors, shape, reason)
+    def load(self, key: str):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return False, False, None, None, None
+        try:
+            with np.load(path) as data:
+                cors = data['cors']
+                shape = tuple(int(s) for s in data['shape'])
+                reason = str(data['reason']) if 'reason' in data.files else 'no corners'
+        except Exception as e:
+            # 缓存文件损坏时当作未命中，后续会被覆盖
+            logger.debug(f'corner cache entry {path} is broken: {e}')
+            return False, False, None, None, None
+        if cors.shape[0] == 0:
+            return True, False, None, shape, reason
+        return True, True, cors, shape, None
+
+    def save(self, key: str, ret: bool, cors, shape, reason: str = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if ret is not True or cors is None:
+            cors = np.zeros((0, 1, 2), np.float32)
+        # 多进程同时写入，先写临时文件再原子替换
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, cors=np.asarray(cors, np.float32), shape=np.asarray(shape),
+                         reason=np.asarray(reason or ''))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f'failed to write corner cache {path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith('.npz'):
+                    os.remove(os.path.join(root, f))
@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+
+# 计算图片的差分哈希(dHash)，按缩小后的灰度图解码以减少读图时间
+def file_dhash(filepath: str, hash_size: int = 16):
+    buf = np.fromfile(filepath, dtype=np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    return FrameDeduper.dhash(img, hash_size)
+
+
+# 与当前代表帧的 dHash 汉明距离不超过 max_dist 的帧合并到代表帧，否则成为新的代表帧
+class FrameDeduper():
+    '''
+    folds near-duplicate consecutive frames into one representative
+    '''
+
+    def __init__(self, hash_size: int = 16, max_dist: int = 8):
+        self.hash_size = hash_size
+        # 汉明距离不超过该值视为重复帧(共 hash_size*hash_size 位)
+        self.max_dist = max_dist
+
+    @staticmethod
+    def dhash(gray, hash_size: int = 16):
+        small = cv2.resize(gray, (hash_size+1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+        return (small[:, 1:] > small[:, :-1]).ravel()
+
+    # 按顺序与当前代表帧比较，返回 (代表帧列表, {代表帧: [被合并的帧]})
+    def fold(self, names: list, hashes: list):
+        representatives = []
+        groups = {}
+        rep, rep_hash = None, None
+        for name, h in zip(names, hashes):
+            # 无法解码的图片保留，交给角点检测处理
+            if h is not None and rep_hash is not None and np.count_nonzero(h != rep_hash) <= self.max_dist:
+                groups[rep].append(name)
+                continue
+            representatives.append(name)
+            groups[name] = []
+            rep, rep_hash = (name, h) if h is not None else (None, None)
+        return representatives, {k: v for k, v in groups.items() if len(v) > 0}
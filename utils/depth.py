@@ -4,7 +4,7 @@ import os
 import threading
 import time
 import cv2
-from utils.calib import load_camera_param
+from utils.params import SHARED_PARAMS
 
 
 def timer_decorator(func):
@@ -52,22 +52,16 @@ class SgbmCpu():
         self.stereo = self._create_instance()
 
     def _init_camera(self, stereoParamPath: str):
-        w,h = 1920, 1080
-        self.cam1_mtx, self.cam1_dist, w, h = load_camera_param(stereoParamPath, need_size=True)
-        self.cam2_mtx, self.cam2_dist, self.rofCam2, self.tofCam2 = load_camera_param(
-            stereoParamPath, camera_id=True, need_rt=True)
-        
-        self.R1, self.R2, self.P1, self.P2, self.Q, _, _ = cv2.stereoRectify(
-            self.cam1_mtx, self.cam1_dist,
-            self.cam2_mtx, self.cam2_dist,
-            (w,h),
-            self.rofCam2, self.tofCam2
-        )
+        # 参数、校正结果和映射由 SHARED_PARAMS 缓存，修改 sgbm 参数重建实例时不再重新计算
+        param = SHARED_PARAMS.stereo(stereoParamPath)
+        self.cam1_mtx, self.cam1_dist = param.left.mtx, param.left.dist
+        self.cam2_mtx, self.cam2_dist = param.right.mtx, param.right.dist
+        self.rofCam2, self.tofCam2 = param.R, param.T
 
-        self.map1x, self.map1y = cv2.initUndistortRectifyMap(
-            self.cam1_mtx, self.cam1_dist, self.R1, self.P1, (w,h), cv2.CV_32FC1)
-        self.map2x, self.map2y = cv2.initUndistortRectifyMap(
-            self.cam2_mtx, self.cam2_dist, self.R2, self.P2, (w,h), cv2.CV_32FC1)
+        # 定点格式的映射 (CV_16SC2, CV_16UC1)，直接用于 cv2.remap
+        (self.map1x, self.map1y), (self.map2x, self.map2y) = param.maps
+        rect = param.rect
+        self.R1, self.R2, self.P1, self.P2, self.Q = rect['R1'], rect['R2'], rect['P1'], rect['P2'], rect['Q']
 
     def _create_instance(self):
         stereo = cv2.StereoSGBM_create(
@@ -5,6 +5,7 @@ class CalibErrType(Enum):
     CAL_CORNER_DET_ERR = auto()
     CAL_DATA_SIZE_NOT_MATCH = auto()
     CAL_DATA_CSV_FORMAT_ERR = auto()
+    CAL_CANCELLED = auto()
 
     @staticmethod
     def to_string(err_type):
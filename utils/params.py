@@ -0,0 +1,201 @@
+import os
+import json
+import threading
+import numpy as np
+from loguru import logger
+from utils.projection import undistort_points
+
+
+# 参数文件中相机参数所在的节点名，找不到时返回 None
+def camera_element(jstr: dict, camera_id: bool = False):
+    if 'CameraParameters' in jstr:
+        return 'CameraParameters'
+    if camera_id is False and 'CameraParameters1' in jstr:
+        return 'CameraParameters1'
+    if camera_id is True and 'CameraParameters2' in jstr:
+        return 'CameraParameters2'
+    return None
+
+
+# 解析内参和畸变系数，返回 (mtx, dist)，失败时返回 (None, None)
+def parse_camera(jstr: dict, need_trans: bool = False, camera_id: bool = False):
+    element = camera_element(jstr, camera_id)
+    if element is None:
+        return None, None
+    # 非 opencv 格式(matlab)的内参矩阵是转置的
+    if jstr.get('Scheme', 'opencv') != 'opencv':
+        need_trans = True
+    params = jstr[element]
+    mtx = np.array(params['IntrinsicMatrix'])
+    if need_trans:
+        mtx = mtx.T
+    dist_r, dist_t = params['RadialDistortion'], params['TangentialDistortion']
+    dist = np.array([dist_r[:2] + dist_t + [dist_r[-1]]])
+    # 5 个以上系数的畸变模型保存了完整的系数
+    if 'DistortionCoefficients' in params:
+        dist = np.array([params['DistortionCoefficients']])
+    return mtx, dist
+
+
+# 图像尺寸 (w, h)，没有记录时返回 (None, None)
+def parse_size(jstr: dict):
+    if 'ImageShape' not in jstr:
+        return None, None
+    return jstr['ImageShape'][0], jstr['ImageShape'][1]
+
+
+# 右相机相对左相机的 (R, T)，没有记录时返回 (None, None)
+def parse_stereo_rt(jstr: dict):
+    if 'RotationOfCamera2' not in jstr or 'TranslationOfCamera2' not in jstr:
+        return None, None
+    return np.array(jstr['RotationOfCamera2']), np.array(jstr['TranslationOfCamera2'])
+
+
+def _readonly(arr):
+    arr = np.array(arr, np.float64)
+    arr.flags.writeable = False
+    return arr
+
+
+# mtx (3,3), dist (1,n) n=5/8/12/14, size (w, h) 或 None; 数组只读，各处共享同一份
+class CameraParam():
+    '''
+    one camera of a saved parameter file
+    '''
+
+    def __init__(self, path: str, mtx, dist, size=None, camera_id: bool = False):
+        self.path = path
+        self.camera_id = camera_id
+        self.mtx = _readonly(mtx)
+        self.dist = _readonly(dist)
+        self.size = size
+        self._inv_mtx = None
+        # {(alpha, size): (map1, map2, newK)}
+        self._maps = {}
+
+    @property
+    def inv_mtx(self):
+        if self._inv_mtx is None:
+            self._inv_mtx = _readonly(np.linalg.inv(self.mtx))
+        return self._inv_mtx
+
+    # 像素坐标去畸变，P 为 None 时返回归一化坐标
+    def undistort_points(self, pts, P=None, dtype=np.float64):
+        return undistort_points(pts, self.mtx, self.dist, P=P, dtype=dtype)
+
+    # 去畸变映射 (map1, map2, newK)，见 RectifyMapService.undistort_maps; 参数文件没有图像尺寸时需要传入 size
+    def undistort_maps(self, alpha: float = None, size=None):
+        size = self.size if size is None else tuple(size)
+        if (alpha, size) not in self._maps:
+            # 避免循环导入
+            from utils.rectmap import SHARED_MAPS
+            self._maps[(alpha, size)] = SHARED_MAPS.undistort_maps(self.path, size, alpha, self.camera_id)
+        return self._maps[(alpha, size)]
+
+
+# R, T 为右相机相对左相机的位姿; rect (stereoRectify 的结果) 和 maps 在第一次使用时计算
+class StereoParam():
+    '''
+    stereo pair of a saved parameter file
+    '''
+
+    def __init__(self, path: str, left: CameraParam, right: CameraParam, R, T, size=None):
+        self.path = path
+        self.left = left
+        self.right = right
+        self.R = _readonly(R)
+        self.T = _readonly(np.asarray(T).reshape(3, 1))
+        self.size = size
+        self._rect = None
+        self._maps = None
+
+    def _rectify(self):
+        from utils.rectmap import SHARED_MAPS
+        maps_l, maps_r, self._rect = SHARED_MAPS.rectify_maps(self.path, self.size)
+        self._maps = (maps_l, maps_r)
+
+    @property
+    def rect(self):
+        if self._rect is None:
+            self._rectify()
+        return self._rect
+
+    @property
+    def Q(self):
+        return self.rect['Q']
+
+    @property
+    def maps(self):
+        if self._maps is None:
+            self._rectify()
+        return self._maps
+
+    @property
+    def baseline(self):
+        return float(np.linalg.norm(self.T))
+
+
+# 参数文件只解析一次，修改时间或大小变化时才重新读取; CameraParam/StereoParam 在第一次请求时创建
+class ParamRegistry():
+    '''
+    cache of parsed parameter files
+    '''
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, path: str):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['stamp'] == stamp:
+                return entry
+        with open(path) as f:
+            jstr = json.load(f)
+        entry = {'stamp': stamp, 'json': jstr, 'objects': {}}
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    # 解析后的 json，调用方不要修改
+    def json(self, path: str):
+        return self._entry(path)['json']
+
+    # 单个相机，参数文件中没有对应相机时返回 None
+    def camera(self, path: str, camera_id: bool = False, need_trans: bool = False):
+        entry = self._entry(path)
+        key = ('camera', camera_id, need_trans)
+        if key not in entry['objects']:
+            mtx, dist = parse_camera(entry['json'], need_trans, camera_id)
+            if mtx is None:
+                logger.debug(f'no camera parameters in {path}')
+                return None
+            w, h = parse_size(entry['json'])
+            entry['objects'][key] = CameraParam(path, mtx, dist, None if w is None else (w, h), camera_id)
+        return entry['objects'][key]
+
+    # 双目参数，缺少任一相机或 R/T 时返回 None
+    def stereo(self, path: str):
+        entry = self._entry(path)
+        if 'stereo' not in entry['objects']:
+            left, right = self.camera(path), self.camera(path, camera_id=True)
+            R, T = parse_stereo_rt(entry['json'])
+            if left is None or right is None or R is None:
+                logger.debug(f'no stereo parameters in {path}')
+                return None
+            entry['objects']['stereo'] = StereoParam(path, left, right, R, T, left.size)
+        return entry['objects']['stereo']
+
+    def invalidate(self, path: str = None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+
+# 进程内共享，标定、视差和手眼标定页使用同一份参数
+SHARED_PARAMS = ParamRegistry()
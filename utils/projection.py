@@ -0,0 +1,187 @@
+import numpy as np
+
+'''
+batched projection of all calibration views in one numpy pass,
+follows the opencv camera model with up to 14 distortion coefficients
+(k1, k2, p1, p2[, k3[, k4, k5, k6[, s1, s2, s3, s4[, tauX, tauY]]]])
+distort / undistort / project work on any number of points in float32 or float64
+'''
+
+
+# 批量旋转向量转旋转矩阵, (N,3) -> (N,3,3)
+def rodrigues_batch(rvecs):
+    rvecs = np.asarray(rvecs, np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    k = rvecs/np.maximum(theta, 1e-12)[:, None]
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1], K[:, 0, 2], K[:, 1, 2] = -k[:, 2], k[:, 1], -k[:, 0]
+    K[:, 1, 0], K[:, 2, 0], K[:, 2, 1] = k[:, 2], -k[:, 1], k[:, 0]
+    s, c = np.sin(theta)[:, None, None], np.cos(theta)[:, None, None]
+    return np.eye(3) + s*K + (1-c)*(K @ K)
+
+
+# 倾斜传感器模型的投影矩阵，与 opencv computeTiltProjectionMatrix 一致
+def tilt_matrix(tau_x: float, tau_y: float):
+    cx, sx = np.cos(tau_x), np.sin(tau_x)
+    cy, sy = np.cos(tau_y), np.sin(tau_y)
+    rot_x = np.array([[1, 0, 0], [0, cx, sx], [0, -sx, cx]])
+    rot_y = np.array([[cy, 0, -sy], [0, 1, 0], [sy, 0, cy]])
+    rot_xy = rot_y @ rot_x
+    proj_z = np.array([[rot_xy[2, 2], 0, -rot_xy[0, 2]],
+                       [0, rot_xy[2, 2], -rot_xy[1, 2]],
+                       [0, 0, 1]])
+    return proj_z @ rot_xy
+
+
+# 把畸变系数补齐为 14 个
+def pad_dist(dist):
+    d = np.zeros(14)
+    dist = np.asarray(dist, np.float64).ravel()[:14]
+    d[:len(dist)] = dist
+    return d
+
+
+# 归一化坐标加畸变, x/y 任意形状，按 x 的精度(float32/float64)计算
+def distort_normalized(x, y, dist):
+    dtype = np.result_type(np.asarray(x).dtype, np.float32)
+    k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4, tau_x, tau_y = pad_dist(dist).astype(dtype)
+    r2 = x*x + y*y
+    r4 = r2*r2
+    radial = (1 + r2*(k1 + r2*(k2 + r2*k3)))/(1 + r2*(k4 + r2*(k5 + r2*k6)))
+    xd = x*radial + 2*p1*x*y + p2*(r2 + 2*x*x) + s1*r2 + s2*r4
+    yd = y*radial + p1*(r2 + 2*y*y) + 2*p2*x*y + s3*r2 + s4*r4
+    if tau_x != 0 or tau_y != 0:
+        T = tilt_matrix(tau_x, tau_y).astype(dtype)
+        w = T[2, 0]*xd + T[2, 1]*yd + T[2, 2]
+        xd, yd = (T[0, 0]*xd + T[0, 1]*yd + T[0, 2])/w, (T[1, 0]*xd + T[1, 1]*yd + T[1, 2])/w
+    return xd, yd
+
+
+# 批量投影多个视角的点, objpoints (N,P,3) 或所有视角共用的 (P,3), rmats (N,3,3), tvecs (N,3) -> (N,P,2)
+def project_points_batch(objpoints, rmats, tvecs, mtx, dist):
+    objpoints = np.asarray(objpoints, np.float64)
+    if objpoints.ndim == 2:
+        X = np.einsum('nij,pj->npi', rmats, objpoints)
+    else:
+        X = np.einsum('nij,npj->npi', rmats, objpoints)
+    X += np.asarray(tvecs, np.float64).reshape(-1, 1, 3)
+    xd, yd = distort_normalized(X[..., 0]/X[..., 2], X[..., 1]/X[..., 2], dist)
+    mtx = np.asarray(mtx, np.float64)
+    u = mtx[0, 0]*xd + mtx[0, 1]*yd + mtx[0, 2]
+    v = mtx[1, 1]*yd + mtx[1, 2]
+    return np.stack((u, v), axis=-1)
+
+
+def reprojection_residuals(objpoints, imgpoints, rvecs, tvecs, mtx, dist):
+    '''
+    reprojection of all views at once
+    return (projected (N,P,2), residuals (N,P,2), per-view rms (N,), stats)
+    stats: {'rms', 'mean', 'median', 'max'} over all corners, in pixel
+    '''
+    rmats = rodrigues_batch(np.hstack([np.asarray(r, np.float64).reshape(3, 1) for r in rvecs]).T)
+    tvecs = np.hstack([np.asarray(t, np.float64).reshape(3, 1) for t in tvecs]).T
+    projected = project_points_batch(objpoints, rmats, tvecs, mtx, dist)
+    residuals = np.asarray(imgpoints, np.float64).reshape(projected.shape) - projected
+    err2 = (residuals**2).sum(axis=-1)
+    err = np.sqrt(err2)
+    stats = {'rms': float(np.sqrt(err2.mean())), 'mean': float(err.mean()),
+             'median': float(np.median(err)), 'max': float(err.max())}
+    return projected, residuals, np.sqrt(err2.mean(axis=1)), stats
+
+
+# 像素坐标 (...,2) 转归一化坐标，考虑 mtx 中的 skew
+def pixel_to_normalized(pts, mtx, dtype=np.float64):
+    pts = np.asarray(pts, dtype)
+    fx, skew, cx, _, fy, cy = np.asarray(mtx, np.float64).ravel()[:6].astype(dtype)
+    y = (pts[..., 1] - cy)/fy
+    return (pts[..., 0] - cx - skew*y)/fx, y
+
+
+# 归一化坐标转像素坐标 (...,2)
+def normalized_to_pixel(x, y, mtx):
+    fx, skew, cx, _, fy, cy = np.asarray(mtx, np.float64).ravel()[:6].astype(np.asarray(x).dtype)
+    return np.stack((fx*x + skew*y + cx, fy*y + cy), axis=-1)
+
+
+# 理想(无畸变)像素坐标加畸变，undistort_points(..., P=mtx) 的逆
+def distort_points(pts, mtx, dist, dtype=np.float64):
+    x, y = pixel_to_normalized(pts, mtx, dtype)
+    return normalized_to_pixel(*distort_normalized(x, y, dist), mtx)
+
+
+# 相机(或 rvec/tvec 给定的世界)坐标系下的点 (...,3) 投影到像素 (...,2)
+# rvec 可以是旋转向量或 3x3 旋转矩阵
+def project_points(points, mtx, dist, rvec=None, tvec=None, dtype=np.float64):
+    X = np.asarray(points, dtype)
+    if rvec is not None:
+        R = np.asarray(rvec, np.float64)
+        R = R if R.shape == (3, 3) else rodrigues_batch(R)[0]
+        X = X @ R.T.astype(dtype)
+    if tvec is not None:
+        X = X + np.asarray(tvec, dtype).reshape(3)
+    return normalized_to_pixel(*distort_normalized(X[..., 0]/X[..., 2], X[..., 1]/X[..., 2], dist), mtx)
+
+
+def undistort_points(pts, mtx, dist, P=None, max_iter: int = 20, eps: float = None, dtype=np.float64, return_converged=False):
+    '''
+    iterative undistortion of pixel points (...,2), same model and fixed-point update as opencv undistortPoints,
+    a point stops iterating once re-distorting it lands within eps pixel of the input
+    (measured before the tilt and skew of the sensor, exact for the usual models)
+    P: None returns normalized coordinates, otherwise the new camera matrix (3x3 or 3x4) for pixel output
+    eps: default 1e-8 for float64, 1e-3 for float32
+    return undistorted (...,2)[, converged (...) bool]
+    '''
+    pts = np.asarray(pts, dtype)
+    shape = pts.shape[:-1]
+    pts = pts.reshape(-1, 2)
+    eps = (1e-3 if pts.dtype == np.float32 else 1e-8) if eps is None else eps
+    k1, k2, p1, p2, k3, k4, k5, k6, s1, s2, s3, s4, tau_x, tau_y = pad_dist(dist).astype(pts.dtype)
+    fx, fy = np.asarray(mtx, np.float64)[[0, 1], [0, 1]].astype(pts.dtype)
+    x0, y0 = pixel_to_normalized(pts, mtx, pts.dtype)
+    if tau_x != 0 or tau_y != 0:
+        # 先去掉传感器倾斜
+        T = np.linalg.inv(tilt_matrix(tau_x, tau_y)).astype(pts.dtype)
+        w = T[2, 0]*x0 + T[2, 1]*y0 + T[2, 2]
+        x0, y0 = (T[0, 0]*x0 + T[0, 1]*y0 + T[0, 2])/w, (T[1, 0]*x0 + T[1, 1]*y0 + T[1, 2])/w
+    x, y = x0.copy(), y0.copy()
+    converged = np.zeros(len(pts), bool)
+    rational = k4 != 0 or k5 != 0 or k6 != 0
+    prism = s1 != 0 or s2 != 0 or s3 != 0 or s4 != 0
+    # 只迭代尚未收敛的点，剩余不到 3/4 时才压缩数组，避免每次迭代都复制
+    active = np.arange(len(pts))
+    xa, ya, x0a, y0a = x0, y0, x0, y0
+    for it in range(max_iter+1):
+        r2 = xa*xa + ya*ya
+        ratio = 1 + r2*(k1 + r2*(k2 + r2*k3))
+        if rational:
+            ratio /= 1 + r2*(k4 + r2*(k5 + r2*k6))
+        xy2 = 2*xa*ya
+        dx = p1*xy2 + p2*(r2 + 2*xa*xa)
+        dy = p1*(r2 + 2*ya*ya) + p2*xy2
+        if prism:
+            dx += r2*(s1 + s2*r2)
+            dy += r2*(s3 + s4*r2)
+        # 当前解重新加畸变后与输入的差(像素)，畸变比例为负的点已发散
+        ex, ey = fx*(xa*ratio + dx - x0a), fy*(ya*ratio + dy - y0a)
+        done = (ex*ex + ey*ey < eps*eps) & (ratio > 0)
+        x[active[done]], y[active[done]] = xa[done], ya[done]
+        converged[active[done]] = True
+        if it == max_iter:
+            break
+        keep = ~done & (ratio > 0)
+        if not keep.any():
+            break
+        xa, ya = (x0a - dx)/ratio, (y0a - dy)/ratio
+        if keep.sum() < len(keep)*3//4:
+            active, xa, ya, x0a, y0a = active[keep], xa[keep], ya[keep], x0a[keep], y0a[keep]
+    # 未收敛的点取最后一次迭代的结果，发散的点保持初值
+    rest = ~converged[active] & (ratio > 0)
+    x[active[rest]], y[active[rest]] = xa[rest], ya[rest]
+    if P is None:
+        out = np.stack((x, y), axis=-1)
+    else:
+        out = normalized_to_pixel(x, y, np.asarray(P, np.float64)[:3, :3])
+    out = out.reshape(shape + (2,))
+    if return_converged is True:
+        return out, converged.reshape(shape)
+    return out
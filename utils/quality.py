@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+
+# 曝光(灰度分位数)、对比度(99%-1%分位数)、清晰度(拉普拉斯方差)不合格时拒绝;
+# 是否有标定板由 board_visible 单独判断，只作参考，不拒绝
+class QualityScreen():
+    '''
+    cheap pre-screen on a downscaled gray image before corner detection
+    '''
+
+    def __init__(self, pattern_size: tuple = None, max_side: int = 640, min_sharpness: float = 5.0,
+                 max_dark_level: int = 200, min_bright_level: int = 40, min_contrast: int = 30,
+                 min_square_px: int = 6, min_board_fraction: float = 0.1):
+        # 内角点数 (row, col)，None 时跳过标定板检查(如 charuco)
+        self.pattern_size = pattern_size
+        # 标定板检查的缩放: 标定板至少占长边的 min_board_fraction 时，缩小后每个方格仍有 min_square_px 像素
+        self.min_square_px = min_square_px
+        self.min_board_fraction = min_board_fraction
+        self.max_side = max_side
+        self.min_sharpness = min_sharpness
+        # 5% 分位灰度高于该值说明几乎没有暗像素(黑格)
+        self.max_dark_level = max_dark_level
+        # 99% 分位灰度低于该值说明几乎没有亮像素(白格)
+        self.min_bright_level = min_bright_level
+        self.min_contrast = min_contrast
+
+    def signature(self):
+        return f'{self.max_side}|{self.min_sharpness}|{self.max_dark_level}|{self.min_bright_level}|{self.min_contrast}'
+
+    def _downscale(self, gray, max_side: int = None):
+        scale = (max_side or self.max_side)/max(gray.shape[:2])
+        if scale >= 1.0:
+            return gray
+        return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # 返回 (sharpness, p1, p5, p99)
+    def score(self, gray):
+        small = self._downscale(gray)
+        sharpness = float(cv2.Laplacian(small, cv2.CV_32F).var())
+        p1, p5, p99 = np.percentile(small, (1, 5, 99))
+        return sharpness, float(p1), float(p5), float(p99)
+
+    # 返回 (ok, reason)，ok 为 False 时 reason 为拒绝原因
+    def check(self, gray):
+        small = self._downscale(gray)
+        p1, p5, p99 = np.percentile(small, (1, 5, 99))
+        if p5 >= self.max_dark_level:
+            return False, 'overexposed'
+        if p99 <= self.min_bright_level:
+            return False, 'underexposed'
+        if p99 - p1 < self.min_contrast:
+            return False, 'low contrast'
+        if cv2.Laplacian(small, cv2.CV_32F).var() < self.min_sharpness:
+            return False, 'blurry'
+        return True, None
+
+    # 缩小图上能否看到标定板，只作参考: 高分辨率图中较小的标定板可能检测不到，不能据此拒绝
+    # 返回 None 表示没有做检查
+    def board_visible(self, gray):
+        if self.pattern_size is None:
+            return None
+        squares = max(self.pattern_size) + 1
+        side = max(self.max_side, int(np.ceil(self.min_square_px*squares/self.min_board_fraction)))
+        return bool(cv2.checkChessboard(self._downscale(gray, side), self.pattern_size))
@@ -0,0 +1,211 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from loguru import logger
+from utils.calib import load_camera_param
+
+# 默认缓存目录，与角点缓存放在一起
+DEFAULT_MAP_DIR = os.path.join(
+    os.path.expanduser('~'), '.calibrationtool', 'maps')
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+# 映射使用定点格式 CV_16SC2 + CV_16UC1 (每像素6字节)，key 为参数文件内容哈希 + 类型/尺寸/alpha
+class RectifyMapService():
+    '''
+    undistort / rectify maps for saved parameter files
+    '''
+
+    def __init__(self, cache_dir: str = DEFAULT_MAP_DIR, max_workers: int = None, memory_entries: int = 4,
+                 use_disk_cache: bool = False, max_disk_bytes: int = 512*1024*1024):
+        # 磁盘缓存默认关闭，目录在第一次写入时创建; 超出 max_disk_bytes 时删除最久未使用的映射
+        self.cache_dir = cache_dir
+        self.use_disk_cache = use_disk_cache
+        self.max_disk_bytes = max_disk_bytes
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # 进程内最近使用的 memory_entries 组映射，参数文件不变时直接复用
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(param_path: str, kind: str, size, alpha) -> str:
+        with open(param_path, 'rb') as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        return hashlib.sha1(f'{content_hash}|{kind}|{size}|{alpha}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npz')
+
+    def _load(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.use_disk_cache is not True:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                entry = {k: data[k] for k in data.files}
+        except Exception as e:
+            # 缓存文件损坏时当作未命中，后续会被覆盖
+            logger.debug(f'map cache entry {path} is broken: {e}')
+            return None
+        # 修改时间作为最近使用时间，淘汰时保留常用的映射
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, entry)
+        return entry
+
+    def _save(self, key: str, entry: dict):
+        self._remember(key, entry)
+        if self.use_disk_cache is not True:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 多个进程同时写入，先写临时文件再原子替换
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **entry)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f'failed to write map cache {path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict()
+
+    def _cache_files(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for f in names:
+                if f.endswith('.npz'):
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    # 磁盘缓存超过 max_disk_bytes 时从最久未使用的文件开始删除
+    def _evict(self):
+        files = self._cache_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                logger.debug(f'failed to evict map cache {path}: {e}')
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    @staticmethod
+    def _image_size(param_path: str, size):
+        if size is not None:
+            return tuple(int(s) for s in size)
+        _, _, w, h = load_camera_param(param_path, need_size=True)
+        if w is None or h is None:
+            raise ValueError(f'{param_path} has no ImageShape, pass size=(w, h)')
+        return int(w), int(h)
+
+    # 单目去畸变映射，返回 (map1, map2, newK)
+    # alpha 为 None 时保持原内参，否则按 getOptimalNewCameraMatrix 的 alpha 缩放视野
+    def undistort_maps(self, param_path: str, size=None, alpha: float = None, camera_id: bool = False):
+        size = self._image_size(param_path, size)
+        key = self.make_key(param_path, f'undistort{int(camera_id)}', size, alpha)
+        entry = self._load(key)
+        if entry is None:
+            mtx, dist = load_camera_param(param_path, camera_id=camera_id)
+            newK = mtx if alpha is None else cv2.getOptimalNewCameraMatrix(mtx, dist, size, alpha, size)[0]
+            map1, map2 = cv2.initUndistortRectifyMap(mtx, dist, None, newK, size, cv2.CV_16SC2)
+            entry = dict(map1=map1, map2=map2, newK=newK)
+            self._save(key, entry)
+        return entry['map1'], entry['map2'], entry['newK']
+
+    # 双目极线校正映射，返回 ((map1_l, map2_l), (map1_r, map2_r), {'R1','R2','P1','P2','Q'})
+    def rectify_maps(self, param_path: str, size=None, alpha: float = -1):
+        size = self._image_size(param_path, size)
+        key = self.make_key(param_path, 'rectify', size, alpha)
+        entry = self._load(key)
+        if entry is None:
+            mtx_l, dist_l = load_camera_param(param_path)
+            mtx_r, dist_r, R, T = load_camera_param(param_path, camera_id=True, need_rt=True)
+            R1, R2, P1, P2, Q, _, _ = cv2.stereoRectify(
+                mtx_l, dist_l, mtx_r, dist_r, size, np.asarray(R, np.float64), np.asarray(T, np.float64).reshape(3, 1),
+                alpha=alpha)
+            map1_l, map2_l = cv2.initUndistortRectifyMap(mtx_l, dist_l, R1, P1, size, cv2.CV_16SC2)
+            map1_r, map2_r = cv2.initUndistortRectifyMap(mtx_r, dist_r, R2, P2, size, cv2.CV_16SC2)
+            entry = dict(map1_l=map1_l, map2_l=map2_l, map1_r=map1_r, map2_r=map2_r,
+                         R1=R1, R2=R2, P1=P1, P2=P2, Q=Q)
+            self._save(key, entry)
+        return ((entry['map1_l'], entry['map2_l']), (entry['map1_r'], entry['map2_r']),
+                {k: entry[k] for k in ('R1', 'R2', 'P1', 'P2', 'Q')})
+
+    # 对 (src, dst, maps) 列表逐张 remap，多线程执行(imread/remap/imwrite 均释放 GIL)，返回写入成功的 dst
+    def _remap_files(self, jobs: list, interpolation: int):
+        def run(job):
+            src, dst, (map1, map2) = job
+            img = cv2.imread(src, cv2.IMREAD_UNCHANGED)
+            if img is None:
+                logger.debug(f'failed to read {src}')
+                return None
+            os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+            if not cv2.imwrite(dst, cv2.remap(img, map1, map2, interpolation)):
+                logger.debug(f'failed to write {dst}')
+                return None
+            return dst
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return [dst for dst in executor.map(run, jobs) if dst is not None]
+
+    @staticmethod
+    def _list_images(folder: str, files: list = None):
+        if files is not None:
+            return list(files)
+        return sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTS))
+
+    # 去畸变整个目录，输出同名文件到 dst_dir
+    def undistort_folder(self, param_path: str, src_dir: str, dst_dir: str, files: list = None, size=None,
+                         alpha: float = None, camera_id: bool = False, interpolation: int = cv2.INTER_LINEAR):
+        map1, map2, _ = self.undistort_maps(param_path, size, alpha, camera_id)
+        jobs = [(os.path.join(src_dir, f), os.path.join(dst_dir, f), (map1, map2))
+                for f in self._list_images(src_dir, files)]
+        return self._remap_files(jobs, interpolation)
+
+    # 极线校正左右目录，输出同名文件; files 给定时左右目录使用相同的文件名
+    def rectify_folders(self, param_path: str, left_dir: str, right_dir: str, dst_left: str, dst_right: str,
+                        files: list = None, size=None, alpha: float = -1, interpolation: int = cv2.INTER_LINEAR):
+        maps_l, maps_r, _ = self.rectify_maps(param_path, size, alpha)
+        jobs = [(os.path.join(left_dir, f), os.path.join(dst_left, f), maps_l)
+                for f in self._list_images(left_dir, files)]
+        jobs += [(os.path.join(right_dir, f), os.path.join(dst_right, f), maps_r)
+                 for f in self._list_images(right_dir, files)]
+        return self._remap_files(jobs, interpolation)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for _, _, path in self._cache_files():
+            os.remove(path)
+
+
+# 进程内共享，参数文件不变时各处复用同一组映射; 只缓存在内存中，需要磁盘缓存时设置 use_disk_cache
+SHARED_MAPS = RectifyMapService()